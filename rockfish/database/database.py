@@ -111,6 +111,49 @@ class RockfishDatabaseConnection(sqlite3.Connection):
             # add a new row
             self.insert(table, **kwargs)
 
+    def _insertupdate_many(self, table, rows):
+        """
+        Update or add many rows in a table.
+
+        Same as calling :meth:`_insertupdate` for each row, but the table
+        fields are only looked up once and rows are written with
+        ``executemany``.
+
+        :param table: Name of table to update data in.
+        :type table: ``str``
+        :param rows: ``list`` of ``dict`` with field values for each row.
+            All rows must have the same fields.
+        """
+        if len(rows) == 0:
+            return
+        table_fields = self._get_fields(table)
+        primary_fields = self._get_primary_fields(table)
+        fields = [k for k in rows[0] if k in table_fields]
+        pfields = [k for k in fields if k in primary_fields]
+        values = [tuple([row[k] for k in fields]) for row in rows]
+        if len(pfields) > 0:
+            keys = [tuple([row[k] for k in pfields]) for row in rows]
+            # update existing rows
+            sql = 'UPDATE %s SET ' % table
+            sql += ', '.join(['%s=?' % k for k in fields])
+            sql += ' WHERE ' + ' and '.join(['%s=?' % k for k in pfields])
+            logging.debug("calling: self.executemany('%s', ...)" % sql)
+            self.executemany(sql, [v + k for v, k in zip(values, keys)])
+            # only add rows with new primary keys, keeping the last row
+            # for keys that are repeated
+            sql = 'SELECT DISTINCT %s FROM %s' % (', '.join(pfields), table)
+            existing = set([tuple(r) for r in self.execute(sql)])
+            new = {}
+            for k, v in zip(keys, values):
+                if k not in existing:
+                    new[k] = v
+            values = [new.pop(k) for k in keys if k in new]
+        # add rows that do not already exist
+        sql = 'INSERT INTO %s (%s)' % (table, ', '.join(fields))
+        sql += ' VALUES (%s)' % ', '.join(['?' for k in fields])
+        logging.debug("calling: self.executemany('%s', ...)" % sql)
+        self.executemany(sql, values)
+
     def _count(self, table, **kwargs):
         """
         Get the number of rows in a table.
@@ -204,7 +247,7 @@ class RockfishDatabaseConnection(sqlite3.Connection):
         """
         primary_fields = []
         for row in self._get_pragma(table):
-            if row[5] == 1:
+            if row[5] > 0:
                 primary_fields.append(str(row[1]))
         logging.debug('found primary fields: ' + str(primary_fields))
         return primary_fields
@@ -24,6 +24,16 @@ else:
     BYTEORDER = '>'
 
 
+def numpy_byteorder(endian):
+    """
+    Convert a ``struct`` byte order character to a ``numpy`` one.
+
+    ``numpy`` does not accept the ``struct`` characters ``'@'`` (native)
+    and ``'!'`` (network), which are mapped to ``'='`` and ``'>'``.
+    """
+    return {'@': '=', '!': '>'}.get(endian, endian)
+
+
 class WrongDtypeException(Exception):
     pass
 
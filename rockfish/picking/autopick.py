@@ -0,0 +1,175 @@
+"""
+Automatic picking of first arrivals.
+"""
+import numpy as np
+from rockfish.picking.database import PickDatabaseConnection, trace2pick
+from rockfish.segy.segy import readSEGY
+
+CHARACTERISTIC_FUNCTIONS = ['sta_lta', 'energy_ratio']
+
+def _cumulative_energy(data):
+    """
+    Cumulative sum of squared amplitudes along rows with a leading column of
+    zeros, such that the energy in ``data[:, i0:i1]`` is
+    ``cs[:, i1] - cs[:, i0]``.
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    cs = np.zeros((data.shape[0], data.shape[1] + 1))
+    np.cumsum(data ** 2, axis=1, out=cs[:, 1:])
+    return cs
+
+def sta_lta(data, nsta, nlta):
+    """
+    Compute the ratio of short-term to long-term average energy.
+
+    Averages are computed in windows that end at each sample.  Samples
+    before the end of the first long-term window are set to zero.
+
+    :param data: ``numpy.ndarray`` with shape ``(ntraces, nsamples)``.
+    :param nsta: Length of the short-term window in samples.
+    :param nlta: Length of the long-term window in samples.
+    :returns: ``numpy.ndarray`` with the same shape as ``data``.
+    """
+    cs = _cumulative_energy(data)
+    cf = np.zeros((cs.shape[0], cs.shape[1] - 1))
+    i = np.arange(nlta, cs.shape[1])
+    sta = (cs[:, i] - cs[:, i - nsta]) / nsta
+    lta = (cs[:, i] - cs[:, i - nlta]) / nlta
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cf[:, nlta - 1:] = np.where(lta > 0, sta / lta, 0.)
+    return cf
+
+def energy_ratio(data, n):
+    """
+    Compute the ratio of energy after each sample to energy before it.
+
+    Samples without a full window on both sides are set to zero.
+
+    :param data: ``numpy.ndarray`` with shape ``(ntraces, nsamples)``.
+    :param n: Length of the windows in samples.
+    :returns: ``numpy.ndarray`` with the same shape as ``data``.
+    """
+    cs = _cumulative_energy(data)
+    cf = np.zeros((cs.shape[0], cs.shape[1] - 1))
+    i = np.arange(n, cs.shape[1] - n)
+    after = cs[:, i + n] - cs[:, i]
+    before = cs[:, i] - cs[:, i - n]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cf[:, i] = np.where(before > 0, after / before, 0.)
+    return cf
+
+def pick_first_breaks(cf, threshold=None, window=None):
+    """
+    Pick first breaks on characteristic functions.
+
+    :param cf: ``numpy.ndarray`` with shape ``(ntraces, nsamples)`` of
+        characteristic function values, e.g., from :func:`sta_lta`.
+    :param threshold: Optional. Pick the first sample where ``cf`` reaches
+        this value.  Default is to pick the maximum of ``cf``.
+    :param window: Optional. ``(i0, i1)`` sample indices of the window to
+        pick in.  ``i0`` and ``i1`` can be scalars or have a value for each
+        trace.  Default is to pick in the entire trace.
+    :returns: ``numpy.ndarray`` of sample indices for each trace, with
+        ``-1`` for traces without a pick.
+    """
+    cf = np.atleast_2d(cf)
+    if window is not None:
+        i = np.arange(cf.shape[1])[np.newaxis, :]
+        i0 = np.atleast_1d(window[0])[:, np.newaxis]
+        i1 = np.atleast_1d(window[1])[:, np.newaxis]
+        cf = np.where((i >= i0) & (i < i1), cf, 0.)
+    if threshold is None:
+        idx = cf.argmax(axis=1)
+        found = cf.max(axis=1) > 0
+    else:
+        above = cf >= threshold
+        idx = above.argmax(axis=1)
+        found = above.any(axis=1)
+    return np.where(found, idx, -1)
+
+def autopick(segy, pickdb, event, method='sta_lta', sta=0.05, lta=0.5,
+             threshold=None, guide_velocity=None, guide_intercept=0.,
+             guide_window=(-0.25, 0.5), error=0., branch=0, subbranch=0):
+    """
+    Pick first arrivals on all traces in a SEG-Y file.
+
+    Picks are written to the pick database in a single transaction.
+
+    :param segy: :class:`rockfish.segy.segy.SEGYFile` instance or filename
+        of a SEG-Y file.
+    :param pickdb: Open
+        :class:`rockfish.picking.database.PickDatabaseConnection` or
+        filename of a database to add picks to.
+    :param event: Event name to assign to the picks.
+    :param method: Optional. Characteristic function to pick on. Options
+        are 'sta_lta' (default) or 'energy_ratio'.
+    :param sta: Optional. Length of the short-term window, or of the
+        energy-ratio windows, in seconds.  Default is 0.05.
+    :param lta: Optional. Length of the long-term window in seconds.
+        Default is 0.5.
+    :param threshold: Optional. Pick the first sample where the
+        characteristic function reaches this value.  Default is to pick the
+        maximum of the characteristic function.
+    :param guide_velocity: Optional. Velocity in km/s of a guide time,
+        ``t = abs(offset)/guide_velocity + guide_intercept``, to pick
+        around.  Default is to pick in the entire trace.
+    :param guide_intercept: Optional. Intercept time in seconds of the guide
+        time. Default is 0.
+    :param guide_window: Optional. ``(t0, t1)`` times in seconds, relative to
+        the guide time, of the window to pick in. Default is (-0.25, 0.5).
+    :param error: Optional. Pick error to assign to all picks. Default is 0.
+    :param branch: Optional. Branch number for the event. Default is 0.
+    :param subbranch: Optional. Subbranch number for the event. Default is
+        0.
+    :returns: :class:`rockfish.picking.database.PickDatabaseConnection`
+    """
+    if method not in CHARACTERISTIC_FUNCTIONS:
+        msg = "Unknown value method='{:}'. Options are: {:}"\
+                .format(method, CHARACTERISTIC_FUNCTIONS)
+        raise ValueError(msg)
+    if type(pickdb) is str:
+        pickdb = PickDatabaseConnection(pickdb)
+    if type(segy) is str:
+        segy = readSEGY(segy)
+    traces = segy.traces
+    # collect data and timing
+    npts = np.array([len(tr.data) for tr in traces])
+    data = np.zeros((len(traces), npts.max()))
+    for i, tr in enumerate(traces):
+        data[i, :npts[i]] = tr.data
+    dt = np.array([tr.header.sample_interval_in_ms_for_this_trace
+                   for tr in traces]) / 1.e6
+    t0 = np.array([tr.header.delay_recording_time_in_ms
+                   for tr in traces]) / 1.e3
+    # compute characteristic function
+    nsta = max(1, int(round(sta / dt[0])))
+    if method == 'sta_lta':
+        cf = sta_lta(data, nsta, max(nsta, int(round(lta / dt[0]))))
+    else:
+        cf = energy_ratio(data, nsta)
+    # pick
+    if guide_velocity is not None:
+        x_km = np.array([tr.header.source_receiver_offset_in_m
+                         for tr in traces]) * 0.001
+        tguide = np.abs(x_km) / guide_velocity + guide_intercept
+        i0 = np.round((tguide + guide_window[0] - t0) / dt).astype(int)
+        i1 = np.round((tguide + guide_window[1] - t0) / dt).astype(int)
+        window = (i0, np.minimum(i1, npts))
+    else:
+        window = (0, npts)
+    idx = pick_first_breaks(cf, threshold=threshold, window=window)
+    # write picks
+    picks = []
+    method = 'autopick({:})'.format(method)
+    for i in np.nonzero(idx >= 0)[0]:
+        pick = trace2pick(traces[i], int(i), segy.file.name)
+        pick.update({'event': event,
+                     'branch': branch,
+                     'subbranch': subbranch,
+                     'time': float(t0[i] + idx[i] * dt[i]),
+                     'error': error,
+                     'method': method})
+        picks.append(pick)
+    pickdb.update_picks(picks)
+    pickdb.commit()
+    return pickdb
@@ -267,6 +267,21 @@ class PickDatabaseConnection(RockfishDatabaseConnection):
             logging.debug('Adding ' + str(values) + " to table '%s'" % table)
             self._insertupdate(table, **values)
 
+    def update_picks(self, picks):
+        """
+        Update many picks in the database, or add them if they do not
+        already exist.
+
+        Same as calling :meth:`update_pick` for each pick, but each table is
+        written with a single ``executemany`` call.
+
+        :param picks: ``list`` of ``dict`` with keyword=value arguments for
+            fields in the ``picks`` table. All picks must have the same
+            fields.
+        """
+        for table in [self.PICK_TABLE, self.EVENT_TABLE, self.TRACE_TABLE]:
+            self._insertupdate_many(table, picks)
+
     def write_vmtomo(self, instfile='inst.dat', pickfile='picks.dat',
                      shotfile='shots.dat', directory='.', step=1, **kwargs):
         """
@@ -521,22 +536,11 @@ def segy2db(segy, pickdb, events, branches=None, subbranch=None,
     if type(segy) is str:
         segy = readSEGY(segy)
     for i, tr in enumerate(segy.traces):
-        d = {'ensemble': tr.header.ensemble_number,
-             'trace' : tr.header.trace_number_within_the_ensemble,
-             'trace_in_file' : i,
-             'time' : 1e30,
-             'time_reduced' : 1e30,
-             'error': 0,
-             'source_x': tr.header.scaled_source_coordinate_x,
-             'source_y': tr.header.scaled_source_coordinate_y,
-             'source_z': - tr.header.scaled_source_depth_below_surface,
-             'receiver_x': tr.header.scaled_group_coordinate_x,
-             'receiver_y': tr.header.scaled_group_coordinate_y,
-             'receiver_z': tr.header.scaled_receiver_group_elevation,
-             'offset': tr.header.source_receiver_offset_in_m,
-             'faz': tr.header.computed_azimuth_in_deg,
-             'data_file' : segy.file.name,
-             'method': 'segy2db()'}
+        d = trace2pick(tr, i, segy.file.name)
+        d.update({'time' : 1e30,
+                  'time_reduced' : 1e30,
+                  'error': 0,
+                  'method': 'segy2db()'})
         if constant_values is not None:
             for k in constant_values:
                 d[k] = constant_values[k]
@@ -553,3 +557,25 @@ def segy2db(segy, pickdb, events, branches=None, subbranch=None,
             pickdb.update_pick(**d)
     pickdb.commit()
     return pickdb
+
+def trace2pick(tr, trace_in_file, data_file):
+    """
+    Get pick database fields from a SEG-Y trace header.
+
+    :param tr: :class:`rockfish.segy.segy.SEGYTrace` instance.
+    :param trace_in_file: Index of the trace in the SEG-Y file.
+    :param data_file: Filename of the SEG-Y file.
+    :returns: ``dict`` of values for fields in the ``traces`` table.
+    """
+    return {'ensemble': tr.header.ensemble_number,
+            'trace' : tr.header.trace_number_within_the_ensemble,
+            'trace_in_file' : trace_in_file,
+            'source_x': tr.header.scaled_source_coordinate_x,
+            'source_y': tr.header.scaled_source_coordinate_y,
+            'source_z': - tr.header.scaled_source_depth_below_surface,
+            'receiver_x': tr.header.scaled_group_coordinate_x,
+            'receiver_y': tr.header.scaled_group_coordinate_y,
+            'receiver_z': tr.header.scaled_receiver_group_elevation,
+            'offset': tr.header.source_receiver_offset_in_m,
+            'faz': tr.header.computed_azimuth_in_deg,
+            'data_file' : data_file}
@@ -0,0 +1,186 @@
+"""
+Refinement of picks by cross-correlation.
+"""
+import numpy as np
+from scipy import ndimage
+from rockfish.picking.database import PickDatabaseConnection
+from rockfish.segy.segy import readSEGY
+
+def extract_windows(data, idx, n0, n1):
+    """
+    Extract a window of data around a sample in each trace.
+
+    :param data: ``numpy.ndarray`` with shape ``(ntraces, nsamples)``.
+    :param idx: Index of the sample in each trace to extract a window
+        around.
+    :param n0: Index of the first sample in the window relative to ``idx``.
+    :param n1: Index of the sample after the end of the window relative to
+        ``idx``.
+    :returns: ``numpy.ndarray`` with shape ``(ntraces, n1 - n0)``. Samples
+        outside of the data are set to zero.
+    """
+    data = np.atleast_2d(data)
+    j = np.asarray(idx)[:, np.newaxis] + np.arange(n0, n1)[np.newaxis, :]
+    valid = (j >= 0) & (j < data.shape[1])
+    rows = np.arange(data.shape[0])[:, np.newaxis]
+    return np.where(valid, data[rows, np.clip(j, 0, data.shape[1] - 1)], 0.)
+
+def xcorr_lags(windows, pilots, max_lag):
+    """
+    Find the lag of each window relative to a pilot trace.
+
+    Cross-correlations are computed for all windows at once with FFTs.
+    Lags are refined to a fraction of a sample by fitting a parabola to the
+    correlation peak.
+
+    :param windows: ``numpy.ndarray`` with shape ``(ntraces, nwindow)``.
+    :param pilots: Pilot trace with length ``nwindow``, or an array with a
+        pilot trace for each window.
+    :param max_lag: Maximum lag to search, in samples.
+    :returns: ``(lags, coefficients)`` arrays with the lag, in samples, and
+        normalized correlation coefficient for each window.  A positive lag
+        means that the window is delayed relative to the pilot.
+    """
+    windows = np.atleast_2d(windows)
+    nwin = windows.shape[1]
+    nfft = 2 ** int(np.ceil(np.log2(2 * nwin)))
+    cc = np.fft.irfft(np.fft.rfft(windows, nfft, axis=-1)
+                      * np.conj(np.fft.rfft(pilots, nfft, axis=-1)),
+                      nfft, axis=-1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    cc = cc[:, lags % nfft]
+    norm = np.sqrt(np.sum(windows ** 2, axis=-1)
+                   * np.sum(np.atleast_2d(pilots) ** 2, axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cc = np.where(norm[:, np.newaxis] > 0, cc / norm[:, np.newaxis], 0.)
+    rows = np.arange(cc.shape[0])
+    k = cc.argmax(axis=1)
+    coef = cc[rows, k]
+    # parabolic interpolation of the peak
+    y0 = cc[rows, np.maximum(k - 1, 0)]
+    y2 = cc[rows, np.minimum(k + 1, len(lags) - 1)]
+    denom = y0 - 2 * coef + y2
+    interior = (k > 0) & (k < len(lags) - 1) & (denom < 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(interior, 0.5 * (y0 - y2) / denom, 0.)
+    return lags[k] + frac, coef
+
+def xcorr_refine(data, idx, n0, n1, max_lag, nstack=None, niter=2):
+    """
+    Refine sample indices by cross-correlating with a stacked pilot trace.
+
+    Windows are normalized by their RMS amplitude and stacked to build the
+    pilot.  Windows are realigned and restacked for each iteration.
+
+    :param data: ``numpy.ndarray`` with shape ``(ntraces, nsamples)``.
+    :param idx: Index of the initial pick in each trace.
+    :param n0: Index of the first sample in the window relative to ``idx``.
+    :param n1: Index of the sample after the end of the window relative to
+        ``idx``.
+    :param max_lag: Maximum total shift of the picks, in samples.
+    :param nstack: Optional. Number of neighbouring traces to stack for the
+        pilot trace of each trace after the first iteration, which always
+        uses a single stack of all traces.  Default is to stack all traces
+        into a single pilot trace for every iteration.
+    :param niter: Optional. Number of times to realign and restack. Default
+        is 2.
+    :returns: ``(shifts, coefficients)`` arrays with the shift, in samples,
+        to add to each pick and the correlation coefficient with the final
+        pilot trace.
+    """
+    idx = np.asarray(idx, dtype=int)
+    shifts = np.zeros(len(idx))
+    for i in range(niter):
+        windows = extract_windows(data, idx + np.round(shifts).astype(int),
+                                  n0, n1)
+        rms = np.sqrt(np.mean(windows ** 2, axis=1))
+        rms[rms == 0] = 1.
+        windows /= rms[:, np.newaxis]
+        if (nstack is None) or (i == 0):
+            pilots = windows.mean(axis=0)
+        else:
+            pilots = ndimage.uniform_filter1d(windows, nstack, axis=0,
+                                              mode='nearest')
+        lags, coef = xcorr_lags(windows, pilots, max_lag)
+        shifts = np.clip(np.round(shifts) + lags, -max_lag, max_lag)
+    return shifts, coef
+
+def refine_picks(segy, pickdb, event, window=(-0.1, 0.2), max_shift=0.05,
+                 nstack=None, niter=2, min_correlation=None):
+    """
+    Refine picks for an event by cross-correlation with a stacked pilot.
+
+    Refined times and correlation coefficients are written to the ``time``
+    and ``correlation`` fields of the pick database in a single transaction.
+
+    :param segy: :class:`rockfish.segy.segy.SEGYFile` instance or filename
+        of a SEG-Y file.
+    :param pickdb: Open
+        :class:`rockfish.picking.database.PickDatabaseConnection` or
+        filename of a database with picks.
+    :param event: Name of the event to refine picks for.
+    :param window: Optional. ``(t0, t1)`` times, in seconds relative to the
+        picks, of the window to cross-correlate. Default is (-0.1, 0.2).
+    :param max_shift: Optional. Maximum change in pick times in seconds.
+        Default is 0.05.
+    :param nstack: Optional. Number of neighbouring traces to stack for the
+        pilot trace of each trace after the first iteration.  Default is to
+        stack all picked traces.
+    :param niter: Optional. Number of times to realign and restack. Default
+        is 2.
+    :param min_correlation: Optional. Only update picks with a correlation
+        coefficient of at least this value.  Default is to update all picks.
+    :returns: :class:`rockfish.picking.database.PickDatabaseConnection`
+    """
+    if type(pickdb) is str:
+        pickdb = PickDatabaseConnection(pickdb)
+    if type(segy) is str:
+        segy = readSEGY(segy)
+    # match picks to traces
+    itrace = dict([((tr.header.ensemble_number,
+                     tr.header.trace_number_within_the_ensemble), i)
+                   for i, tr in enumerate(segy.traces)])
+    picks = []
+    for row in pickdb.get_picks(event=event):
+        key = (row['ensemble'], row['trace'])
+        if key in itrace:
+            picks.append((itrace[key], row))
+    if len(picks) == 0:
+        return pickdb
+    picks.sort(key=lambda p: p[0])
+    traces = [segy.traces[i] for i, row in picks]
+    # collect data and pick indices
+    npts = np.array([len(tr.data) for tr in traces])
+    data = np.zeros((len(traces), npts.max()))
+    for i, tr in enumerate(traces):
+        data[i, :npts[i]] = tr.data
+    dt = np.array([tr.header.sample_interval_in_ms_for_this_trace
+                   for tr in traces]) / 1.e6
+    t0 = np.array([tr.header.delay_recording_time_in_ms
+                   for tr in traces]) / 1.e3
+    times = np.array([row['time'] for i, row in picks])
+    idx = np.round((times - t0) / dt)
+    picked = (idx >= 0) & (idx < npts)
+    idx = np.where(picked, idx, 0).astype(int)
+    # refine
+    shifts, coef = xcorr_refine(data[picked], idx[picked],
+                                int(round(window[0] / dt[0])),
+                                int(round(window[1] / dt[0])),
+                                int(round(max_shift / dt[0])),
+                                nstack=nstack, niter=niter)
+    # write refined picks
+    pickdb._add_field_if_not_exists(pickdb.PICK_TABLE, 'correlation',
+                                    sql_type='REAL')
+    rows = []
+    for j, i in enumerate(np.nonzero(picked)[0]):
+        if (min_correlation is not None) and (coef[j] < min_correlation):
+            continue
+        row = picks[i][1]
+        rows.append({'event': row['event'],
+                     'ensemble': row['ensemble'],
+                     'trace': row['trace'],
+                     'time': float(times[i] + shifts[j] * dt[i]),
+                     'correlation': float(coef[j])})
+    pickdb.update_picks(rows)
+    pickdb.commit()
+    return pickdb
@@ -0,0 +1,106 @@
+"""
+Test suite for rockfish.picking.autopick
+"""
+import unittest
+import numpy as np
+from rockfish.picking import autopick
+from rockfish.picking.database import PickDatabaseConnection
+from rockfish.segy.segy import readSEGY
+from rockfish.utils.loaders import get_example_file
+
+
+def synthetic_first_breaks(ntrc=20, nsamp=500, onset=None, noise=0.01):
+    """
+    Make traces with low-amplitude noise followed by a sinusoid.
+    """
+    if onset is None:
+        onset = 100 + 10 * np.arange(ntrc)
+    data = noise * np.random.RandomState(0).randn(ntrc, nsamp)
+    i = np.arange(nsamp)[np.newaxis, :]
+    signal = np.sin(2 * np.pi * (i - onset[:, np.newaxis]) / 20.)
+    data += np.where(i >= onset[:, np.newaxis], signal, 0.)
+    return data, onset
+
+
+class autopickTestCase(unittest.TestCase):
+    """
+    Test cases for the autopick module.
+    """
+    def test_sta_lta(self):
+        """
+        Should match a direct calculation of STA/LTA.
+        """
+        data = np.random.randn(3, 100)
+        cf = autopick.sta_lta(data, 5, 20)
+        self.assertEqual(cf.shape, data.shape)
+        for j in [19, 50, 99]:
+            sta = np.mean(data[:, j - 4:j + 1] ** 2, axis=1)
+            lta = np.mean(data[:, j - 19:j + 1] ** 2, axis=1)
+            self.assertTrue(np.allclose(cf[:, j], sta / lta))
+        self.assertTrue(np.all(cf[:, :19] == 0))
+
+    def test_energy_ratio(self):
+        """
+        Should match a direct calculation of the energy ratio.
+        """
+        data = np.random.randn(3, 100)
+        cf = autopick.energy_ratio(data, 10)
+        self.assertEqual(cf.shape, data.shape)
+        for j in [10, 50, 90]:
+            er = np.sum(data[:, j:j + 10] ** 2, axis=1)\
+                    / np.sum(data[:, j - 10:j] ** 2, axis=1)
+            self.assertTrue(np.allclose(cf[:, j], er))
+
+    def test_pick_first_breaks(self):
+        """
+        Should pick the onset of a signal.
+        """
+        data, onset = synthetic_first_breaks()
+        cf = autopick.energy_ratio(data, 10)
+        idx = autopick.pick_first_breaks(cf)
+        self.assertTrue(np.all(np.abs(idx - onset) <= 5))
+        cf = autopick.sta_lta(data, 5, 50)
+        idx = autopick.pick_first_breaks(cf)
+        self.assertTrue(np.all(np.abs(idx - onset) <= 5))
+        # should pick the first sample above a threshold
+        idx = autopick.pick_first_breaks(cf, threshold=5.)
+        self.assertTrue(np.all(np.abs(idx - onset) <= 5))
+        # should only pick inside of a window
+        idx = autopick.pick_first_breaks(cf, window=(onset + 20, onset + 60))
+        self.assertTrue(np.all(idx >= onset + 20))
+        self.assertTrue(np.all(idx < onset + 60))
+        # should return -1 for traces without a pick
+        idx = autopick.pick_first_breaks(cf, threshold=1e30)
+        self.assertTrue(np.all(idx == -1))
+
+    def test_autopick(self):
+        """
+        Should write picks for a SEG-Y file to a database.
+        """
+        segy = readSEGY(get_example_file('ew0210_o30.segy'))
+        segy.traces = segy.traces[0:20]
+        data, onset = synthetic_first_breaks(ntrc=20, nsamp=500)
+        for i, tr in enumerate(segy.traces):
+            tr.data = np.float32(data[i])
+            tr.header.delay_recording_time_in_ms = 0
+            tr.header.sample_interval_in_ms_for_this_trace = 4000
+            tr.header.trace_number_within_the_ensemble = i + 1
+        pickdb = PickDatabaseConnection(':memory:')
+        autopick.autopick(segy, pickdb, 'Pg', sta=0.02, lta=0.2,
+                          threshold=5.)
+        picks = pickdb.get_picks(event='Pg')
+        self.assertEqual(len(picks), 20)
+        for row in picks:
+            i = row['trace_in_file']
+            self.assertTrue(abs(row['time'] - onset[i] * 0.004) <= 0.02)
+            self.assertEqual(row['method'], 'autopick(sta_lta)')
+        # should raise error for an unknown method
+        with self.assertRaises(ValueError):
+            autopick.autopick(segy, pickdb, 'Pg', method='bogus')
+
+
+def suite():
+    return unittest.makeSuite(autopickTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -192,6 +192,37 @@ class PickingTestCase(unittest.TestCase):
         pickdb = PickDatabaseConnection(':memory:')
         self.assertEqual(pickdb.events, [])
 
+    def test_update_picks(self):
+        """
+        Should add or update many picks at once.
+        """
+        db0 = PickDatabaseConnection(':memory:')
+        db1 = PickDatabaseConnection(':memory:')
+        for pick in uniq_picks:
+            db0.update_pick(**pick)
+        db1.update_picks(uniq_picks)
+        self.assertEqual(sorted([tuple(r) for r in db0.get_picks()]),
+                         sorted([tuple(r) for r in db1.get_picks()]))
+        # should update existing picks
+        picks = [dict(p) for p in uniq_picks]
+        for pick in picks:
+            pick['time'] = 1.5
+        db1.update_picks(picks)
+        self.assertEqual(len(db1.get_picks()), len(uniq_picks))
+        for row in db1.get_picks():
+            self.assertEqual(row['time'], 1.5)
+        # should keep the last of repeated picks
+        db1 = PickDatabaseConnection(':memory:')
+        db1.update_picks([picks[0], uniq_picks[0]])
+        self.assertEqual(len(db1.get_picks()), 1)
+        self.assertEqual(db1.get_picks()[0]['time'], uniq_picks[0]['time'])
+        # should raise an error for picks that violate table constraints
+        pick = dict(picks[0])
+        pick['ensemble'] += 1000
+        pick['time'] = None
+        with self.assertRaises(sqlite3.IntegrityError):
+            db1.update_picks([pick])
+
     def test_copy(self):
         """
         Should create a copy of the database.
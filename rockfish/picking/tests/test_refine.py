@@ -0,0 +1,108 @@
+"""
+Test suite for rockfish.picking.refine
+"""
+import unittest
+import numpy as np
+from rockfish.picking import refine
+from rockfish.picking.database import PickDatabaseConnection
+from rockfish.segy.segy import readSEGY
+from rockfish.utils.loaders import get_example_file
+
+
+def synthetic_arrivals(ntrc=30, nsamp=400, noise=0.05):
+    """
+    Make traces with a Ricker wavelet arriving at a different sample on each
+    trace.
+    """
+    onset = 150 + 3 * np.arange(ntrc)
+    i = np.arange(nsamp)[np.newaxis, :] - onset[:, np.newaxis]
+    a = (np.pi * i / 8.) ** 2
+    data = (1 - 2 * a) * np.exp(-a)
+    data += noise * np.random.RandomState(0).randn(ntrc, nsamp)
+    return data, onset
+
+def scattered_picks(onset):
+    """
+    Offset picks by up to 3 samples from the onset.
+    """
+    return onset + np.resize([0, 3, -2, 1, -3, 2, -1], len(onset))
+
+
+class refineTestCase(unittest.TestCase):
+    """
+    Test cases for the refine module.
+    """
+    def test_extract_windows(self):
+        """
+        Should extract windows around samples.
+        """
+        data = np.arange(20.).reshape(2, 10)
+        win = refine.extract_windows(data, [2, 8], -2, 3)
+        self.assertTrue(np.all(win[0] == [0, 1, 2, 3, 4]))
+        # should pad with zeros outside of the data
+        self.assertTrue(np.all(win[1] == [16, 17, 18, 19, 0]))
+
+    def test_xcorr_lags(self):
+        """
+        Should find the lag of a shifted window.
+        """
+        data, onset = synthetic_arrivals(noise=0)
+        pilot = data[0, 100:200]
+        windows = refine.extract_windows(data, onset - onset[0] + 150,
+                                         -50, 50)
+        lags, coef = refine.xcorr_lags(data[:, 100:200], pilot, 20)
+        self.assertTrue(np.allclose(lags[:7], 3 * np.arange(7), atol=0.1))
+        self.assertAlmostEqual(coef[0], 1.)
+        # should find zero lag for aligned windows
+        lags, coef = refine.xcorr_lags(windows, pilot, 20)
+        self.assertTrue(np.allclose(lags, 0, atol=0.1))
+
+    def test_xcorr_refine(self):
+        """
+        Should reduce the scatter of noisy picks.
+        """
+        data, onset = synthetic_arrivals()
+        idx = scattered_picks(onset)
+        for nstack in [None, 7]:
+            shifts, coef = refine.xcorr_refine(data, idx, -20, 30, 10,
+                                               nstack=nstack)
+            err = idx + shifts - onset
+            self.assertTrue(np.std(err) < 0.5)
+            self.assertTrue(np.all(np.abs(shifts) <= 10))
+            self.assertTrue(np.all(coef > 0.8))
+
+    def test_refine_picks(self):
+        """
+        Should write refined picks to the database.
+        """
+        segy = readSEGY(get_example_file('ew0210_o30.segy'))
+        segy.traces = segy.traces[0:30]
+        data, onset = synthetic_arrivals()
+        pickdb = PickDatabaseConnection(':memory:')
+        picks = []
+        idx = scattered_picks(onset)
+        for i, tr in enumerate(segy.traces):
+            tr.data = np.float32(data[i])
+            tr.header.delay_recording_time_in_ms = 0
+            tr.header.sample_interval_in_ms_for_this_trace = 4000
+            tr.header.trace_number_within_the_ensemble = i + 1
+            picks.append({'event': 'Pg', 'ensemble': 1, 'trace': i + 1,
+                          'time': idx[i] * 0.004, 'source_x': 0,
+                          'source_y': 0, 'source_z': 0, 'receiver_x': 0,
+                          'receiver_y': 0, 'receiver_z': 0})
+        pickdb.update_picks(picks)
+        refine.refine_picks(segy, pickdb, 'Pg', window=(-0.08, 0.12),
+                            max_shift=0.04)
+        rows = pickdb.get_picks(event='Pg')
+        self.assertEqual(len(rows), len(picks))
+        err = [row['time'] - onset[row['trace'] - 1] * 0.004 for row in rows]
+        self.assertTrue(np.std(err) < 0.002)
+        for row in rows:
+            self.assertTrue(row['correlation'] > 0.8)
+
+
+def suite():
+    return unittest.makeSuite(refineTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -320,7 +320,13 @@ class SEGYPlotManager(object):
         self.T = self.get_time_array(self.segy.traces[0].header)
         self.XLIMITS = [self.X[0], self.X[-1]]
         self.TLIMITS = [self.T[0], self.T[-1]]
-        self.AMP_MAX = np.max([tr.data for tr in self.segy.traces])
+        stats = None
+        if hasattr(self.segy, 'get_cached_trace_statistics'):
+            stats = self.segy.get_cached_trace_statistics()
+        if stats is not None:
+            self.AMP_MAX = np.max(stats['max'])
+        else:
+            self.AMP_MAX = np.max([tr.data.max() for tr in self.segy.traces])
 
     def _init_interpolators(self):
         """
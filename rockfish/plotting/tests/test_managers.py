@@ -253,6 +253,19 @@ class SEGYPlotManagerTestCase(unittest.TestCase):
         self.assertFalse('foobar' in splt.ACTIVE_LINES)
         self.assertFalse('foobar' in splt.INACTIVE_LINES)
 
+    def test_set_global_ranges(self):
+        """
+        Should compute amplitude ranges from the current trace data.
+        """
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        self.segy.compute_trace_statistics()
+        for tr in self.segy.traces:
+            tr.data = tr.data * 2
+        splt = SEGYPlotManager(ax, self.segy)
+        amp_max = np.max([tr.data.max() for tr in self.segy.traces])
+        self.assertAlmostEqual(splt.AMP_MAX, amp_max, places=5)
+
 
 def suite():
     return unittest.makeSuite(SEGYPlotManagerTestCase, 'test')
@@ -16,6 +16,7 @@ from rockfish.segy.header import ENDIAN, \
 from rockfish.signals import gains
 from rockfish.segy.fft import SEGYFFT
 from rockfish.segy.timeshifts import SEGYTimeshifts
+from rockfish.segy.statistics import SEGYStatistics
 from rockfish.plotting.plotters import SEGYPlotter
 from rockfish.signals.filters import SEGYFilters
 from rockfish.sorting.trace_sorting import SEGYSorting
@@ -42,7 +43,7 @@ class SEGYTraceHeaderDatetimeError(SEGYError):
     pass
 
 class SEGYFile(_SEGYFile, SEGYFilters, SEGYFFT, SEGYTimeshifts, 
-               SEGYSorting):
+               SEGYSorting, SEGYStatistics):
     """
     Class that handles reading, writing, plotting, and processing of SEG-Y data.
 
@@ -0,0 +1,207 @@
+"""
+Amplitude statistics for SEG-Y data.
+"""
+import os
+import weakref
+import numpy as np
+from rockfish.signals.amplitudes import trace_statistics
+
+TRACE_STATISTICS = ['rms', 'peak', 'mean', 'min', 'max', 'snr']
+SIDECAR_EXTENSION = '.stats.npz'
+
+class SEGYStatistics(object):
+    """
+    Functions for computing amplitude statistics of SEG-Y data.
+    """
+    def compute_trace_statistics(self, signal_window=None, noise_window=None,
+                                 sidecar=False, chunk_size=1000, cache=True):
+        """
+        Compute amplitude statistics for every trace in a single pass.
+
+        Statistics are arrays with one value for each trace in
+        ``self.traces``, and are stored in the ``self.trace_stats``
+        dictionary if ``cache`` is ``True``.  See
+        :func:`rockfish.signals.amplitudes.trace_statistics` for the
+        statistics that are computed.
+
+        .. note:: Statistics are not updated when trace data are modified.
+            Cached statistics are ignored by
+            :meth:`get_cached_trace_statistics` once the data array of any
+            trace is replaced (as by filters, gains, and timeshifts) or
+            traces are added, removed, or reordered. Call this method again
+            after modifying data arrays in place.
+
+        :param signal_window: Optional. ``(t0, t1)`` times, in seconds, of
+            the window to compute signal RMS in.  ``t0`` and ``t1`` can be
+            scalars or have a value for each trace.  Default is to use the
+            entire trace.
+        :param noise_window: Optional. ``(t0, t1)`` times, in seconds, of
+            the window to compute the reference RMS in.  Default is to use
+            the entire trace.
+        :param sidecar: Optional. If ``True``, read statistics from, or
+            write them to, a ``.stats.npz`` file next to the SEG-Y file.
+            Statistics are only read if they were computed for the same
+            windows and the SEG-Y file has not been modified since.
+            Default is ``False``.
+        :param chunk_size: Optional. Number of traces to unpack and
+            process at once. Default is 1000.
+        :param cache: Optional. If ``True`` (default), store statistics in
+            ``self.trace_stats``.
+        :returns: ``dict`` of statistics.
+        """
+        filename = self._get_statistics_sidecar_filename() if sidecar\
+                else None
+        if filename is not None:
+            stats = self._read_statistics_sidecar(filename, signal_window,
+                                                  noise_window)
+            if stats is not None:
+                if cache:
+                    self._cache_trace_statistics(stats)
+                return stats
+        ntrc = len(self.traces)
+        stats = dict([(k, np.empty(ntrc)) for k in TRACE_STATISTICS])
+        for i0 in range(0, ntrc, chunk_size):
+            i1 = min(i0 + chunk_size, ntrc)
+            traces = self.traces[i0:i1]
+            data = [tr.data for tr in traces]
+            npts = np.array([len(d) for d in data])
+            if np.all(npts == npts[0]):
+                data = np.vstack(data)
+                npts = None
+            else:
+                _data = np.zeros((len(data), npts.max()))
+                for j, d in enumerate(data):
+                    _data[j, :len(d)] = d
+                data = _data
+            dt = np.array([tr.header.sample_interval_in_ms_for_this_trace
+                           for tr in traces]) / 1.e6
+            t0 = np.array([tr.header.delay_recording_time_in_ms
+                           for tr in traces]) / 1.e3
+            _stats = trace_statistics(
+                data, npts=npts,
+                signal_window=_time2index(signal_window, t0, dt, i0, i1),
+                noise_window=_time2index(noise_window, t0, dt, i0, i1))
+            for k in TRACE_STATISTICS:
+                stats[k][i0:i1] = _stats[k]
+        if cache:
+            self._cache_trace_statistics(stats)
+        if filename is not None:
+            self._write_statistics_sidecar(filename, stats, signal_window,
+                                           noise_window)
+        return stats
+
+    def get_cached_trace_statistics(self):
+        """
+        Returns statistics stored by :meth:`compute_trace_statistics` if
+        they are still valid for the current trace data, or ``None``.
+        """
+        stats = getattr(self, 'trace_stats', None)
+        refs = getattr(self, '_trace_stats_refs', None)
+        if (stats is None) or (refs is None)\
+           or (len(refs) != len(self.traces)):
+            return None
+        for (trace_ref, data_ref), tr in zip(refs, self.traces):
+            if (trace_ref() is not tr) or (not _same_data(data_ref, tr)):
+                # traces were moved, or their data were replaced
+                return None
+        return stats
+
+    def _cache_trace_statistics(self, stats):
+        """
+        Store statistics with weak references to the traces they describe.
+        """
+        refs = [(weakref.ref(tr), _data_ref(tr)) for tr in self.traces]
+        self.trace_stats = stats
+        self._trace_stats_refs = refs
+
+    def _get_statistics_sidecar_filename(self):
+        """
+        Returns the name of the statistics sidecar file, or ``None`` if
+        data were not read from a file on disk.
+        """
+        filename = getattr(self.file, 'name', None)
+        if (filename is None) or (not os.path.isfile(filename)):
+            return None
+        return filename + SIDECAR_EXTENSION
+
+    def _read_statistics_sidecar(self, filename, signal_window,
+                                 noise_window):
+        """
+        Read statistics from a sidecar file if it is up to date.
+        """
+        if not os.path.isfile(filename):
+            return None
+        mtime = os.path.getmtime(self.file.name)
+        with np.load(filename) as npz:
+            if (npz['mtime'] != mtime)\
+               or (len(npz['rms']) != len(self.traces))\
+               or (not _same_window(npz['signal_window'], signal_window))\
+               or (not _same_window(npz['noise_window'], noise_window)):
+                return None
+            return dict([(k, npz[k]) for k in TRACE_STATISTICS])
+
+    def _write_statistics_sidecar(self, filename, stats, signal_window,
+                                  noise_window):
+        """
+        Write statistics to a sidecar file.
+        """
+        kwargs = dict(stats)
+        kwargs['mtime'] = os.path.getmtime(self.file.name)
+        kwargs['signal_window'] = _window2array(signal_window)
+        kwargs['noise_window'] = _window2array(noise_window)
+        with open(filename, 'wb') as f:
+            np.savez(f, **kwargs)
+
+
+def _data_ref(tr):
+    """
+    Returns a weak reference to the data array stored on a trace, or
+    ``None`` if the data are unpacked from the file on the fly.
+    """
+    data = tr.__dict__.get('data')
+    if isinstance(data, np.ndarray):
+        return weakref.ref(data)
+    return None
+
+
+def _same_data(data_ref, tr):
+    """
+    Returns ``True`` if a trace still holds the data referenced by
+    :func:`_data_ref`.
+    """
+    data = tr.__dict__.get('data')
+    if data_ref is None:
+        return data is None
+    return data_ref() is data
+
+
+def _time2index(window, t0, dt, i0, i1):
+    """
+    Convert a window in time to sample indices for traces ``i0:i1``.
+    """
+    if window is None:
+        return None
+    idx = []
+    for t in window:
+        t = np.asarray(t, dtype=float)
+        if t.ndim > 0:
+            t = t[i0:i1]
+        idx.append(np.round((t - t0) / dt).astype(int))
+    return idx
+
+def _window2array(window):
+    """
+    Convert a window to an array for storing in a sidecar file.
+    """
+    if window is None:
+        return np.array([])
+    return np.vstack(np.broadcast_arrays(
+        np.atleast_1d(np.asarray(window[0], dtype=float)),
+        np.atleast_1d(np.asarray(window[1], dtype=float))))
+
+def _same_window(stored, window):
+    """
+    Check if a window matches a window stored in a sidecar file.
+    """
+    window = _window2array(window)
+    return (stored.shape == window.shape) and np.allclose(stored, window)
@@ -2,7 +2,9 @@
 Test suite for rockfish.segy.segy
 """
 
+import os
 import unittest
+import numpy as np
 from rockfish.segy.segy import readSEGY, SEGYFile
 from rockfish.utils.loaders import get_example_file
 
@@ -50,6 +52,76 @@ class SEGYFileTestCase(unittest.TestCase):
         self.assertEqual(tr.header.ensemble_coordinate_y, y)
 
 
+    def test_compute_trace_statistics(self):
+        """
+        Should compute amplitude statistics for every trace.
+        """
+        segy = readSEGY(get_example_file('ew0210_o30.segy'))
+        stats = segy.compute_trace_statistics(chunk_size=100)
+        self.assertEqual(len(stats['rms']), len(segy.traces))
+        for i in [0, 101, len(segy.traces) - 1]:
+            self.assertAlmostEqual(stats['max'][i],
+                                   segy.traces[i].data.max(), 5)
+        self.assertTrue(segy.trace_stats is stats)
+        # cached statistics should only be used for the same data
+        self.assertTrue(segy.get_cached_trace_statistics() is stats)
+        segy.traces[1].data = segy.traces[1].data * 2
+        self.assertEqual(segy.get_cached_trace_statistics(), None)
+        stats = segy.compute_trace_statistics()
+        segy.traces.reverse()
+        self.assertEqual(segy.get_cached_trace_statistics(), None)
+        segy.traces.reverse()
+        # should write and then read statistics from a sidecar file
+        filename = segy.file.name + '.stats.npz'
+        try:
+            stats = segy.compute_trace_statistics(noise_window=(0, 0.5),
+                                                  sidecar=True)
+            self.assertTrue(os.path.isfile(filename))
+            segy.traces[0].data *= 0
+            stats1 = segy.compute_trace_statistics(noise_window=(0, 0.5),
+                                                   sidecar=True)
+            self.assertEqual(stats['rms'][0], stats1['rms'][0])
+            # should not use statistics computed for other windows
+            stats1 = segy.compute_trace_statistics(noise_window=(0, 1.0),
+                                                   sidecar=True)
+            self.assertEqual(stats1['rms'][0], 0)
+        finally:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+
+    def test_resample(self):
+        """
+        Should resample data and update headers.
+        """
+        segy = readSEGY(get_example_file('ew0210_o30.segy'))
+        segy.traces = segy.traces[0:10]
+        dt0 = segy.traces[0].header.sample_interval_in_ms_for_this_trace
+        npts0 = len(segy.traces[0].data)
+        # low-frequency signal should be preserved
+        t = np.arange(npts0) * dt0 / 1.e6
+        data = np.sin(2 * np.pi * 2. * t)
+        for tr in segy.traces:
+            tr.data = np.float32(data)
+        segy.resample(2 * dt0 / 1.e6)
+        for tr in segy.traces:
+            self.assertEqual(tr.header.sample_interval_in_ms_for_this_trace,
+                             2 * dt0)
+            self.assertEqual(tr.header.number_of_samples_in_this_trace,
+                             npts0 / 2)
+            self.assertEqual(len(tr.data), npts0 / 2)
+            self.assertEqual(tr.data.dtype, np.float32)
+            self.assertTrue(np.allclose(tr.data[50:-50], data[::2][50:-50],
+                                        atol=0.01))
+        self.assertEqual(
+            segy.binary_file_header.sample_interval_in_microseconds, 2 * dt0)
+        self.assertEqual(
+            segy.binary_file_header.number_of_samples_per_data_trace,
+            npts0 / 2)
+        # should raise error for sample intervals that do not fit in headers
+        with self.assertRaises(ValueError):
+            segy.resample(0.1)
+
 
 
 
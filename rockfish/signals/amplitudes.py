@@ -115,6 +115,84 @@ def snr(data, i=None, iref=None, window_size=10,
     # Return SNR
     return rms1 / rms0
 
+def _cumulative_sum(data):
+    """
+    Cumulative sum along rows with a leading column of zeros, such that
+    the sum of ``data[:, i0:i1]`` is ``cs[:, i1] - cs[:, i0]``.
+    """
+    cs = np.zeros((data.shape[0], data.shape[1] + 1))
+    np.cumsum(data, axis=1, out=cs[:, 1:])
+    return cs
+
+def _window_rms(cs2, window, npts):
+    """
+    RMS amplitude in a window for each row of data, given the cumulative
+    sum of squared amplitudes from :func:`_cumulative_sum`.
+    """
+    rows = np.arange(cs2.shape[0])
+    if window is None:
+        i0 = np.zeros(len(rows), dtype=int)
+        i1 = npts
+    else:
+        i0 = np.clip(np.asarray(window[0], dtype=int), 0, npts)
+        i1 = np.clip(np.asarray(window[1], dtype=int), 0, npts)
+        i0 = i0 * np.ones(len(rows), dtype=int)
+        i1 = np.maximum(i0, i1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt((cs2[rows, i1] - cs2[rows, i0]) / (i1 - i0))
+
+def trace_statistics(data, npts=None, signal_window=None, noise_window=None):
+    """
+    Compute amplitude statistics for each row of a 2D array of traces.
+
+    :param data: ``numpy.ndarray`` with shape ``(ntraces, nsamples)``.
+    :param npts: Optional. Number of valid samples in each trace. Samples
+        after ``npts`` are ignored. Default is to use all samples in every
+        trace.
+    :param signal_window: Optional. ``(i0, i1)`` sample indices of the
+        window to compute signal RMS in.  ``i0`` and ``i1`` can be scalars
+        or have a value for each trace. Default is to use the entire trace.
+    :param noise_window: Optional. ``(i0, i1)`` sample indices of the
+        window to compute the reference RMS in.  Default is to use the
+        entire trace.
+    :return: ``dict`` with ``ntraces`` values for each of ``'rms'``,
+        ``'peak'`` (maximum absolute amplitude), ``'mean'``, ``'min'``,
+        ``'max'``, and ``'snr'`` (ratio of the signal and reference RMS, as
+        in :func:`snr`).
+
+    >>> import numpy as np
+    >>> a = np.array([[1, 2, 3, 4, 5], [0, 0, 1, 0, 0]])
+    >>> print trace_statistics(a)['rms']
+    [ 3.31662479  0.4472136 ]
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    ntrc, nsamp = data.shape
+    if npts is None:
+        npts = nsamp * np.ones(ntrc, dtype=int)
+        amin = data.min(axis=1)
+        amax = data.max(axis=1)
+    else:
+        npts = np.clip(np.asarray(npts, dtype=int), 0, nsamp) \
+                * np.ones(ntrc, dtype=int)
+        valid = np.arange(nsamp)[np.newaxis, :] < npts[:, np.newaxis]
+        data = np.where(valid, data, 0.)
+        amin = np.where(valid, data, np.inf).min(axis=1)
+        amax = np.where(valid, data, -np.inf).max(axis=1)
+    cs2 = _cumulative_sum(data ** 2)
+    rms0 = _window_rms(cs2, None, npts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = {'rms': rms0,
+                 'peak': np.abs(data).max(axis=1),
+                 'mean': data.sum(axis=1) / npts,
+                 'min': amin,
+                 'max': amax}
+        if (signal_window is None) and (noise_window is None):
+            stats['snr'] = rms0 / rms0
+        else:
+            stats['snr'] = _window_rms(cs2, signal_window, npts)\
+                    / _window_rms(cs2, noise_window, npts)
+    return stats
+
 
 if __name__ == "__main__":
     import doctest
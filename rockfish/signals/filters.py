@@ -2,8 +2,10 @@
 Routines for filtering data
 """
 
+from fractions import Fraction
 from rockfish.utils.messaging import ProgressPercentTicker
 import numpy as np
+from scipy import signal
 try:
     from obspy.signal import filter
 except ImportError:
@@ -127,3 +129,42 @@ class SEGYFilters():
         for tr in traces:
             tr.data = filter.envelope(tr.data)
 
+    def resample(self, new_dt):
+        """
+        Resample all traces to a new sample interval.
+
+        Traces are resampled with a polyphase filter
+        (:func:`scipy.signal.resample_poly`), which applies an anti-alias
+        FIR filter when decimating.  Traces with the same sample interval
+        and number of samples are resampled together as a single matrix.
+        Sample interval and number of samples are updated in the binary file
+        header and in all trace headers.
+
+        :param new_dt: New sample interval in seconds.
+        """
+        new_dt_us = int(round(new_dt * 1.e6))
+        if (new_dt_us <= 0) or (new_dt_us > 65535):
+            msg = 'new_dt must be between 1e-6 and 0.065535 seconds.'
+            raise ValueError(msg)
+        # group traces by sample interval and length
+        groups = {}
+        for i, tr in enumerate(self.traces):
+            key = (tr.header.sample_interval_in_ms_for_this_trace,
+                   len(tr.data))
+            groups.setdefault(key, []).append(i)
+        for (dt_us, npts), idx in groups.iteritems():
+            if dt_us == new_dt_us:
+                continue
+            ratio = Fraction(dt_us, new_dt_us)
+            data = np.vstack([self.traces[i].data for i in idx])
+            data = signal.resample_poly(data, ratio.numerator,
+                                        ratio.denominator, axis=1)
+            for j, i in enumerate(idx):
+                tr = self.traces[i]
+                tr.data = data[j].astype(tr.data.dtype)
+                tr.header.sample_interval_in_ms_for_this_trace = new_dt_us
+                tr.header.number_of_samples_in_this_trace = data.shape[1]
+        self.binary_file_header.sample_interval_in_microseconds = new_dt_us
+        if len(self.traces) > 0:
+            self.binary_file_header.number_of_samples_per_data_trace = \
+                    len(self.traces[0].data)
@@ -2,7 +2,11 @@
 Utilities for smoothing data.
 """
 import numpy as np
-from scipy import signal
+from scipy import signal, ndimage
+
+# Kernel half-widths (in samples) above which smoothing along an axis is
+# done by FFT convolution rather than by direct convolution.
+FFT_KERNEL_SIZE = 32
 
 def gauss_kern(size, sizey=None):
     """ Returns a normalized 2D gauss kernel array for convolutions """
@@ -15,15 +19,74 @@ def gauss_kern(size, sizey=None):
     g = np.exp(-(x**2/float(size) + y**2/float(sizey)))
     return g / g.sum()
 
+def gauss_kern1d(size):
+    """ Returns a normalized 1D gauss kernel array for convolutions """
+    size = int(size)
+    x = np.arange(-size, size + 1)
+    g = np.exp(-x**2/float(size))
+    return g / g.sum()
+
+def _smooth_axis(data, size, axis):
+    """
+    Smooth data along a single axis with a gaussian kernel of typical size
+    ``size``.
+
+    The data are padded at both ends with reflected copies of the data (as
+    in :func:`smooth1d`) so that the result has the same shape as the
+    input.
+    """
+    size = int(size)
+    n = data.shape[axis]
+    if (size < 1) or (n < 2):
+        return data
+    pad = [(0, 0)] * data.ndim
+    pad[axis] = (size, size)
+    padded = np.pad(data, pad, mode='reflect', reflect_type='odd')
+    if size > FFT_KERNEL_SIZE:
+        shape = [1] * data.ndim
+        shape[axis] = 2 * size + 1
+        g = gauss_kern1d(size).reshape(shape)
+        padded = signal.fftconvolve(padded, g, mode='same', axes=axis)
+    else:
+        # exp(-x**2/size) is a gaussian with sigma**2 = size/2, truncated
+        # at x = +/- size
+        padded = ndimage.gaussian_filter1d(padded, np.sqrt(size / 2.),
+                                           axis=axis,
+                                           truncate=np.sqrt(2. * size))
+    idx = [slice(None)] * data.ndim
+    idx[axis] = slice(size, size + n)
+    return padded[tuple(idx)]
+
 def smooth2d(im, n, ny=None) :
     """ blurs the image by convolving with a gaussian kernel of typical
         size n. The optional keyword argument ny allows for a different
         size in the y direction.
+
+        The kernel is the same as :func:`gauss_kern`, but is applied as
+        two 1D passes, and the image is padded with reflected copies of
+        itself so that the result has the same shape as the input.
     """
-    g = gauss_kern(n, sizey=ny)
-    improc = signal.convolve(im, g, mode='valid')
+    if ny is None:
+        ny = n
+    improc = np.asarray(im, dtype=float)
+    improc = _smooth_axis(improc, n, 0)
+    improc = _smooth_axis(improc, ny, 1)
     return(improc)
 
+def smooth3d(vol, n, ny=None, nz=None):
+    """ blurs a volume by convolving with a gaussian kernel of typical
+        size n. The optional keyword arguments ny and nz allow for
+        different sizes in the y and z directions.
+    """
+    if ny is None:
+        ny = n
+    if nz is None:
+        nz = n
+    volproc = np.asarray(vol, dtype=float)
+    for axis, size in enumerate([n, ny, nz]):
+        volproc = _smooth_axis(volproc, size, axis)
+    return(volproc)
+
 def smooth1d(x, window_len=10, window='hanning'):
     """smooth the data using a window with requested size.
     
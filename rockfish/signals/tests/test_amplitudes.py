@@ -99,6 +99,38 @@ class amplitudesTestCase(unittest.TestCase):
         for w in [1, 10, 20]:
             self.assertEqual(1., amplitudes.snr(a, i=i0, window_size=w))
 
+    def test_trace_statistics(self):
+        """
+        Should return amplitude statistics for each trace.
+        """
+        data = np.random.random((10, 50)) - 0.5
+        stats = amplitudes.trace_statistics(data)
+        for i, d in enumerate(data):
+            self.assertAlmostEqual(stats['rms'][i], amplitudes.rms(d))
+            self.assertAlmostEqual(stats['peak'][i], np.max(np.abs(d)))
+            self.assertAlmostEqual(stats['mean'][i], np.mean(d))
+            self.assertAlmostEqual(stats['min'][i], np.min(d))
+            self.assertAlmostEqual(stats['max'][i], np.max(d))
+            self.assertAlmostEqual(stats['snr'][i], 1.)
+        # should compute snr in per-trace windows
+        i0 = np.arange(10)
+        stats = amplitudes.trace_statistics(data,
+                                            signal_window=(i0 + 20, i0 + 30),
+                                            noise_window=(0, 10))
+        for i, d in enumerate(data):
+            snr = amplitudes.rms(d[i0[i] + 20:i0[i] + 30])\
+                    / amplitudes.rms(d[0:10])
+            self.assertAlmostEqual(stats['snr'][i], snr)
+        # should ignore samples after the end of short traces
+        npts = np.arange(10) + 5
+        padded = data.copy()
+        padded[np.arange(50)[None, :] >= npts[:, None]] = -100.
+        stats = amplitudes.trace_statistics(padded, npts=npts)
+        for i, d in enumerate(data):
+            self.assertAlmostEqual(stats['rms'][i],
+                                   amplitudes.rms(d[:npts[i]]))
+            self.assertAlmostEqual(stats['min'][i], np.min(d[:npts[i]]))
+
 
 def suite():
     return unittest.makeSuite(amplitudesTestCase, 'test')
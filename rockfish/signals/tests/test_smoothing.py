@@ -0,0 +1,85 @@
+"""
+Test suite for the smoothing module.
+"""
+import unittest
+import numpy as np
+from scipy import signal
+from rockfish.signals import smoothing
+
+
+class smoothingTestCase(unittest.TestCase):
+    """
+    Test cases for the smoothing module.
+    """
+    def test_gauss_kern1d(self):
+        """
+        Should be a 1D slice of the 2D kernel.
+        """
+        for n in [1, 3, 10]:
+            g1 = smoothing.gauss_kern1d(n)
+            g2 = smoothing.gauss_kern(n)
+            self.assertEqual(len(g1), 2 * n + 1)
+            self.assertAlmostEqual(np.sum(g1), 1.)
+            self.assertTrue(np.allclose(np.outer(g1, g1), g2))
+
+    def test_smooth2d(self):
+        """
+        Should smooth a 2D grid with the gaussian kernel.
+        """
+        im = np.random.random((40, 30))
+        for n, ny in [(2, None), (3, 5), (5, 1)]:
+            sm = smoothing.smooth2d(im, n, ny=ny)
+            # should return a grid with the same shape
+            self.assertEqual(sm.shape, im.shape)
+            # should match a direct 2D convolution of the padded grid
+            _ny = n if ny is None else ny
+            padded = np.pad(im, ((n, n), (_ny, _ny)), mode='reflect',
+                            reflect_type='odd')
+            sm0 = signal.convolve(padded, smoothing.gauss_kern(n, _ny),
+                                  mode='valid')
+            self.assertTrue(np.allclose(sm, sm0))
+        # should not change constant or linear grids
+        x, y = np.mgrid[0:40, 0:30]
+        for im in [5. * np.ones((40, 30)), 2. * x - 0.5 * y]:
+            self.assertTrue(np.allclose(smoothing.smooth2d(im, 4), im))
+
+    def test_smooth2d_fft(self):
+        """
+        Should give the same result with FFT and direct convolution.
+        """
+        im = np.random.random((200, 150))
+        n = smoothing.FFT_KERNEL_SIZE + 10
+        sm0 = smoothing.smooth2d(im, 3, ny=n)
+        fft_size = smoothing.FFT_KERNEL_SIZE
+        try:
+            smoothing.FFT_KERNEL_SIZE = 1e30
+            sm1 = smoothing.smooth2d(im, 3, ny=n)
+        finally:
+            smoothing.FFT_KERNEL_SIZE = fft_size
+        self.assertTrue(np.allclose(sm0, sm1))
+
+    def test_smooth3d(self):
+        """
+        Should smooth a 3D grid one axis at a time.
+        """
+        vol = np.random.random((20, 15, 10))
+        sm = smoothing.smooth3d(vol, 3, ny=2, nz=4)
+        self.assertEqual(sm.shape, vol.shape)
+        # should match a direct 3D convolution of the padded grid
+        g = smoothing.gauss_kern1d
+        kern = g(3)[:, None, None] * g(2)[None, :, None] \
+                * g(4)[None, None, :]
+        padded = np.pad(vol, ((3, 3), (2, 2), (4, 4)), mode='reflect',
+                        reflect_type='odd')
+        sm0 = signal.convolve(padded, kern, mode='valid')
+        self.assertTrue(np.allclose(sm, sm0))
+        # should not change a constant volume
+        vol = 3. * np.ones((20, 15, 10))
+        self.assertTrue(np.allclose(smoothing.smooth3d(vol, 3), vol))
+
+
+def suite():
+    return unittest.makeSuite(smoothingTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
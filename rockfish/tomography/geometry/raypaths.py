@@ -22,9 +22,10 @@ def assign_points_to_layers(vm, px, py, pz):
     Returns
     -------
     pi : numpy.ndarray
-        Layer index for each point.
+        Layer index for each point, or ``-1`` for points outside of the
+        model.
     """
-    return np.asarray([vm.point2layer(*pt) for pt in zip(px, py, pz)])
+    return vm.points2layers(px, py, pz)
 
 def split_downup(px, py, pz, pi=None):
     """
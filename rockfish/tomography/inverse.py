@@ -5,8 +5,11 @@ import os
 import subprocess
 import warnings
 import time
+import numpy as np
+from scipy import sparse
 from utils import python2fortran_bool, bool2int
-from model import readVM
+from model import readVM, ENDIAN
+from rockfish.io import pack
 
 INVERSION_PROGRAM = 'vm_tomo'
 SMOOTHING_PROGRAM = 'vm_smooth_model'
@@ -17,6 +20,15 @@ USE_NEW_FRECHET_DERIVATIVE_CALCULATION = True
 USE_HEADWAVES_IN_FRECHET_DERIVATIVES = True
 USE_COMBINATION_SMOOTHNESS = True
 
+# Layout of the binary diagnostic files written by the inversion program.
+# The Frechet matrix is stored row by row (one row per ray), with each row
+# given as the number of non-zero values (int32), the 1-based column
+# indices of the non-zero values (int32), and the values (float32). Model
+# update vectors are stored as a single float32 array.
+FRECHET_INDEX_DTYPE = 'i4'
+FRECHET_VALUE_DTYPE = 'f4'
+MODEL_UPDATE_DTYPE = 'f4'
+
 
 def invert(input_vmfile, rayfile, output_vmfile, smooth_result=True,
            target_chi_squared=1.0, damping=0.1,
@@ -281,3 +293,94 @@ def smooth(input_vmfile, rough_vmfile, output_vmfile, combo_smooth=True,
     sh += '{:}\n'.format(output_vmfile)
     # Run the script
     subprocess.call(sh, shell=True)
+
+
+def read_frechet_matrix(filename, ncols=None, endian=ENDIAN):
+    """
+    Read a Frechet matrix written by the inversion program.
+
+    The file is memory mapped, so only the non-zero values are loaded into
+    memory.
+
+    :param filename: Filename of the binary Frechet matrix file (i.e.,
+        ``frechet_matrix.bin`` in the diagnostic directory of
+        :func:`invert`).
+    :param ncols: Optional. Number of model parameters (i.e., columns in the
+        matrix). Default is to use the largest column index in the file.
+    :param endian: Optional. The endianness of the file. Default is
+        to use machine's native byte order.
+    :returns: ``scipy.sparse.csr_matrix`` with a row for each ray.
+    """
+    endian = pack.numpy_byteorder(endian)
+    if os.path.getsize(filename) == 0:
+        return sparse.csr_matrix((0, ncols or 0), dtype=np.float32)
+    words = np.memmap(filename, dtype=endian + FRECHET_INDEX_DTYPE,
+                      mode='r')
+    # scan row headers for the positions of rows in the file
+    starts = []
+    i = 0
+    _words = np.asarray(words)
+    while i < len(_words):
+        nnz = int(_words[i])
+        if nnz < 0:
+            msg = 'Invalid number of values ({:}) for row {:} in {:}.'\
+                    .format(nnz, len(starts), filename)
+            raise IOError(msg)
+        starts.append(i)
+        i += 1 + 2 * nnz
+    if i != len(_words):
+        msg = 'Row {:} in {:} runs past the end of the file.'\
+                .format(len(starts) - 1, filename)
+        raise IOError(msg)
+    starts = np.asarray(starts, dtype=int)
+    nnz = np.asarray(words[starts], dtype=int)
+    indptr = np.zeros(len(starts) + 1, dtype=int)
+    np.cumsum(nnz, out=indptr[1:])
+    # positions of the column indices and values of each row
+    step = np.arange(indptr[-1]) - np.repeat(indptr[:-1], nnz)
+    icol = np.repeat(starts + 1, nnz) + step
+    ival = icol + np.repeat(nnz, nnz)
+    indices = np.asarray(words[icol], dtype=np.int32) - 1
+    values = words.view(endian + FRECHET_VALUE_DTYPE)[ival]\
+            .astype(np.float32)
+    if ncols is None:
+        ncols = indices.max() + 1 if len(indices) > 0 else 0
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= ncols):
+        msg = 'Column indices in {:} are outside of the range 1-{:}.'\
+                .format(filename, ncols)
+        raise IOError(msg)
+    G = sparse.csr_matrix((values, indices, indptr),
+                          shape=(len(starts), ncols))
+    G.sum_duplicates()
+    return G
+
+
+def read_model_update(filename, endian=ENDIAN):
+    """
+    Read a model update vector written by the inversion program.
+
+    :param filename: Filename of the binary update vector (e.g.,
+        ``vecm.bin`` in the diagnostic directory of :func:`invert`).
+    :param endian: Optional. The endianness of the file. Default is
+        to use machine's native byte order.
+    :returns: Read-only, memory-mapped ``numpy.ndarray``.
+    """
+    dtype = pack.numpy_byteorder(endian) + MODEL_UPDATE_DTYPE
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r')
+
+
+def read_dws(filename):
+    """
+    Read a derivative-weight sum (DWS) file written by the inversion
+    program.
+
+    :param filename: Filename of an ASCII DWS file (e.g., ``dws.sl.dat``
+        in the diagnostic directory of :func:`invert`). The last column is
+        the DWS and preceding columns are coordinates.
+    :returns: ``coordinates, dws`` arrays. ``coordinates`` has a column for
+        each coordinate in the file.
+    """
+    data = np.loadtxt(filename, ndmin=2)
+    return data[:, :-1], data[:, -1]
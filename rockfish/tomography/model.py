@@ -13,12 +13,11 @@ indicates that a node is to be excluded from the inversion.
 """
 import os
 import warnings
-import subprocess
+import itertools
 import numpy as np
 from scipy.io import netcdf_file as netcdf
 from scipy.interpolate import interp1d, interp2d
 import datetime
-from struct import unpack
 import matplotlib.pyplot as plt
 import copy
 from rockfish import __version__
@@ -36,8 +35,151 @@ UNITS = {'slowness': 's/km',
          'y': 'km',
          'z': 'km'}
 
-x2i = lambda x, x0, dx, nx: np.clip([int(round((_x - x0) / dx))\
-                                    for _x in np.atleast_1d(x)], 0, nx - 1)
+def _read_array(f, dtype, count):
+    """
+    Read an array of binary values from a file or file-like object.
+
+    :param f: Open file or file-like object to read from.
+    :param dtype: ``numpy.dtype`` of the values, including byte order.
+    :param count: Number of values to read.
+    :returns: ``numpy.ndarray`` with ``count`` values.
+    """
+    dtype = np.dtype(dtype)
+    if isinstance(f, file):
+        data = np.fromfile(f, dtype=dtype, count=count)
+    else:
+        data = np.frombuffer(f.read(dtype.itemsize * count), dtype=dtype)
+    if len(data) != count:
+        msg = 'Expected {:} values but only read {:}.'.format(count,
+                                                              len(data))
+        raise IOError(msg)
+    return data
+
+def nearest_index(x, x0, dx, nx):
+    """
+    Find the nearest grid index for an array of coordinates.
+
+    Rounds half-way values away from zero, as in the scalar ``x2i``.
+
+    :param x: ``numpy.ndarray`` of coordinates.
+    :param x0: Coordinate of the first grid node.
+    :param dx: Grid node spacing.
+    :param nx: Number of grid nodes.
+    :returns: ``numpy.ndarray`` of indices with the same shape as ``x``.
+    """
+    i = (np.asarray(x) - x0) / dx
+    i = np.sign(i) * np.floor(np.abs(i) + 0.5)
+    return np.clip(i, 0, nx - 1).astype(int)
+
+def linear_weights(x, x0, dx, nx):
+    """
+    Find grid nodes and weights for linear interpolation at coordinates.
+
+    Coordinates outside of the grid are moved to the nearest edge.
+
+    :param x: ``numpy.ndarray`` of coordinates.
+    :param x0: Coordinate of the first grid node.
+    :param dx: Grid node spacing.
+    :param nx: Number of grid nodes.
+    :returns: ``i0, i1, w`` arrays with the indices of the nodes on either
+        side of each coordinate and the weight of node ``i1``.
+    """
+    i = np.clip((np.asarray(x, dtype=float) - x0) / dx, 0, nx - 1)
+    i0 = np.minimum(np.floor(i).astype(int), max(nx - 2, 0))
+    return i0, np.minimum(i0 + 1, nx - 1), i - i0
+
+def _interp_columns(x, xp, fp):
+    """
+    Linearly interpolate values in many columns to the same coordinates.
+
+    :param x: ``numpy.ndarray`` of coordinates to interpolate at.
+    :param xp: ``numpy.ndarray`` with coordinates that increase along the
+        last axis.
+    :param fp: ``numpy.ndarray`` of values at ``xp``.
+    :returns: ``numpy.ndarray`` with shape ``xp.shape[:-1] + (len(x),)``.
+        Values outside of the range of ``xp`` in a column are ``nan``.
+    """
+    x = np.asarray(x, dtype=float)
+    shape = xp.shape[:-1] + (len(x),)
+    xp = np.reshape(xp, (-1, xp.shape[-1]))
+    fp = np.reshape(fp, (-1, fp.shape[-1]))
+    # Shift each column to a separate interval so that all columns can be
+    # interpolated in a single call
+    width = max(np.nanmax(xp), x.max()) - min(np.nanmin(xp), x.min()) + 1.
+    shift = width * np.arange(xp.shape[0])[:, np.newaxis]
+    v = np.interp((x + shift).ravel(), (xp + shift).ravel(), fp.ravel())
+    inside = (x >= xp[:, :1]) & (x <= xp[:, -1:])
+    return np.where(inside, v.reshape(inside.shape), np.nan).reshape(shape)
+
+def _write_grid_rows(file, x, y, z, grd, fmt, delimiter=' ',
+                     chunk_size=1000000):
+    """
+    Write a row with the coordinates and value of each node in a grid.
+
+    Rows are ordered with z varying fastest, then y, then x.
+
+    :param file: Open file to write to.
+    :param x, y, z: Coordinates of the grid nodes along each axis.
+    :param grd: ``numpy.ndarray`` with shape ``(len(x), len(y), len(z))``.
+    :param fmt: Format for each row, as for ``numpy.savetxt``.
+    :param delimiter: Optional. String separating columns if ``fmt`` is a
+        single format. Default is a space.
+    :param chunk_size: Optional. Approximate number of rows to format at
+        once. Default is 1000000.
+    """
+    x = np.asarray(x)
+    ny, nz = len(y), len(z)
+    yz = np.column_stack([v.ravel() for v in np.meshgrid(y, z,
+                                                         indexing='ij')])
+    step = max(1, chunk_size // max(1, ny * nz))
+    for i0 in range(0, len(x), step):
+        i1 = min(i0 + step, len(x))
+        rows = np.column_stack((np.repeat(x[i0:i1], ny * nz),
+                                np.tile(yz, (i1 - i0, 1)),
+                                np.ravel(grd[i0:i1])))
+        np.savetxt(file, rows, fmt=fmt, delimiter=delimiter)
+
+def write_netcdf_grid(filename, x, y, z, title='', xunits='km',
+                      yunits='km', zunits=''):
+    """
+    Write a 2D grid to a GMT-compatible netCDF (COARDS) file.
+
+    :param filename: Name of the file to write.
+    :param x: Coordinates of the grid columns, in increasing order.
+    :param y: Coordinates of the grid rows, in increasing order.
+    :param z: ``numpy.ndarray`` with shape ``(len(y), len(x))`` of grid
+        values.  ``nan`` values are treated as missing data by GMT.
+    :param title: Optional. Title for the grid.
+    :param xunits, yunits, zunits: Optional. Units of the coordinates and
+        grid values.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    z = np.asarray(z, dtype=float)
+    assert z.shape == (len(y), len(x)), 'z must have shape (ny, nx)'
+    f = netcdf(filename, 'w')
+    f.Conventions = 'COARDS, CF-1.5'
+    f.title = title
+    f.history = 'Created by {:} (version {:}) on {:}'\
+            .format(__name__, __version__, datetime.datetime.now())
+    f.node_offset = 0
+    for name, v, units in [('x', x, xunits), ('y', y, yunits)]:
+        f.createDimension(name, len(v))
+        var = f.createVariable(name, 'd', (name,))
+        var[:] = v
+        var.long_name = name
+        var.units = units
+        var.actual_range = np.array([v.min(), v.max()])
+    var = f.createVariable('z', 'f', ('y', 'x'))
+    var[:, :] = z
+    var.long_name = 'z'
+    var.units = zunits
+    var.actual_range = np.array([np.nanmin(z), np.nanmax(z)])
+    f.close()
+
+_grid_versions = itertools.count()
+
+x2i = lambda x, x0, dx, nx: nearest_index(np.atleast_1d(x), x0, dx, nx)
 
 
 class GMTCallError(Exception):
@@ -184,12 +326,10 @@ class VM(object):
         """
         self.apply_jumps(iref=range(0, iref - 1))
         _, z0 = self.get_layer_bounds(iref)
-        for ix in self.xrange2i(xmin, xmax):
-            for iy in self.yrange2i(ymin, ymax):
-                iz0 = self.z2i([z0[ix, iy]])[0]
-                sl0 = self.sl[ix, iy, iz0]
-                sl1 = self.sl[ix, iy, iz0 + 1]
-                self.jp[iref - 1][ix][iy] = sl1 - sl0
+        ix, iy = np.ix_(self.xrange2i(xmin, xmax), self.yrange2i(ymin, ymax))
+        iz0 = nearest_index(z0[ix, iy], self.r1[2], self.dz, self.nz)
+        self.jp[iref - 1][ix, iy] = self.sl[ix, iy, iz0 + 1]\
+                - self.sl[ix, iy, iz0]
         self.remove_jumps(iref=range(0, iref - 1))
 
     def apply_jumps(self, iref=None, remove=False):
@@ -203,15 +343,17 @@ class VM(object):
         """
         if iref is None:
             iref = range(0, self.nr)
+        iz = np.arange(self.nz)
         for _iref in iref:
             z0, _ = self.get_layer_bounds(_iref + 1)
-            for ix in range(0, self.nx):
-                for iy in range(0, self.ny):
-                    iz0 = self.z2i([z0[ix, iy]])[0]
-                    if remove is False:
-                        self.sl[ix, iy, iz0:] += self.jp[_iref, ix, iy]
-                    else:
-                        self.sl[ix, iy, iz0:] -= self.jp[_iref, ix, iy]
+            iz0 = nearest_index(z0, self.r1[2], self.dz, self.nz)
+            # jump at each node at or below the interface, zero above it
+            jp = np.where(iz >= iz0[:, :, np.newaxis],
+                          self.jp[_iref][:, :, np.newaxis], 0.)
+            if remove is False:
+                self.sl += jp
+            else:
+                self.sl -= jp
 
     def remove_jumps(self, iref=None):
         """
@@ -297,45 +439,39 @@ class VM(object):
             specifying the order of the spline interpolator to use.
             Default is 'linear'.
         """
-        # Get layer boundary depths
-        z0, z1 = self.get_layer_bounds(ilyr)
-        # Define velocity function at each x,y point
-        vel = np.asarray(vel)
+        ix, iy, iz, iz0, iz1 = self.get_layer_nodes(ilyr, xmin=xmin,
+                                                    xmax=xmax, ymin=ymin,
+                                                    ymax=ymax)
         nvel = len(vel)
-        for ix in self.xrange2i(xmin, xmax):
-            for iy in self.yrange2i(ymin, ymax):
-                iz0, iz1 = self.z2i((z0[ix, iy], z1[ix, iy]))
-                iz1 += 1
-                z = self.z[iz0:iz1]
-                if len(z) == 0:
-                    # in pinchout, nothing to do
-                    continue
-                # Make a copy of velocities for this iteration
-                _vel = np.copy(vel)
-                # Get top and bottom velocities, if they are None
-                if vel[0] is None:
-                    _vel[0] = 1. / self.sl[ix, iy, max(iz0 - 1, 0)]
-                if len(vel) > 1:
-                    if vel[1] is None:
-                        _vel[1] = 1. / self.sl[ix, iy, min(iz1 + 1, self.nx)]
-                # Pad interpolates for rounding to grid coordinates
-                if nvel == 1:
-                    # Set constant value
-                    v = np.asarray([_vel])
-                else:
-                    # Interpolate velocities
-                    zi = z0[ix, iy] + (z1[ix, iy] - z0[ix, iy])\
-                            * np.arange(0., nvel) / (nvel - 1)
-                    vi = np.copy(_vel)
-                    if z[0] < zi[0]:
-                        zi = np.insert(zi, 0, z[0])
-                        vi = np.insert(vi, 0, _vel[0])
-                    if z[-1] > zi[-1]:
-                        zi = np.append(zi, z[-1])
-                        vi = np.append(vi, _vel[-1])
-                    zv = interp1d(zi, vi, kind=kind)
-                    v = zv(z)
-                self.sl[ix, iy, iz0:iz1] = 1. / v
+        # Velocities at the nodes of each column
+        v = np.empty((len(iz), nvel))
+        for i, _v in enumerate(vel):
+            if _v is not None:
+                v[:, i] = _v
+        # Get top and bottom velocities, if they are None
+        if vel[0] is None:
+            v[:, 0] = 1. / self.sl[ix, iy, np.maximum(iz0 - 1, 0)]
+        if (nvel > 1) and (vel[-1] is None):
+            v[:, -1] = 1. / self.sl[ix, iy, np.minimum(iz1 + 2, self.nz - 1)]
+        if nvel == 1:
+            # Set constant value
+            self.sl[ix, iy, iz] = 1. / v[:, 0]
+            self.grids.modified()
+            return
+        # Normalized depth within the layer, with velocities held constant
+        # between the interfaces and the nearest grid nodes
+        z0, z1 = self.get_layer_bounds(ilyr)
+        z = self.z[iz] - z0[ix, iy]
+        h = z1[ix, iy] - z0[ix, iy]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.where(h > 0, z / h, z > 0)
+        u = np.clip(u * (nvel - 1), 0, nvel - 1)
+        # Interpolate velocities as a weighted sum of the values in each
+        # column
+        weights = interp1d(np.arange(nvel), np.eye(nvel), kind=kind,
+                           axis=0)(u)
+        self.sl[ix, iy, iz] = 1. / np.sum(weights * v, axis=1)
+        self.grids.modified()
 
     def insert_layer_velocities(self, ilyr, vel, is_slowness=False):
         """
@@ -354,6 +490,7 @@ class VM(object):
             self.sl[isl] = vel[isl]
         else:
             self.sl[isl] = 1. / vel[isl]
+        self.grids.modified()
 
     def define_constant_layer_velocity(self, ilyr, v, xmin=None,
                                           xmax=None, ymin=None, ymax=None):
@@ -384,20 +521,14 @@ class VM(object):
             shape (nx, ny). Default is to use the value at the
             base of the overlying layer.
         """
-        z0, z1 = self.get_layer_bounds(ilyr)
-        for ix in range(0, self.nx):
-            for iy in range(0, self.ny):
-                iz0, iz1 = self.z2i((z0[ix, iy], z1[ix, iy]))
-                iz1 += 1
-                z = self.z[iz0:iz1] - self.z[iz0]
-                if v0 is None:
-                    if iz0 == 0:
-                        _v0 = 0.
-                    else:
-                        _v0 = 1. / self.sl[ix, iy, iz0 - 1]
-                else:
-                    _v0 = v0[ix, iy]
-                self.sl[ix, iy, iz0:iz1] = 1. / (_v0 + z * dvdz[ix, iy])
+        ix, iy, iz, iz0, iz1 = self.get_layer_nodes(ilyr)
+        if v0 is None:
+            v0 = self._get_overlying_velocities(ix, iy, iz0)
+        else:
+            v0 = np.asarray(v0)[ix, iy]
+        z = self.z[iz] - self.z[iz0]
+        self.sl[ix, iy, iz] = 1. / (v0 + z * np.asarray(dvdz)[ix, iy])
+        self.grids.modified()
 
     def define_constant_layer_gradient(self, ilyr, dvdz, v0=None, xmin=None,
                                        xmax=None, ymin=None, ymax=None):
@@ -415,20 +546,55 @@ class VM(object):
             velocities. Default is to change velocities over the entire
             y-domain.
         """
+        ix, iy, iz, iz0, iz1 = self.get_layer_nodes(ilyr, xmin=xmin,
+                                                    xmax=xmax, ymin=ymin,
+                                                    ymax=ymax)
+        if v0 is None:
+            v0 = self._get_overlying_velocities(ix, iy, iz0)
+        z = self.z[iz] - self.z[iz0]
+        self.sl[ix, iy, iz] = 1. / (v0 + z * dvdz)
+        self.grids.modified()
+
+    def _get_overlying_velocities(self, ix, iy, iz0):
+        """
+        Get velocities at the nodes above the top of a layer.
+
+        :param ix, iy: Arrays of x and y indices.
+        :param iz0: Array of z indices of the top of the layer.
+        :returns: Array of velocities, with zero where the layer starts at
+            the top of the model.
+        """
+        v0 = np.zeros(len(iz0))
+        above = iz0 > 0
+        v0[above] = 1. / self.sl[ix[above], iy[above], iz0[above] - 1]
+        return v0
+
+    def get_layer_nodes(self, ilyr, xmin=None, xmax=None, ymin=None,
+                        ymax=None):
+        """
+        Find the grid nodes in a layer.
+
+        Nodes are found for every column between the nodes nearest to the
+        top and bottom boundaries of the layer.
+
+        :param ilyr: Index of layer of interest.
+        :param xmin, xmax: Set the x-coordinate limits of columns to
+            include. Default is to include the entire x-domain.
+        :param ymin, ymax: Set the y-coordinate limits of columns to
+            include. Default is to include the entire y-domain.
+        :returns: ``ix, iy, iz, iz0, iz1`` arrays with the indices of each
+            node and the indices of the top and bottom nodes of its column.
+        """
         z0, z1 = self.get_layer_bounds(ilyr)
-        for ix in self.xrange2i(xmin, xmax):
-            for iy in self.yrange2i(ymin, ymax):
-                iz0, iz1 = self.z2i((z0[ix, iy], z1[ix, iy]))
-                iz1 += 1
-                z = self.z[iz0:iz1] - self.z[iz0]
-                if v0 is None:
-                    if iz0 == 0:
-                        _v0 = 0.
-                    else:
-                        _v0 = 1. / self.sl[ix, iy, iz0 - 1]
-                else:
-                    _v0 = v0
-                self.sl[ix, iy, iz0:iz1] = 1. / (_v0 + z * dvdz)
+        ix, iy = np.meshgrid(np.asarray(self.xrange2i(xmin, xmax), dtype=int),
+                             np.asarray(self.yrange2i(ymin, ymax), dtype=int),
+                             indexing='ij')
+        iz0 = nearest_index(z0[ix, iy], self.r1[2], self.dz, self.nz)
+        iz1 = nearest_index(z1[ix, iy], self.r1[2], self.dz, self.nz)
+        iz = np.arange(self.nz)
+        i, j, iz = np.nonzero((iz >= iz0[:, :, np.newaxis])
+                              & (iz <= iz1[:, :, np.newaxis]))
+        return ix[i, j], iy[i, j], iz, iz0[i, j], iz1[i, j]
 
     def get_layer_bounds(self, ilyr):
         """
@@ -512,14 +678,12 @@ class VM(object):
             data. Useful if one is only interested in the grid dimension
             values. Default is to read the entire file.
         """
+        endian = pack.numpy_byteorder(endian)
         # Header information
-        fmt = '{:}iiii'.format(endian)
-        nx, ny, nz, nr = unpack(fmt, file.read(4 * 4))
-        fmt = '{:}fff'.format(endian)
-        r1 = unpack(fmt, file.read(4 * 3))
-        r2 = unpack(fmt, file.read(4 * 3))
-        fmt = '{:}fff'.format(endian)
-        dx, dy, dz = unpack(fmt, file.read(4 * 3))
+        nx, ny, nz, nr = _read_array(file, endian + 'i4', 4).tolist()
+        r1 = _read_array(file, endian + 'f4', 3).tolist()
+        r2 = _read_array(file, endian + 'f4', 3).tolist()
+        dx, dy, dz = _read_array(file, endian + 'f4', 3).tolist()
         if head_only is True:
             sl = np.empty((nx, ny, nz))
             self.rf = np.empty((nr, nx, ny))
@@ -533,22 +697,18 @@ class VM(object):
             return
 
         # Slowness grid
-        ngrid = nx * ny * nz
-        fmt = endian + ('f' * ngrid)
-        sl = np.asarray(unpack(fmt, file.read(4 * ngrid)))
+        sl = _read_array(file, endian + 'f4', nx * ny * nz).astype(float)
         self.grids = VMGrids(dx, dy, dz, sl, xmin=r1[0], ymin=r1[1],
                 zmin=r1[2])
 
         # Interface depths and slowness jumps
         nintf = nx * ny * nr
-        fmt = endian + 'f' * nintf
-        self.rf = unpack(fmt, file.read(4 * nintf))
-        self.jp = unpack(fmt, file.read(4 * nintf))
+        self.rf = _read_array(file, endian + 'f4', nintf).astype(float)
+        self.jp = _read_array(file, endian + 'f4', nintf).astype(float)
 
         # Interface flags
-        fmt = endian + 'i' * nintf
-        self.ir = unpack(fmt, file.read(4 * nintf))
-        self.ij = unpack(fmt, file.read(4 * nintf))
+        self.ir = _read_array(file, endian + 'i4', nintf).astype(int)
+        self.ij = _read_array(file, endian + 'i4', nintf).astype(int)
 
         # Rearrage 1D arrays into 3D matrixes
         self._unpack_arrays(nx, ny, nz, nr)
@@ -595,11 +755,7 @@ class VM(object):
 
         :param filename: Filename of an ASCII file with columns: x, y, z, dws.
         """
-        f = open(filename)
-        dws = []
-        for row in f:
-            dws.append(float(row.split()[3]))
-        dws = np.asarray(dws)
+        dws = np.loadtxt(filename, usecols=(3,))
         self.dws_sl = np.reshape(dws, (self.nx, self.ny, self.nz))
 
     def write(self, filename, fmt='vm', endian=ENDIAN, **kwargs):
@@ -636,31 +792,22 @@ class VM(object):
         :param endian: The endianness of the file. Default is
             to use machine's native byte order.
         """
-        f = open(filename, 'w')
+        endian = pack.numpy_byteorder(endian)
+        f = open(filename, 'wb')
         # Header information
-        nx = self.nx
-        ny = self.ny
-        nz = self.nz
-        nr = self.nr
-        for v in [nx, ny, nz, nr]:
-            pack.pack_4byte_Integer(f, np.int32(v), endian)
-        for v in self.r1 + self.r2 + (self.dx, self.dy, self.dz):
-            pack.pack_4byte_IEEE(f, np.float32(v), endian)
+        np.asarray([self.nx, self.ny, self.nz, self.nr],
+                   dtype=endian + 'i4').tofile(f)
+        np.asarray(self.r1 + self.r2 + (self.dx, self.dy, self.dz),
+                   dtype=endian + 'f4').tofile(f)
         # Slowness grid
-        self._pack_arrays()  # must be called after writing size properties
-        pack.pack_4byte_IEEE(f, np.float32(self.sl), endian)
+        np.asarray(self.sl, dtype=endian + 'f4').tofile(f)
         # Interface depths and slowness jumps
         for v in [self.rf, self.jp]:
-            pack.pack_4byte_IEEE(f, np.float32(v), endian)
+            np.asarray(v, dtype=endian + 'f4').tofile(f)
         # Add 1 to interface flags to conform to Fortran convention
-        ir = self.ir + 1
-        ij = self.ij + 1
-        # Write interface flags
-        for v in [ir, ij]:
-            pack.pack_4byte_Integer(f, np.int32(v), endian)
+        for v in [self.ir, self.ij]:
+            (np.asarray(v) + 1).astype(endian + 'i4').tofile(f)
         f.close()
-        # Unpack the arrays for future use
-        self._unpack_arrays(nx, ny, nz, nr)
 
     def write_ascii_grid(self, filename, grid='sl', meters=False,
             velocity=False):
@@ -698,44 +845,42 @@ class VM(object):
         #file.write('#\n# Grid overview:\n')
         #for line in self._get_full_overview().split('\n'):
         #    file.write('# {:}\n'.format(line))
-        for ix in self.xrange2i(): 
-            x = (self.r1[0] + ix * self.dx) * xscale
-            for iy in self.yrange2i(): 
-                y = (self.r1[1] + iy * self.dy) * xscale
-                for iz in self.zrange2i(): 
-                    z = (self.r1[2] + iz * self.dz) * xscale
-                    if velocity is True:
-                        _grd = 1. / grd[ix][iy][iz]
-                    else:
-                        _grd = grd[ix][iy][iz]
-
-                    file.write('{:20.3f} {:20.3f} {:20.3f} {:10.5f}\n'\
-                               .format(x, y, z, _grd))
+        if velocity is True:
+            grd = 1. / np.asarray(grd)
+        _write_grid_rows(file,
+                         (self.r1[0] + np.arange(self.nx) * self.dx) * xscale,
+                         (self.r1[1] + np.arange(self.ny) * self.dy) * xscale,
+                         (self.r1[2] + np.arange(self.nz) * self.dz) * xscale,
+                         grd, '%20.3f %20.3f %20.3f %10.5f')
         file.close()
 
     def write_grd(self, grdfile, grid='sl', velocity=False):
+        """
+        Write a 2D model grid to a GMT-compatible netCDF file.
 
-        assert self.ny == 1, 'write_grd() only works with 2D models (ny=1)'
-
-        xyzfile = '.temp.vm.xyzv'
-
-        self.write_ascii_grid(xyzfile, grid=grid, velocity=velocity,
-                meters=False)
-
-        gmt = "awk '(substr($0, 1, 1)!=" + '"#"'\
-                + "){print $1, $3, $4}' " + xyzfile
-
-        gmt += ' | gmt xyz2grd -G{:} -R{:}/{:}/{:}/{:} -I{:}/{:}'\
-                .format(grdfile, self.r1[0], self.r2[0],
-                        self.r1[2], self.r2[2], self.dx, self.dz)
-
-        subprocess.call(gmt, shell=True)
-
-        if not os.path.isfile(grdfile):
-            raise GMTCallError('Problem executing shell script: {:}'\
-                    .format(gmt))
+        The grid is written with x-coordinates along the columns and depths
+        along the rows.
 
-        os.remove(xyzfile)
+        :param grdfile: Name of the file to write.
+        :param grid: Grid attribute to write data from. Default is `sl`
+            (slowness).
+        :param velocity: Output slowness values as velocity. Default
+            is slowness.
+        """
+        assert self.ny == 1, 'write_grd() only works with 2D models (ny=1)'
+        grd = np.asarray(self.__getattribute__(grid), dtype=float)[:, 0, :]
+        if velocity is True:
+            grd = 1. / grd
+            units = UNITS['velocity']
+        elif grid == 'sl':
+            units = UNITS['slowness']
+        else:
+            units = UNITS.get(grid, '')
+        write_netcdf_grid(grdfile,
+                          self.r1[0] + np.arange(self.nx) * self.dx,
+                          self.r1[2] + np.arange(self.nz) * self.dz,
+                          grd.transpose(), title='VM Tomography model grid',
+                          zunits=units)
 
     def project_model(self, angle, dx=None, x=None, y=None):
         """
@@ -753,7 +898,8 @@ class VM(object):
         if (x is None) and (y is None):
             vm0 = self
         else:
-            vm0 = slice_along_xy_line(x=x, y=y, dx=min(self.dx, self.dy))
+            vm0 = self.slice_along_xy_line(x=x, y=y,
+                                           dx=min(self.dx, self.dy))
         # Create new model
         if dx is None:
             dx = vm0.dx
@@ -762,27 +908,20 @@ class VM(object):
         vm1 = VM(r1=(0, 0, vm0.r1[2]), r2=(xmax, 0, vm0.r2[2]),
                  dx=dx, dy=1, dz=vm0.dz, nr=vm0.nr)
         # New model coordinates in old model
-        x0 = vm1.x * np.cos(np.deg2rad(angle))
+        x0 = vm0.r1[0] + vm1.x * np.cos(np.deg2rad(angle))
+        ix0, ix1, w = linear_weights(x0, vm0.r1[0], vm0.dx, vm0.nx)
         # Project boundaries
-        for iref in range(0, vm0.nr):
-            # setup interpolators
-            x2rf = interp1d(vm0.x, [v[0] for v in vm0.rf[iref]], kind='linear')
-            x2jp = interp1d(vm0.x, [v[0] for v in vm0.jp[iref]], kind='linear')
-            x2ir = interp1d(vm0.x, [v[0] for v in vm0.ir[iref]],
-                            kind='nearest')
-            x2ij = interp1d(vm0.x, [v[0] for v in vm0.ij[iref]],
-                            kind='nearest')
-            # do the interpolating
-            vm1.rf[iref] = np.asarray([[v] for v in x2rf(x0)])
-            vm1.jp[iref] = np.asarray([[v] for v in x2jp(x0)])
-            vm1.ir[iref] = np.asarray([[v] for v in x2ir(x0)])
-            vm1.ij[iref] = np.asarray([[v] for v in x2ij(x0)])
+        for attr in ['rf', 'jp']:
+            v = vm0.__getattribute__(attr)[:, :, 0]
+            vm1.__setattr__(attr, ((1 - w) * v[:, ix0]
+                                   + w * v[:, ix1])[:, :, np.newaxis])
+        ix = nearest_index(x0, vm0.r1[0], vm0.dx, vm0.nx)
+        vm1.ir = vm0.ir[:, ix, :]
+        vm1.ij = vm0.ij[:, ix, :]
         # Project velocities
-        for iz in range(0, vm0.nz):
-            x2sl = interp1d(vm0.x, vm0.sl[:, 0, iz], kind='linear')
-            sl = x2sl(x0)
-            vm1.sl[:, 0, iz] = sl
-        nbogus = len(np.nonzero(vm1.sl < 0))
+        vm1.sl = (1 - w)[:, np.newaxis, np.newaxis] * vm0.sl[ix0]\
+                + w[:, np.newaxis, np.newaxis] * vm0.sl[ix1]
+        nbogus = np.sum(vm1.sl < 0)
         if nbogus > 0:
             msg = 'Interpolation of slowness resulted in {:}'.format(nbogus)
             msg += ' nodes with negative values.'
@@ -794,33 +933,10 @@ class VM(object):
         Rearrange the 1D model arrays into 3D matrices (stacked arrays)
         """
         self.sl = np.reshape(self.sl, (nx, ny, nz))
-        rf = []
-        jp = []
-        ir = []
-        ij = []
-        for iref in range(0, nr):
-            i0 = iref * (nx * self.ny)
-            i1 = i0 + (nx * self.ny)
-            rf.append(np.reshape(self.rf[i0:i1], (nx, ny)))
-            jp.append(np.reshape(self.jp[i0:i1], (nx, ny)))
-            ir.append(np.reshape(self.ir[i0:i1], (nx, ny)))
-            ij.append(np.reshape(self.ij[i0:i1], (nx, ny)))
-        self.rf = np.asarray(rf)
-        self.jp = np.asarray(jp)
-        self.ir = np.asarray(ir)
-        self.ij = np.asarray(ij)
-
-    def _pack_arrays(self):
-        """
-        Rearrange the 3D model matrices into 1D arrays.
-        """
-        ngrid = self.nx * self.ny * self.nz
-        nrefl = self.nx * self.ny * self.nr
-        self.sl = np.reshape(self.sl, (ngrid))
-        self.rf = np.reshape(self.rf, (nrefl))
-        self.jp = np.reshape(self.jp, (nrefl))
-        self.ir = np.reshape(self.ir, (nrefl))
-        self.ij = np.reshape(self.ij, (nrefl))
+        self.rf = np.reshape(self.rf, (nr, nx, ny))
+        self.jp = np.reshape(self.jp, (nr, nx, ny))
+        self.ir = np.reshape(self.ir, (nr, nx, ny))
+        self.ij = np.reshape(self.ij, (nr, nx, ny))
 
     def gridpoint2index(self, ix, iy, iz):
         """
@@ -870,8 +986,9 @@ class VM(object):
         """
         Find x indices for x coordinates.
 
-        :param x: list of x coordinates in the model
-        :returns: list of nearest x index for the given coordinates
+        :param x: x coordinate or array of x coordinates in the model
+        :returns: ``numpy.ndarray`` of nearest x indices for the given
+            coordinates
         """
         return x2i(x, self.r1[0], self.dx, self.nx) 
 
@@ -915,10 +1032,11 @@ class VM(object):
 
     def y2i(self, y):
         """
-        Find a y index for a y coordinate.
+        Find y indices for y coordinates.
 
-        :param y: list of y coordinates in the model
-        :returns: list of nearest y index for the given coordinates
+        :param y: y coordinate or array of y coordinates in the model
+        :returns: ``numpy.ndarray`` of nearest y indices for the given
+            coordinates
         """
         return x2i(y, self.r1[1], self.dy, self.ny) 
 
@@ -962,10 +1080,11 @@ class VM(object):
 
     def z2i(self, z):
         """
-        Find a z index for a z coordinate.
+        Find z indices for z coordinates.
 
-        :param y: list of y coordinates in the model
-        :returns: list of nearest y index for the given coordinates
+        :param z: z coordinate or array of z coordinates in the model
+        :returns: ``numpy.ndarray`` of nearest z indices for the given
+            coordinates
         """
         return x2i(z, self.r1[2], self.dz, self.nz) 
 
@@ -1060,58 +1179,48 @@ class VM(object):
         :param x,y: Lists of coordinates to take slice along.
         :param dx: Grid spacing for the new model. Default is to use
             the x-coordinate spacing of the current model.
-        :returns: VM model along the specified line
-
-        .. warning:: Fails with constant x-slices.
+        :returns: VM model along the specified line. Slowness, interface
+            depths and slowness jumps are bilinearly interpolated from the
+            surrounding columns, and interface flags are taken from the
+            nearest column.
         """
         assert len(x) == len(y), 'x and y must be the same length'
         assert max(x) <= self.r2[0], 'x coordinates exceed model domain'
         assert min(x) >= self.r1[0], 'x coordinates exceed model domain'
         assert max(y) <= self.r2[1], 'y coordinates exceed model domain'
         assert min(y) >= self.r1[1], 'y coordinates exceed model domain'
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
         # Calculate distance along line
-        _xline = [0]
-        for i in range(1, len(x)):
-            x0 = x[i - 1]
-            y0 = y[i - 1]
-            x1 = x[i]
-            y1 = y[i]
-            deltx = np.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
-            _xline.append(_xline[i - 1] + deltx)
+        _xline = np.zeros(len(x))
+        _xline[1:] = np.cumsum(np.sqrt(np.diff(x) ** 2 + np.diff(y) ** 2))
         # Setup new model
         if dx is None:
             dx = self.dx
         vm = VM(r1=(min(_xline), 0, self.r1[2]),
                 r2=(max(_xline) - dx, 0, self.r2[2]),
                 dx=dx, dy=1, dz=self.dz, nr=self.nr)
-        # Pull slowness grid and interface values along line
-        interp_y = interp1d(x, y)
-        interp_x = interp1d(_xline, x)
-        for _ixl, _xl in enumerate(vm.x):
-            # get coordinates of position on line
-            try:
-                _x = interp_x(_xl)
-            except ValueError as e:
-                msg = ' (min, max x-coordinate in 2D model is'
-                msg += ' {:}, {:}'.format(min(_xline), max(_xline))
-                msg += '; at x = {:}.)'.format(_xl)
-                raise ValueError(e.message + msg)
-            _y = interp_y(_x)
-            # get indices in 3D model
-            ix = self.x2i([_x])[0]
-            iy = self.y2i([_y])[0]
-            # get slowness collumn
-            vm.sl[_ixl][0] = self.sl[ix][iy]
-            # get interfaces
-            for iref in range(0, self.nr):
-                vm.rf[iref][_ixl][0] = self.rf[iref][ix][iy]
-                vm.jp[iref][_ixl][0] = self.jp[iref][ix][iy]
-                vm.ir[iref][_ixl][0] = self.ir[iref][ix][iy]
-                vm.ij[iref][_ixl][0] = self.ij[iref][ix][iy]
-        vm.rf = np.asarray(vm.rf)
-        vm.jp = np.asarray(vm.jp)
-        vm.ir = np.asarray(vm.ir)
-        vm.ij = np.asarray(vm.ij)
+        # Get coordinates of positions on line
+        _x = np.interp(vm.x, _xline, x)
+        _y = np.interp(vm.x, _xline, y)
+        # Bilinear interpolation of slowness and interfaces
+        ix0, ix1, wx = linear_weights(_x, self.r1[0], self.dx, self.nx)
+        iy0, iy1, wy = linear_weights(_y, self.r1[1], self.dy, self.ny)
+        corners = [(ix0, iy0, (1 - wx) * (1 - wy)),
+                   (ix1, iy0, wx * (1 - wy)),
+                   (ix0, iy1, (1 - wx) * wy),
+                   (ix1, iy1, wx * wy)]
+        sl = sum([w[:, np.newaxis] * self.sl[ix, iy] for ix, iy, w in corners])
+        vm.sl = sl[:, np.newaxis, :]
+        vm.rf = sum([w * self.rf[:, ix, iy] for ix, iy, w in corners])\
+                [:, :, np.newaxis]
+        vm.jp = sum([w * self.jp[:, ix, iy] for ix, iy, w in corners])\
+                [:, :, np.newaxis]
+        # Interface flags from the nearest column
+        ix = nearest_index(_x, self.r1[0], self.dx, self.nx)
+        iy = nearest_index(_y, self.r1[1], self.dy, self.ny)
+        vm.ir = self.ir[:, ix, iy][:, :, np.newaxis]
+        vm.ij = self.ij[:, ix, iy][:, :, np.newaxis]
         return vm
 
     def remove_interface(self, iref, apply_jumps=False):
@@ -1638,13 +1747,100 @@ class VM(object):
         ilyr: int
             Index of the layer that the point is within.
         """
-        ix = self.x2i([x])[0]
-        iy = self.y2i([y])[0]
-        for iref in range(self.nr + 1):
-            z0, z1 = self.get_layer_bounds(iref)
-            if (z >= z0[ix, iy]) and (z <= z1[ix, iy]):
-                return iref
-        return None
+        ilyr = int(self.points2layers([x], [y], [z])[0])
+        if ilyr < 0:
+            return None
+        return ilyr
+
+    def points2layers(self, x, y, z):
+        """
+        Find the layers that points are in.
+
+        Interface depths are taken from the nearest grid column to each
+        point.  Points on an interface are assigned to the layer above it.
+
+        Parameters
+        ----------
+        x, y, z: array_like
+            x, y, z coordinates of the points. Must all be the same size.
+
+        Returns
+        -------
+        ilyr: numpy.ndarray
+            Index of the layer that each point is within, or ``-1`` for
+            points outside of the model.
+        """
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        ix = self.x2i(x)
+        iy = self.y2i(y)
+        # top and bottom boundaries of each layer at each point
+        rf = self.rf[:, ix, iy]
+        top = np.vstack((self.r1[2] * np.ones((1, len(z))), rf))
+        bottom = np.vstack((rf, self.r2[2] * np.ones((1, len(z)))))
+        inside = (z >= top) & (z <= bottom)
+        return np.where(inside.any(axis=0), inside.argmax(axis=0), -1)
+
+    def sample(self, x, y, z, grid='velocity', respect_layers=True):
+        """
+        Sample a model grid at points by trilinear interpolation.
+
+        Points outside of the model are moved to the nearest edge of the
+        model.
+
+        Parameters
+        ----------
+        x, y, z: array_like
+            x, y, z coordinates of the points. Must be broadcastable to the
+            same shape.
+        grid: {'velocity', 'slowness', 'twt', numpy.ndarray}
+            Grid to sample. Options are 'velocity' (default), 'slowness',
+            'twt' (two-way travel time), or an array with shape
+            ``(nx, ny, nz)``.
+        respect_layers: bool
+            If ``True`` (default), values are not interpolated from nodes
+            on the far side of an interface with a non-zero slowness jump.
+            Points without any nodes on their side of such an interface
+            are interpolated from all surrounding nodes.
+
+        Returns
+        -------
+        values: numpy.ndarray
+            Interpolated values with the same shape as the broadcast
+            coordinates.
+        """
+        if isinstance(grid, str):
+            grid = self.grids.__getattribute__(grid)
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                      np.asarray(y, dtype=float),
+                                      np.asarray(z, dtype=float))
+        shape = x.shape
+        x, y, z = x.ravel(), y.ravel(), z.ravel()
+        nodes = [linear_weights(x, self.r1[0], self.dx, self.nx),
+                 linear_weights(y, self.r1[1], self.dy, self.ny),
+                 linear_weights(z, self.r1[2], self.dz, self.nz)]
+        # indices and weights of the 8 nodes surrounding each point
+        ix, iy, iz, w = [], [], [], []
+        for corner in itertools.product((0, 1), repeat=3):
+            i = [n[c] for n, c in zip(nodes, corner)]
+            ix.append(i[0])
+            iy.append(i[1])
+            iz.append(i[2])
+            w.append(np.prod([n[2] if c else 1 - n[2]
+                              for n, c in zip(nodes, corner)], axis=0))
+        ix, iy, iz, w = [np.asarray(v) for v in (ix, iy, iz, w)]
+        if respect_layers and (self.nr > 0):
+            # total jump magnitude above each layer at each column
+            jumps = np.zeros((self.nr + 1, self.nx, self.ny))
+            jumps[1:] = np.cumsum(np.abs(self.jp), axis=0)
+            ilyr = self.points2layers(x, y, np.clip(z, self.r1[2],
+                                                    self.r2[2]))
+            nlyr = self.layers[ix, iy, iz]
+            same = jumps[nlyr, ix, iy] == jumps[ilyr, ix, iy]
+            wl = np.where(same, w, 0.)
+            total = wl.sum(axis=0)
+            w = np.where(total > 0, wl / np.where(total > 0, total, 1.), w)
+        values = np.sum(w * np.asarray(grid)[ix, iy, iz], axis=0)
+        return values.reshape(shape)
 
 
     # Properties
@@ -1780,15 +1976,40 @@ class VM(object):
     def _get_layers(self):
         """
         Returns a grid of layer indices for each node in the slowness grid.
+
+        The grid is cached until the interface depths or grid dimensions
+        change, and is returned as a read-only array.
+        """
+        key = (self.nx, self.ny, self.nz, self.r1[2], self.dz)
+        cache = getattr(self, '_layers_cache', None)
+        if (cache is not None) and (cache[0] == key)\
+           and np.array_equal(cache[1], self.rf):
+            return cache[2]
+        lyr = self._calc_layers()
+        lyr.flags.writeable = False
+        self._layers_cache = (key, np.array(self.rf, copy=True), lyr)
+        return lyr
+
+    def _calc_layers(self):
         """
-        lyr = np.ones((self.nx, self.ny, self.nz))
+        Calculate a grid of layer indices for each node in the slowness grid.
+
+        Nodes between the top and bottom boundaries of a layer are assigned
+        the layer index, with deeper layers taking precedence where
+        boundaries share a node.
+        """
+        dtype = np.int8 if self.nr < 127 else np.int16
+        lyr = np.ones((self.nx, self.ny, self.nz), dtype=dtype)
+        iz = np.arange(self.nz)
         for iref in range(self.nr + 1):
             # top, bottom boundary depths for current layer
             z0, z1 = self.get_layer_bounds(iref)
-            for ix in range(0, self.nx):
-                for iy in range(0, self.ny):
-                    iz = self.zrange2i(z0[ix, iy], z1[ix, iy])
-                    lyr[ix, iy, iz] = iref
+            iz0 = nearest_index(np.maximum(self.r1[2], z0), self.r1[2],
+                                self.dz, self.nz)
+            iz1 = nearest_index(np.minimum(self.r2[2], z1), self.r1[2],
+                                self.dz, self.nz)
+            lyr[(iz >= iz0[:, :, np.newaxis])
+                & (iz <= iz1[:, :, np.newaxis])] = iref
         return lyr
     layers = property(fget=_get_layers)
 
@@ -1806,6 +2027,31 @@ class VMGrids(object):
         self.ymin = ymin
         self.zmin = zmin
 
+    def modified(self):
+        """
+        Mark the grids as modified.
+
+        Cached grids derived from the slowness grid are recalculated after
+        the slowness grid is replaced or this method is called.  Call it
+        after changing values in the slowness grid in place.
+        """
+        self.version = next(_grid_versions)
+
+    def _get_slowness(self):
+        """
+        Returns the main slowness grid.
+        """
+        return self._slowness
+
+    def _set_slowness(self, value):
+        """
+        Sets the main slowness grid.
+        """
+        self._slowness = value
+        self.modified()
+
+    slowness = property(fget=_get_slowness, fset=_set_slowness)
+
     def _get_nx(self):
         """
         Returns the number of x-nodes in the model grid.
@@ -1830,12 +2076,18 @@ class VMGrids(object):
     
     def _get_twt(self):
         """
-        Returns the model grid in verticle two-way travel time
+        Returns the model grid in verticle two-way travel time.
+
+        The grid is cached until the slowness grid is modified, and is
+        returned as a read-only array.
         """
+        cache = getattr(self, '_twt_cache', None)
+        if (cache is not None) and (cache[0] == self.version):
+            return cache[1]
         twt = 2 * self.dz * np.cumsum(self.slowness, axis=2)
-        for ix in range(self.nx):
-            for iy in range(self.ny):
-                twt[ix, iy, :] -= twt[ix, iy, 0]
+        twt -= twt[:, :, :1]
+        twt.flags.writeable = False
+        self._twt_cache = (self.version, twt)
         return twt
     twt = property(fget=_get_twt)
 
@@ -1880,16 +2132,11 @@ class VMTime(object):
         units = ', '.join(['{:} [{:}]'.format(v, UNITS[v])\
                 for v in ['x', 'y', 'twt', grid]])
         file.write('# {:}\n'.format(units))
-        twt = self.twt[:]
-        nt = len(twt)
-        grd = self.grids.__getattribute__(grid)[:, :, :]
-        for ix in range(0, self._vm.nx):
-            x = (self._vm.r1[0] + ix * self._vm.dx)
-            for iy in range(0, self._vm.ny):
-                y = (self._vm.r1[1] + iy * self._vm.dy)
-                for it in range(0, nt):
-                    file.write('{:}, {:}, {:}, {:}\n'\
-                               .format(x, y, twt[it], grd[ix, iy, it]))
+        _write_grid_rows(file,
+                         self._vm.r1[0] + np.arange(self._vm.nx) * self._vm.dx,
+                         self._vm.r1[1] + np.arange(self._vm.ny) * self._vm.dy,
+                         self.twt, self.grids.__getattribute__(grid), '%.12g',
+                         delimiter=', ')
         file.close()
 
         
@@ -1929,23 +2176,27 @@ class VMTime(object):
 
     def _get_sl(self):
         """
-        Interpolates a grid of slowness values for a uniform time grid
-        """
-        sl = np.zeros((self._vm.nx, self._vm.ny, len(self.twt)))
-        for ix in self._vm.xrange2i():
-            for iy in self._vm.yrange2i():
-                twt2sl = interp1d(self._vm.grids.twt[ix, iy, :],
-                        self._vm.grids.slowness[ix, iy, :], kind='linear')
-                sl[ix, iy, :] = twt2sl(self.twt)
+        Interpolates a grid of slowness values for a uniform time grid.
 
-        return sl
+        Values below the base of the model in a column are ``nan``.
+        """
+        return _interp_columns(self.twt, self._vm.grids.twt,
+                               self._vm.grids.slowness)
 
     def _get_grids(self):
         """
-        Reinitializes the grids
+        Returns the grids in time.
+
+        The grids are cached until the depth model is modified or ``dt``
+        changes.
         """
+        key = (self._vm.grids.version, self.dt)
+        cache = getattr(self, '_grids_cache', None)
+        if (cache is not None) and (cache[0] == key):
+            return cache[1]
         grids = VMGrids(self._vm.dx, self._vm.dy, self.dt, self._get_sl(),
                 xmin=self._vm.r1[0], ymin=self._vm.r1[1], zmin=0)
+        self._grids_cache = (key, grids)
         return grids
 
     grids = property(fget=_get_grids)
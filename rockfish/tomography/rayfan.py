@@ -3,11 +3,17 @@ Support for working with VM Tomography binary rayfan files.
 """
 import os
 import warnings
-from struct import unpack
+import zlib
+import sqlite3
+import itertools
+import copy
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from scipy import sparse
 from rockfish.utils.dictlistutil import get_dict_default
 from rockfish.io import pack
 from rockfish.picking.database import PickDatabaseConnection
+from rockfish.tomography.model import _read_array
 import logging
 import numpy as np
 
@@ -26,9 +32,130 @@ RAYPATH_FIELDS = [#(name, sql_type, default_value, is_not_null, is_primary)
                   ('ray_btm_x', 'REAL', None, False, False),
                   ('ray_btm_y', 'REAL', None, False, False),
                   ('ray_btm_z', 'REAL', None, False, False),
-                  ('ray_x', 'TEXT', None, False, False),
-                  ('ray_y', 'TEXT', None, False, False),
-                  ('ray_z', 'TEXT', None, False, False)]
+                  ('path', 'BLOB', None, False, False)]
+
+# codecs for raypaths stored as BLOBs, identified by the first byte
+RAYPATH_CODECS = {'raw': 'R', 'zlib': 'Z'}
+RAYPATH_DTYPE = '<f4'
+
+# structure of the seek table for random access to rayfans
+SEEK_TABLE_DTYPE = [('start_point_id', 'i4'), ('offset', 'i8'),
+                    ('nrays', 'i4'), ('npoints', 'i8')]
+SEEK_TABLE_SUFFIX = '.idx'
+
+# maximum number of values in a single SQL query
+SQL_BATCH_SIZE = 500
+
+# unique versions of rayfan data for validating cached values
+_rayfan_versions = itertools.count()
+
+
+def _seek_table_filename(file):
+    """
+    Returns the name of the seek table sidecar for an open rayfan file, or
+    ``None`` if the file is not on the disk.
+    """
+    filename = getattr(file, 'name', None)
+    if not isinstance(filename, basestring) or not os.path.isfile(filename):
+        return None
+    return filename + SEEK_TABLE_SUFFIX
+
+
+def _file_stat(file):
+    """
+    Returns the size and modification time of an open file, which identify
+    the version of a rayfan file that a seek table was built for.
+    """
+    stat = os.fstat(file.fileno())
+    return np.array([stat.st_size, stat.st_mtime])
+
+
+def _cached_property(calc):
+    """
+    Make a read-only property that caches the value returned by ``calc``.
+
+    Cached values are recalculated when the value returned by the
+    ``_cache_key`` method of the instance changes, and arrays are returned
+    as read-only arrays.
+    """
+    name = calc.__name__
+    def fget(self):
+        key = self._cache_key()
+        cache = self.__dict__.setdefault('_cache', {})
+        if (name not in cache) or (cache[name][0] != key):
+            value = calc(self)
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            cache[name] = (key, value)
+        return cache[name][1]
+    return property(fget=fget, doc=calc.__doc__)
+
+
+def _write_array(file, values, dtype):
+    """
+    Write values to a file as binary data with the given data type.
+    """
+    file.write(np.asarray(values, dtype=dtype).tobytes())
+
+
+def _write_header(file, n, endian='@',
+                  rayfan_version=DEFAULT_RAYFAN_VERSION):
+    """
+    Write the header of a rayfan file with ``n`` rayfans.
+    """
+    dtype = pack.numpy_byteorder(endian) + 'i4'
+    if rayfan_version > 1:
+        _write_array(file, [-rayfan_version, n], dtype)
+    else:
+        _write_array(file, [n], dtype)
+
+
+def _block_sizes(seek_table, rayfan_version):
+    """
+    Returns the size in bytes of each rayfan in a seek table.
+    """
+    nstatic = 4 if rayfan_version > 1 else 0
+    return 12 + nstatic + 28 * seek_table['nrays'].astype(np.int64)\
+            + 12 * seek_table['npoints']
+
+
+def _copy_rayfans(rays, file, idx, endian='@', chunk_size=16777216):
+    """
+    Copy rayfans from a rayfan file to another rayfan file.
+
+    Rayfans are copied byte for byte if the files have the same format
+    version. Otherwise, they are read and rewritten.
+
+    :param rays: :class:`RayfanGroup` with an open file and seek table.
+    :param file: An open file-like object to copy rayfans to.
+    :param idx: Indices of rayfans in the seek table to copy.
+    :param endian: Optional. The endianness of the files. Default is
+        to use machine's native byte order.
+    :param chunk_size: Optional. Maximum number of bytes to copy at once.
+    """
+    offsets = rays.seek_table['offset'][idx]
+    sizes = _block_sizes(rays.seek_table, rays.FORMAT)[idx]
+    for offset, size in zip(offsets, sizes):
+        rays.file.seek(offset)
+        if rays.FORMAT != DEFAULT_RAYFAN_VERSION:
+            Rayfan(rays.file, endian=endian, rayfan_version=rays.FORMAT)\
+                    .write(file, endian=endian)
+            continue
+        while size > 0:
+            data = rays.file.read(min(size, chunk_size))
+            if len(data) == 0:
+                raise RayfanReadingError('Unexpected end of rayfan file.')
+            file.write(data)
+            size -= len(data)
+
+
+def _open_rayfans(file, endian='@'):
+    """
+    Open a rayfan file and load its seek table without reading any rayfans.
+    """
+    rays = RayfanGroup()
+    rays.read(file, endian=endian, start_points=[])
+    return rays
 
 
 class RayfanError(Exception):
@@ -77,7 +204,7 @@ class RayfanGroup(object):
         sng += ' Chi^2 = {:}, rms = {:}'.format(self.chi2, self.rms)
         return sng
 
-    def read(self, file, endian='@'):
+    def read(self, file, endian='@', start_points=None):
         """
         Read rayfan data from a rayfan file.
 
@@ -85,6 +212,9 @@ class RayfanGroup(object):
             assumed to be a filename.
         :param endian: Optional. The endianness of the file. Default is
             to use machine's native byte order.
+        :param start_points: Optional. ``list`` of start point IDs of the
+            rayfans to read. Rayfans are located with the seek table (see
+            :meth:`read_seek_table`). Default is to read all rayfans.
         """
         if not hasattr(file, 'read') or not hasattr(file, 'tell') or not \
             hasattr(file, 'seek'):
@@ -92,7 +222,24 @@ class RayfanGroup(object):
         else:
             file.seek(0)
         self.file = file
-        self._read(file, endian=endian)
+        if start_points is None:
+            self._read(file, endian=endian)
+            self._write_seek_table()
+        else:
+            self._read_start_points(file, start_points, endian=endian)
+
+    def _read_header(self, file, endian='@'):
+        """
+        Read the file header and return the number of rayfans in the file.
+        """
+        dtype = pack.numpy_byteorder(endian) + 'i4'
+        n = int(_read_array(file, dtype, 1)[0])
+        if n < 0:
+            self.FORMAT = -n
+            n = int(_read_array(file, dtype, 1)[0])
+        else:
+            self.FORMAT = 1
+        return n
 
     def _read(self, file, endian='@'):
         """
@@ -103,26 +250,148 @@ class RayfanGroup(object):
         :param endian: Optional. The endianness of the file. Default is
             to use machine's native byte order.
         """
-        # Read file header
-        fmt = '{:}i'.format(endian)
-        n = unpack(fmt, file.read(4))[0]
-        if n < 0:
-            self.FORMAT = -n
-            n = unpack(fmt, file.read(4))[0]
-        else:
-            self.FORMAT = 1
+        n = self._read_header(file, endian=endian)
         # Read the individual rayfans
         self.rayfans = []
+        self.seek_table = np.zeros(n, dtype=SEEK_TABLE_DTYPE)
         for i in range(0, n):
+            pos = file.tell()
+            rfn = Rayfan(file, endian=endian, rayfan_version=self.FORMAT)
+            self.seek_table[i] = (rfn.start_point_id, pos, rfn.nrays,
+                                  len(rfn.points))
+            self.rayfans.append(rfn)
+
+    def _read_start_points(self, file, start_points, endian='@'):
+        """
+        Read rayfans for a subset of start points from a rayfan file.
+
+        :param file: An open file-like object with the file pointer set at the
+            beginning of a rayfan file.
+        :param start_points: ``list`` of start point IDs of the rayfans
+            to read.
+        :param endian: Optional. The endianness of the file. Default is
+            to use machine's native byte order.
+        """
+        self.read_seek_table(endian=endian)
+        file.seek(0)
+        self._read_header(file, endian=endian)
+        self.rayfans = []
+        idx = np.in1d(self.seek_table['start_point_id'], start_points)
+        for offset in self.seek_table['offset'][idx]:
+            file.seek(offset)
             self.rayfans.append(Rayfan(file, endian=endian,
                                        rayfan_version=self.FORMAT))
 
+    def read_seek_table(self, endian='@'):
+        """
+        Read or build the seek table for the rayfan file.
+
+        The seek table is a ``numpy`` record array with the start point ID,
+        byte offset, number of rays, and number of raypath points for each
+        rayfan in the file. It is stored in a sidecar file with the name of
+        the rayfan file plus ``'.idx'``, and is rebuilt by scanning the
+        rayfan headers if the sidecar is missing or the size or
+        modification time of the rayfan file has changed.
+
+        :param endian: Optional. The endianness of the file. Default is
+            to use machine's native byte order.
+        :returns: The seek table, which is also stored as
+            :attr:`seek_table`.
+        """
+        sidecar = self._load_seek_table()
+        if sidecar is not None:
+            self.seek_table, self.FORMAT = sidecar
+        else:
+            self._scan_headers(endian=endian)
+            self._write_seek_table()
+        return self.seek_table
+
+    def _load_seek_table(self):
+        """
+        Load the seek table and format version from the sidecar file.
+
+        :returns: ``(table, format)``, or ``None`` if the sidecar does not
+            exist or was built for a different version of the rayfan file.
+        """
+        filename = _seek_table_filename(self.file)
+        if filename is None or not os.path.isfile(filename):
+            return None
+        try:
+            with np.load(filename) as sidecar:
+                if np.array_equal(sidecar['stat'], _file_stat(self.file)):
+                    return sidecar['table'], int(sidecar['format'])
+        except (IOError, KeyError, ValueError):
+            pass
+        return None
+
+    def _scan_headers(self, endian='@'):
+        """
+        Build the seek table by reading only the header of each rayfan.
+        """
+        file = self.file
+        file.seek(0)
+        n = self._read_header(file, endian=endian)
+        dtype = pack.numpy_byteorder(endian) + 'i4'
+        self.seek_table = np.zeros(n, dtype=SEEK_TABLE_DTYPE)
+        nstatic = 4 if self.FORMAT > 1 else 0
+        for i in range(0, n):
+            pos = file.tell()
+            start_point_id, nrays, _ = _read_array(file, dtype, 3)
+            # skip to the raypath lengths
+            file.seek(pos + 12 + nstatic + 12 * nrays)
+            npoints = int(np.sum(_read_array(file, dtype, nrays)))
+            self.seek_table[i] = (start_point_id, pos, nrays, npoints)
+            # skip the times and raypaths
+            file.seek(file.tell() + 12 * nrays + 12 * npoints)
+
+    def _write_seek_table(self):
+        """
+        Write the seek table to a sidecar file, if it is out of date.
+        """
+        filename = _seek_table_filename(self.file)
+        if filename is None or self._load_seek_table() is not None:
+            return
+        try:
+            f = open(filename, 'wb')
+            np.savez(f, table=self.seek_table, format=self.FORMAT,
+                     stat=_file_stat(self.file))
+            f.close()
+        except IOError:
+            logging.debug('Could not write seek table to {:}'
+                          .format(filename))
+
+    def write(self, file, endian='@',
+              rayfan_version=DEFAULT_RAYFAN_VERSION):
+        """
+        Write rayfans to a rayfan file.
+
+        :param file: An open file-like object or a string which is
+            assumed to be a filename.
+        :param endian: Optional. The endianness of the file. Default is
+            to use machine's native byte order.
+        :param rayfan_version: Optional. Sets the version number of the
+            rayfan file format. Default is version 2.
+        """
+        if not hasattr(file, 'write'):
+            f = open(file, 'wb')
+        else:
+            f = file
+        _write_header(f, len(self.rayfans), endian, rayfan_version)
+        for rfn in self.rayfans:
+            rfn.write(f, endian=endian, rayfan_version=rayfan_version)
+        if f is not file:
+            f.close()
+
     def plot_raypaths(self, dim=[0, 2], ax=None, receivers=True,
                       sources=True, outfile=None, event_colors={},
-                      default_color=DEFAULT_RAYPATH_COLOR):
+                      default_color=DEFAULT_RAYPATH_COLOR, decimate=1,
+                      subsample=1):
         """
         Plot all raypaths.
 
+        Raypaths are drawn as a single
+        :class:`matplotlib.collections.LineCollection` for each event.
+
         :param dim: Coordinate dimensions to plot paths into. Default is z
             vs. x (``dim=[0,2]``).
         :param ax:  A :class:`matplotlib.Axes.axes` object to plot
@@ -142,6 +411,11 @@ class RayfanGroup(object):
             ``default_color``.
         :param default_color: Optional. Color to use when plotting raypaths
             for events not in ``event_colors``.  Default is grey.
+        :param decimate: Optional. Only plot every ``decimate``-th point in
+            each raypath. The last point is always plotted. Default is to
+            plot all points.
+        :param subsample: Optional. Only plot every ``subsample``-th ray.
+            Default is to plot all rays.
         """
         if ax is None:
             fig = plt.figure()
@@ -151,21 +425,34 @@ class RayfanGroup(object):
         else:
             reverse = False
             show = False
-        for irfn, rfn in enumerate(self.rayfans):
-            for i, path in enumerate(rfn.paths):
-                x = [p[dim[0]] for p in path]
-                y = [p[dim[1]] for p in path]
-                c = get_dict_default(rfn.event_ids[i], event_colors,
-                                     default_color)
-                ax.plot(x, y, color=c)
-                if receivers:
-                    x = rfn.paths[i][-1][dim[0]]
-                    y = rfn.paths[i][-1][dim[1]]
-                    ax.plot(x, y, 'vy')
-                if sources:
-                    x = rfn.endpoints[i][dim[0]]
-                    y = rfn.endpoints[i][dim[1]]
-                    ax.plot(x, y, '*r')
+        points, path_offsets = _raypath_arrays(self)
+        event_ids = np.concatenate([rfn.event_ids for rfn in self.rayfans]
+                                   or [[]]).astype(int)
+        # rays to plot
+        lens = np.diff(path_offsets)
+        iray = np.arange(0, len(lens), subsample)
+        iray = iray[lens[iray] > 0]
+        lens = lens[iray]
+        event_ids = event_ids[iray]
+        # points to plot in each ray
+        npts = (lens - 1 + decimate - 1) // decimate + 1
+        step = np.arange(npts.sum()) - np.repeat(np.cumsum(npts) - npts,
+                                                 npts)
+        ipts = np.repeat(path_offsets[iray], npts)\
+                + np.minimum(decimate * step, np.repeat(lens - 1, npts))
+        xy = points[ipts][:, dim]
+        paths = np.split(xy, np.cumsum(npts)[:-1]) if len(npts) > 0 else []
+        for ev in np.unique(event_ids):
+            segments = [p for p, _ev in zip(paths, event_ids) if _ev == ev]
+            color = get_dict_default(ev, event_colors, default_color)
+            ax.add_collection(LineCollection(segments, colors=color))
+        ax.autoscale_view()
+        if receivers:
+            last = xy[np.cumsum(npts) - 1]
+            ax.plot(last[:, 0], last[:, 1], 'vy')
+        if sources:
+            first = xy[np.cumsum(npts) - npts]
+            ax.plot(first[:, 0], first[:, 1], '*r')
         if reverse:
             ax.set_ylim(ax.get_ylim()[::-1])
         if outfile:
@@ -351,39 +638,46 @@ class RayfanGroup(object):
         else:
             plt.draw()
 
+    def _cache_key(self):
+        """
+        Returns the versions of all rayfans, which change if rayfans are
+        added, removed, or modified.
+        """
+        return tuple(rfn.version for rfn in self.rayfans)
+
     def _get_all_azimuths(self):
         """
-        Returns a list of all azimuths in the rayfans.
+        Returns an array of all azimuths in the rayfans.
         """
         return np.concatenate([rfn.azimuths for rfn in self.rayfans])
-    azimuths = property(fget=_get_all_azimuths)
+    azimuths = _cached_property(_get_all_azimuths)
 
     def _get_all_offsets(self):
         """
-        Returns a list of all azimuths in the rayfans.
+        Returns an array of all offsets in the rayfans.
         """
         return np.concatenate([rfn.offsets for rfn in self.rayfans])
-    offsets = property(fget=_get_all_offsets)
+    offsets = _cached_property(_get_all_offsets)
 
     def _get_all_residuals(self):
         """
-        Returns a list of all residuals in the rayfans.
+        Returns an array of all residuals in the rayfans.
         """
         return np.concatenate([rfn.residuals for rfn in self.rayfans])
-    residuals = property(fget=_get_all_residuals)
+    residuals = _cached_property(_get_all_residuals)
 
     def _get_all_bottom_points(self):
         """
-        Returns a list of all ray bottom points.
+        Returns an array of all ray bottom points.
         """
         return np.concatenate([rfn.bottom_points for rfn in self.rayfans])
-    bottom_points = property(fget=_get_all_bottom_points)
+    bottom_points = _cached_property(_get_all_bottom_points)
 
     def _get_nrays(self):
         """
         Returns the total number of rays in all rayfans.
         """
-        return len(self._get_all_offsets())
+        return sum([rfn.nrays for rfn in self.rayfans])
     nrays = property(fget=_get_nrays)
 
     def _calc_mean_rms(self):
@@ -391,14 +685,14 @@ class RayfanGroup(object):
         Calculate mean RMS of all rayfans.
         """
         return np.mean([rfn.rms for rfn in self.rayfans])
-    rms = property(fget=_calc_mean_rms)
+    rms = _cached_property(_calc_mean_rms)
 
     def _calc_mean_chi2(self):
         """
         Calculate mean Chi-squared value for all rayfans.
         """
         return np.mean([rfn.chi2_mean for rfn in self.rayfans])
-    chi2 = property(fget=_calc_mean_chi2)
+    chi2 = _cached_property(_calc_mean_chi2)
 
 
 class Rayfan(object):
@@ -406,7 +700,7 @@ class Rayfan(object):
     Class for working with a single rayfan.
     """
     def __init__(self, file, endian='@',
-                 rayfan_version=DEFAULT_RAYFAN_VERSION):
+                 rayfan_version=DEFAULT_RAYFAN_VERSION, skip_paths=False):
         """
         Class for handling an individual rayfan.
 
@@ -416,26 +710,37 @@ class Rayfan(object):
             to use machine's native byte order.
         :param rayfan_version: Optional. Sets the version number of the
             rayfan file format. Default is version 2.
+        :param skip_paths: Optional. If ``True``, raypath coordinates are
+            skipped. Default is ``False``.
         """
-        self.read(file, endian=endian, rayfan_version=rayfan_version)
+        self.read(file, endian=endian, rayfan_version=rayfan_version,
+                  skip_paths=skip_paths)
 
-    def read(self, file, endian='@', rayfan_version=DEFAULT_RAYFAN_VERSION):
+    def read(self, file, endian='@', rayfan_version=DEFAULT_RAYFAN_VERSION,
+             skip_paths=False):
         """
         Read data for a single rayfan.
 
+        Coordinates for all raypaths are read into a single ``(npoints, 3)``
+        array, :attr:`points`. The points for raypath ``i`` are
+        ``points[path_offsets[i]:path_offsets[i + 1]]``.
+
         :param file: An open file-like object with the file pointer set at the
             beginning of a rayfan file.
         :param endian: Optional. The endianness of the file. Default is
             to use machine's native byte order.
         :param rayfan_version: Optional. Sets the version number of the
             rayfan file format. Default is version 2.
+        :param skip_paths: Optional. If ``True``, the file pointer is moved
+            past the raypath coordinates without reading them, and
+            :attr:`points` is set to ``None``.  Values derived from the
+            raypaths are then not available. Default is ``False``.
         """
         filesize = os.fstat(file.fileno()).st_size
+        endian = pack.numpy_byteorder(endian)
         # read the rayfan header information
-        fmt = '{:}i'.format(endian)
-        self.start_point_id = unpack(fmt, file.read(4))[0]
-        self.nrays = unpack(fmt, file.read(4))[0]
-        nsize = unpack(fmt, file.read(4))[0]
+        self.start_point_id, self.nrays, nsize = \
+                _read_array(file, endian + 'i4', 3).tolist()
         # make sure the expected amount of data exist
         pos = file.tell()
         data_left = filesize - pos
@@ -448,61 +753,146 @@ class Rayfan(object):
             raise RayfanReadingError(msg)
         # Static correction
         if rayfan_version > 1:
-            fmt = '{:}f'.format(endian)
-            self.static_correction = unpack(fmt, file.read(4))[0]
+            self.static_correction = \
+                    float(_read_array(file, endian + 'f4', 1)[0])
         else:
             self.static_correction = 0.
         # ID arrays and sizes
-        fmt = '{:}'.format(endian) + 'i' * self.nrays
-        self.end_point_ids = unpack(fmt, file.read(4 * self.nrays))
-        self.event_ids = unpack(fmt, file.read(4 * self.nrays))
-        self.event_subids = unpack(fmt, file.read(4 * self.nrays))
-        lens = unpack(fmt, file.read(4 * self.nrays))  # raypath length
+        ids = _read_array(file, endian + 'i4', 4 * self.nrays)
+        self.end_point_ids, self.event_ids, self.event_subids, lens = \
+                ids.reshape(4, self.nrays).astype(int)
         # Picks, travel-times, and errors
-        fmt = '{:}'.format(endian) + 'f' * self.nrays
-        self.pick_times = unpack(fmt, file.read(4 * self.nrays))
-        self.travel_times = unpack(fmt, file.read(4 * self.nrays))
-        self.pick_errors = unpack(fmt, file.read(4 * self.nrays))
+        times = _read_array(file, endian + 'f4', 3 * self.nrays)
+        self.pick_times, self.travel_times, self.pick_errors = \
+                times.reshape(3, self.nrays).astype(float)
         # Actual ray path coordinates
-        self.paths = []
-        for i in range(0, self.nrays):
-            fmt = '{:}'.format(endian) + 'f' * 3 * lens[i]
-            self.paths.append(np.reshape(
-                unpack(fmt, file.read(4 * 3 * lens[i])),
-                (lens[i], 3)))
-        # Endpoint coordinates
-        self.endpoints = []
-        for path in self.paths:
-            if len(path) > 0:
-                self.endpoints.append(path[0])
-            else:
-                self.endpoints.append([None, None, None])
+        self.path_offsets = np.zeros(self.nrays + 1, dtype=int)
+        np.cumsum(lens, out=self.path_offsets[1:])
+        if skip_paths:
+            file.seek(file.tell() + 12 * self.path_offsets[-1])
+            self.points = None
+        else:
+            points = _read_array(file, endian + 'f4',
+                                 3 * self.path_offsets[-1])
+            self.points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        self.modified()
+
+    def modified(self):
+        """
+        Mark the rayfan as modified.
+
+        Derived values, such as :attr:`offsets` and :attr:`residuals`, are
+        cached until this method is called.  Call it after changing any of
+        the rayfan data.
+        """
+        self.version = next(_rayfan_versions)
+
+    def _cache_key(self):
+        """
+        Returns the version of the rayfan data.
+        """
+        return self.version
+
+    def write(self, file, endian='@',
+              rayfan_version=DEFAULT_RAYFAN_VERSION):
+        """
+        Write data for a single rayfan.
+
+        :param file: An open file-like object to write the rayfan to.
+        :param endian: Optional. The endianness of the file. Default is
+            to use machine's native byte order.
+        :param rayfan_version: Optional. Sets the version number of the
+            rayfan file format. Default is version 2.
+        """
+        endian = pack.numpy_byteorder(endian)
+        lens = np.diff(self.path_offsets)
+        _write_array(file, [self.start_point_id, self.nrays, np.sum(lens)],
+                     endian + 'i4')
+        if rayfan_version > 1:
+            _write_array(file, [self.static_correction], endian + 'f4')
+        _write_array(file, [self.end_point_ids, self.event_ids,
+                            self.event_subids, lens], endian + 'i4')
+        _write_array(file, [self.pick_times, self.travel_times,
+                            self.pick_errors], endian + 'f4')
+        _write_array(file, self.points, endian + 'f4')
+
+    def select(self, rays):
+        """
+        Returns a new rayfan with a subset of the rays in this rayfan.
+
+        :param rays: Indices or boolean mask of the rays to keep.
+        :returns: :class:`Rayfan`
+        """
+        idx = np.arange(self.nrays)[rays]
+        rfn = copy.copy(self)
+        rfn.__dict__.pop('_cache', None)
+        rfn.nrays = len(idx)
+        for attr in ['end_point_ids', 'event_ids', 'event_subids',
+                     'pick_times', 'travel_times', 'pick_errors']:
+            setattr(rfn, attr, getattr(self, attr)[idx])
+        lens = np.diff(self.path_offsets)[idx]
+        rfn.path_offsets = np.zeros(rfn.nrays + 1, dtype=int)
+        np.cumsum(lens, out=rfn.path_offsets[1:])
+        # shift from new to old point indices for each point
+        shift = np.repeat(self.path_offsets[:-1][idx]
+                          - rfn.path_offsets[:-1], lens)
+        rfn.points = self.points[np.arange(rfn.path_offsets[-1]) + shift]
+        rfn.modified()
+        return rfn
+
+    def _get_paths(self):
+        """
+        Returns a list with an array of coordinates for each raypath.
+
+        Arrays are views into :attr:`points`.
+        """
+        return [self.points[i0:i1] for i0, i1 in
+                zip(self.path_offsets[:-1], self.path_offsets[1:])]
+    paths = property(fget=_get_paths)
+
+    def _get_path_ends(self):
+        """
+        Returns the first and last point of each raypath.
+
+        Coordinates are ``nan`` for empty raypaths.
+        """
+        empty = self.path_offsets[1:] == self.path_offsets[:-1]
+        i0 = np.minimum(self.path_offsets[:-1], len(self.points) - 1)
+        i1 = np.maximum(self.path_offsets[1:] - 1, 0)
+        first = np.full((self.nrays, 3), np.nan)
+        last = np.full((self.nrays, 3), np.nan)
+        if len(self.points) > 0:
+            first[~empty] = self.points[i0[~empty]]
+            last[~empty] = self.points[i1[~empty]]
+        first.flags.writeable = False
+        last.flags.writeable = False
+        return first, last
+    _path_ends = _cached_property(_get_path_ends)
+
+    def _get_endpoints(self):
+        """
+        Returns the coordinates of the first point of each raypath.
+        """
+        return self._path_ends[0]
+    endpoints = property(fget=_get_endpoints)
 
     def _calc_offsets(self):
         """
         Calculate source-reciever offset for each path.
         """
-        x = np.zeros(len(self.paths))
-        for i, path in enumerate(self.paths):
-            deltx = path[-1][0] - path[0][0]
-            delty = path[-1][1] - path[0][1]
-            x[i] = np.sqrt(deltx ** 2 + delty ** 2)
-        return x
-    offsets = property(fget=_calc_offsets)
+        first, last = self._path_ends
+        return np.sqrt(np.sum((last[:, :2] - first[:, :2]) ** 2, axis=1))
+    offsets = _cached_property(_calc_offsets)
 
     def _calc_azimuths(self):
         """
         Calculate source-receiver azimuth for each path.
         """
-        az = np.zeros(len(self.paths))
-        for i, path in enumerate(self.paths):
-            deltx = path[-1][0] - path[0][0]
-            delty = path[-1][1] - path[0][1]
-            az[i] = (90 - np.rad2deg(np.arctan2(delty, deltx)))
-            if az[i] < 0:
-                az[i] += 360.
-        return az
-    azimuths = property(fget=_calc_azimuths)
+        first, last = self._path_ends
+        deltx, delty = (last[:, :2] - first[:, :2]).T
+        az = 90 - np.rad2deg(np.arctan2(delty, deltx))
+        return np.mod(az, 360.)
+    azimuths = _cached_property(_calc_azimuths)
 
     def _calc_residuals(self):
         """
@@ -510,41 +900,52 @@ class Rayfan(object):
         """
         return np.asarray(self.travel_times) - np.asarray(self.pick_times) \
             + self.static_correction
-    residuals = property(fget=_calc_residuals)
+    residuals = _cached_property(_calc_residuals)
 
     def _calc_rms(self):
         """
         Calculate the RMS of travel-time residuals.
         """
         return np.sqrt(np.sum(self.residuals ** 2) / self.nrays)
-    rms = property(fget=_calc_rms)
+    rms = _cached_property(_calc_rms)
 
     def _calc_chi2(self):
         """
         Calculate the Chi-squared value.
         """
         return (self.residuals / self.pick_errors) ** 2
-    chi2 = property(fget=_calc_chi2)
+    chi2 = _cached_property(_calc_chi2)
 
     def _calc_mean_chi2(self):
         """
         Calculate the mean Chi-squared value.
         """
         return np.sum(self.chi2) / self.nrays
-    chi2_mean = property(fget=_calc_mean_chi2)
+    chi2_mean = _cached_property(_calc_mean_chi2)
 
     def _get_ray_bottom_points(self):
         """
         Find the bottoming point for each raypath.
         """
-        pts = np.zeros((self.nrays, 3))
-        for i, path in enumerate(self.paths):
-            pts[i] = path[np.argmax([p[2] for p in path])]
+        pts = np.full((self.nrays, 3), np.nan)
+        n = np.diff(self.path_offsets)
+        full = n > 0
+        if not np.any(full):
+            return pts
+        # deepest z in each raypath
+        z = self.points[:, 2]
+        zmax = np.full(self.nrays, np.nan, dtype=z.dtype)
+        zmax[full] = np.maximum.reduceat(z, self.path_offsets[:-1][full])
+        # first point at the deepest z in each raypath
+        ipath = np.repeat(np.arange(self.nrays), n)
+        ipt, = np.nonzero(z == zmax[ipath])
+        ipath, i = np.unique(ipath[ipt], return_index=True)
+        pts[ipath] = self.points[ipt[i]]
         return pts
-    bottom_points = property(fget=_get_ray_bottom_points)
+    bottom_points = _cached_property(_get_ray_bottom_points)
 
 
-def readRayfanGroup(file, endian=ENDIAN):
+def readRayfanGroup(file, endian=ENDIAN, start_points=None):
     """
     Read a VM tomography rayfan file.
 
@@ -552,14 +953,369 @@ def readRayfanGroup(file, endian=ENDIAN):
         assumed to be a filename.
     :param endian: Optional. The endianness of the file. Default is
         to use machine's native byte order.
+    :param start_points: Optional. ``list`` of start point IDs of the
+        rayfans to read. Default is to read all rayfans.
     """
     rfn = RayfanGroup()
-    rfn.read(file, endian=endian)
+    rfn.read(file, endian=endian, start_points=start_points)
     return rfn
 
 
+def merge_rayfans(files, out, endian='@'):
+    """
+    Merge rayfan files into a single rayfan file.
+
+    Rayfans are copied without decoding raypaths.
+
+    :param files: ``list`` of rayfan filenames to merge.
+    :param out: Filename of the new rayfan file.
+    :param endian: Optional. The endianness of the files. Default is
+        to use machine's native byte order.
+    """
+    groups = [_open_rayfans(f, endian=endian) for f in files]
+    f = open(out, 'wb')
+    _write_header(f, sum([len(rays.seek_table) for rays in groups]),
+                  endian)
+    for rays in groups:
+        _copy_rayfans(rays, f, np.arange(len(rays.seek_table)),
+                      endian=endian)
+        rays.file.close()
+    f.close()
+
+
+def subset_rayfan(file, out, start_points=None, branches=None,
+                  endian='@'):
+    """
+    Write a subset of the rays in a rayfan file to a new rayfan file.
+
+    Rayfans are copied without decoding raypaths unless rays are selected
+    by branch.
+
+    :param file: Filename of the rayfan file to read.
+    :param out: Filename of the new rayfan file.
+    :param start_points: Optional. ``list`` of start point IDs of the
+        rayfans to keep. Default is to keep all rayfans.
+    :param branches: Optional. ``list`` of branch IDs of the rays to keep.
+        Rayfans without any of these branches are dropped. Default is to
+        keep rays for all branches.
+    :param endian: Optional. The endianness of the files. Default is
+        to use machine's native byte order.
+    """
+    rays = _open_rayfans(file, endian=endian)
+    idx = np.arange(len(rays.seek_table))
+    if start_points is not None:
+        idx = idx[np.in1d(rays.seek_table['start_point_id'][idx],
+                          start_points)]
+    f = open(out, 'wb')
+    if branches is None:
+        _write_header(f, len(idx), endian)
+        _copy_rayfans(rays, f, idx, endian=endian)
+    else:
+        _write_header(f, 0, endian)
+        n = 0
+        for offset in rays.seek_table['offset'][idx]:
+            rays.file.seek(offset)
+            rfn = Rayfan(rays.file, endian=endian,
+                         rayfan_version=rays.FORMAT)
+            keep = np.in1d(rfn.event_ids, branches)
+            if np.any(keep):
+                rfn.select(keep).write(f, endian=endian)
+                n += 1
+        # rewrite the header with the number of rayfans kept
+        f.seek(0)
+        _write_header(f, n, endian)
+    f.close()
+    rays.file.close()
+
+
+def encode_raypath(path, codec='raw'):
+    """
+    Pack raypath coordinates into a BLOB for storing in a database.
+
+    :param path: ``(npoints, 3)`` array of raypath coordinates.
+    :param codec: Optional. Codec to pack coordinates with. Options are
+        'raw' (default) for little-endian float32 values, or 'zlib' for
+        compressed values.
+    :returns: ``sqlite3.Binary`` with the codec ID followed by the packed
+        coordinates.
+    """
+    if codec not in RAYPATH_CODECS:
+        msg = "Unknown value codec='{:}'. Options are: {:}"\
+                .format(codec, RAYPATH_CODECS.keys())
+        raise ValueError(msg)
+    data = np.asarray(path, dtype=RAYPATH_DTYPE).tobytes()
+    if codec == 'zlib':
+        data = zlib.compress(data)
+    return sqlite3.Binary(RAYPATH_CODECS[codec] + data)
+
+
+def _unpack_raypath(blob):
+    """
+    Returns the packed float32 bytes from a raypath BLOB.
+    """
+    blob = bytes(blob)
+    if blob[:1] == RAYPATH_CODECS['zlib']:
+        return zlib.decompress(blob[1:])
+    elif blob[:1] == RAYPATH_CODECS['raw']:
+        return blob[1:]
+    raise ValueError('Unknown raypath codec: {:}'.format(repr(blob[:1])))
+
+
+def decode_raypath(blob):
+    """
+    Unpack raypath coordinates from a BLOB made by :func:`encode_raypath`.
+
+    :param blob: BLOB value from a database.
+    :returns: ``(npoints, 3)`` float32 array of raypath coordinates.
+    """
+    return np.frombuffer(_unpack_raypath(blob),
+                         dtype=RAYPATH_DTYPE).reshape(-1, 3)
+
+
+def decode_raypaths(blobs):
+    """
+    Unpack coordinates for many raypaths into a single array.
+
+    :param blobs: Sequence of BLOB values made by :func:`encode_raypath`,
+        e.g., from ``SELECT path FROM raypaths``.
+    :returns: ``(points, path_offsets)``, where ``points`` is a
+        ``(npoints, 3)`` float32 array of coordinates for all raypaths, and
+        the points for raypath ``i`` are
+        ``points[path_offsets[i]:path_offsets[i + 1]]``.
+    """
+    data = [_unpack_raypath(blob) for blob in blobs]
+    path_offsets = np.zeros(len(data) + 1, dtype=int)
+    np.cumsum([len(d) // 12 for d in data], out=path_offsets[1:])
+    points = np.frombuffer(''.join(data), dtype=RAYPATH_DTYPE)
+    return points.reshape(-1, 3), path_offsets
+
+
+# columns that rayfan statistics can be grouped by
+RAYFAN_STATISTICS_GROUPS = {'start_point': 'start_point_id',
+                            'end_point': 'end_point_ids',
+                            'event': 'event_ids',
+                            'event_subid': 'event_subids'}
+
+
+def rayfan_statistics(file, by=('start_point', 'event'), endian='@'):
+    """
+    Calculate traveltime residual statistics for groups of rays.
+
+    Makes a single pass through a rayfan file, skipping over raypath
+    coordinates.
+
+    :param file: An open file-like object or a string which is assumed to
+        be a filename of a rayfan file.
+    :param by: Optional. Fields to group rays by. Options are
+        'start_point', 'end_point', 'event' (i.e., branch ID), and
+        'event_subid'. Default is to group by start point and event.
+    :param endian: Optional. The endianness of the file. Default is
+        to use machine's native byte order.
+    :returns: ``numpy`` record array with a row for each group, sorted by
+        the ``by`` fields. Fields are the ``by`` fields plus 'count',
+        'mean_residual', 'rms', and 'chi2' (mean Chi-squared value).
+    """
+    for k in by:
+        if k not in RAYFAN_STATISTICS_GROUPS:
+            msg = "Unknown value by='{:}'. Options are: {:}"\
+                    .format(k, RAYFAN_STATISTICS_GROUPS.keys())
+            raise ValueError(msg)
+    rays = RayfanGroup()
+    if not hasattr(file, 'read'):
+        rays.file = open(file, 'rb')
+    else:
+        rays.file = file
+        file.seek(0)
+    n = rays._read_header(rays.file, endian=endian)
+    keys = dict([(k, []) for k in by])
+    residuals = []
+    chi2 = []
+    for i in range(0, n):
+        rfn = Rayfan(rays.file, endian=endian, rayfan_version=rays.FORMAT,
+                     skip_paths=True)
+        for k in by:
+            keys[k].append(np.resize(getattr(rfn, RAYFAN_STATISTICS_GROUPS[k]),
+                                     rfn.nrays))
+        residuals.append(rfn.residuals)
+        chi2.append(rfn.chi2)
+    if rays.file is not file:
+        rays.file.close()
+    residuals = np.concatenate(residuals or [[]])
+    chi2 = np.concatenate(chi2 or [[]])
+    # group rays by unique combinations of key values
+    ray_keys = np.zeros(len(residuals), dtype=[(k, int) for k in by])
+    for k in by:
+        ray_keys[k] = np.concatenate(keys[k] or [[]])
+    if len(by) > 0:
+        groups, igroup = np.unique(ray_keys, return_inverse=True)
+    else:
+        # all rays in a single group
+        groups = ray_keys[:min(len(ray_keys), 1)]
+        igroup = np.zeros(len(ray_keys), dtype=int)
+    count = np.bincount(igroup, minlength=len(groups))
+    dtype = [(k, int) for k in by] + [('count', int),
+                                     ('mean_residual', float),
+                                     ('rms', float), ('chi2', float)]
+    stats = np.zeros(len(groups), dtype=dtype)
+    for k in by:
+        stats[k] = groups[k]
+    stats['count'] = count
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['mean_residual'] = np.bincount(igroup, residuals,
+                                             len(groups)) / count
+        stats['rms'] = np.sqrt(np.bincount(igroup, residuals ** 2,
+                                           len(groups)) / count)
+        stats['chi2'] = np.bincount(igroup, chi2, len(groups)) / count
+    return stats.view(np.recarray)
+
+
+def _raypath_arrays(rays):
+    """
+    Returns the raypath coordinates and offsets for a rayfan or a group of
+    rayfans.
+    """
+    if hasattr(rays, 'rayfans'):
+        rayfans = rays.rayfans
+    else:
+        rayfans = [rays]
+    points = np.concatenate([rfn.points for rfn in rayfans] or
+                            [np.zeros((0, 3))])
+    lens = np.concatenate([np.diff(rfn.path_offsets) for rfn in rayfans] or
+                          [[]]).astype(int)
+    path_offsets = np.zeros(len(lens) + 1, dtype=int)
+    np.cumsum(lens, out=path_offsets[1:])
+    return points, path_offsets
+
+
+def raypath_matrix(rays, vm):
+    """
+    Build a sparse matrix of raypath lengths in the cells of a model grid.
+
+    Each model cell is centered on a grid node and extends half-way to the
+    neighboring nodes. Raypath segments are split where they cross cell
+    boundaries, and the length of each piece is added to the cell that
+    contains it. Pieces outside of the model grid are ignored.
+
+    :param rays: :class:`Rayfan` or :class:`RayfanGroup` with raypaths.
+    :param vm: :class:`rockfish.tomography.model.VM` with the model grid.
+    :returns: ``scipy.sparse.csr_matrix`` with shape
+        ``(nrays, nx * ny * nz)``. Rows are in the order of the rays in the
+        rayfans, and columns are indices in the packed slowness array (see
+        :meth:`rockfish.tomography.model.VM.gridpoint2index`).
+    """
+    points, path_offsets = _raypath_arrays(rays)
+    nrays = len(path_offsets) - 1
+    shape = (nrays, vm.nx * vm.ny * vm.nz)
+    axes = [(vm.r1[i], d, n) for i, (d, n) in
+            enumerate([(vm.dx, vm.nx), (vm.dy, vm.ny), (vm.dz, vm.nz)])]
+    # segments between consecutive points in the same raypath
+    iray = np.repeat(np.arange(nrays), np.diff(path_offsets))
+    same = iray[1:] == iray[:-1]
+    p0 = np.asarray(points[:-1][same], dtype=float)
+    p1 = np.asarray(points[1:][same], dtype=float)
+    iray = iray[1:][same]
+    nseg = len(p0)
+    # parametric distances along segments to the ends and to all cell
+    # boundary crossings
+    t = [np.zeros(nseg), np.ones(nseg)]
+    iseg = [np.arange(nseg), np.arange(nseg)]
+    for axis, (x0, dx, nx) in enumerate(axes):
+        if nx < 2:
+            continue
+        c0 = (p0[:, axis] - x0) / dx + 0.5
+        c1 = (p1[:, axis] - x0) / dx + 0.5
+        k0 = np.floor(np.minimum(c0, c1))
+        ncross = (np.floor(np.maximum(c0, c1)) - k0).astype(int)
+        j = np.repeat(np.arange(nseg), ncross)
+        step = np.arange(len(j)) - np.repeat(np.cumsum(ncross) - ncross,
+                                             ncross)
+        t.append((k0[j] + 1 + step - c0[j]) / (c1[j] - c0[j]))
+        iseg.append(j)
+    t = np.concatenate(t)
+    iseg = np.concatenate(iseg)
+    order = np.lexsort((t, iseg))
+    t = t[order]
+    iseg = iseg[order]
+    # pieces of segments between crossings
+    keep = iseg[1:] == iseg[:-1]
+    j = iseg[1:][keep]
+    tmid = (0.5 * (t[1:] + t[:-1]))[keep]
+    dp = p1[j] - p0[j]
+    lengths = np.diff(t)[keep] * np.sqrt(np.sum(dp ** 2, axis=1))
+    mid = p0[j] + tmid[:, np.newaxis] * dp
+    inside = np.ones(len(j), dtype=bool)
+    ijk = []
+    for axis, (x0, dx, nx) in enumerate(axes):
+        if nx < 2:
+            i = np.zeros(len(j), dtype=int)
+        else:
+            i = np.floor((mid[:, axis] - x0) / dx + 0.5).astype(int)
+            inside &= (i >= 0) & (i < nx)
+        ijk.append(i)
+    cols = vm.gridpoint2index(*ijk)
+    G = sparse.coo_matrix((lengths[inside],
+                           (iray[j][inside], cols[inside])),
+                          shape=shape).tocsr()
+    G.sum_duplicates()
+    G.eliminate_zeros()
+    return G
+
+
+def hit_count_grid(G, vm):
+    """
+    Count the number of rays that pass through each model cell.
+
+    :param G: Sparse matrix of raypath lengths from :func:`raypath_matrix`.
+    :param vm: :class:`rockfish.tomography.model.VM` that ``G`` was built
+        for.
+    :returns: ``numpy.ndarray`` with shape ``(nx, ny, nz)``.
+    """
+    G = sparse.csr_matrix(G)
+    G.eliminate_zeros()
+    hits = np.bincount(G.indices, minlength=G.shape[1])
+    return hits.reshape((vm.nx, vm.ny, vm.nz))
+
+
+def dws_grid(G, vm):
+    """
+    Calculate the derivative-weight sum (DWS) for each model cell.
+
+    The DWS is the sum of the lengths of all raypaths in a cell, i.e., the
+    sum of the derivatives of traveltimes with respect to the cell slowness.
+    The result can be assigned to
+    :attr:`rockfish.tomography.model.VM.dws_sl` for plotting with
+    :meth:`rockfish.tomography.model.VM.plot_dws`.
+
+    :param G: Sparse matrix of raypath lengths from :func:`raypath_matrix`.
+    :param vm: :class:`rockfish.tomography.model.VM` that ``G`` was built
+        for.
+    :returns: ``numpy.ndarray`` with shape ``(nx, ny, nz)``.
+    """
+    dws = np.asarray(G.sum(axis=0)).ravel()
+    return dws.reshape((vm.nx, vm.ny, vm.nz))
+
+
+def _get_picks_for_ensembles(pickdb, ensembles,
+                             batch_size=SQL_BATCH_SIZE):
+    """
+    Get all picks for a list of ensembles.
+
+    Ensembles are selected in batches with ``IN`` clauses, which keeps
+    queries within the SQLite limits on expression depth and the number of
+    parameters.
+    """
+    rows = []
+    for i in range(0, len(ensembles), batch_size):
+        batch = list(ensembles[i:i + batch_size])
+        sql = 'SELECT * FROM {:} WHERE ensemble IN ({:})'\
+                .format(pickdb.MASTER_VIEW, ', '.join(['?'] * len(batch)))
+        logging.debug("calling: pickdb.execute('%s', ...)" % sql)
+        rows.extend(pickdb.execute(sql, batch).fetchall())
+    return rows
+
+
 def rayfan2db(rayfan_file, raydb_file=':memory:', synthetic=False, noise=None,
-              pickdb=None, raypaths=False):
+              pickdb=None, raypaths=False, raypath_codec='raw'):
     """
     Read a rayfan file and store its data in a database.
 
@@ -586,9 +1342,16 @@ def rayfan2db(rayfan_file, raydb_file=':memory:', synthetic=False, noise=None,
         'trace_in_file') are copied from this database to the new
         database along with rayfan data. Default is ignore these extra fields.
     raypaths: bool, optional
-        If ``True``, raypath coordinates are stored as text in a new table
-        'raypaths'.
+        If ``True``, raypath coordinates are stored as BLOBs in a new table
+        'raypaths'. Use :func:`decode_raypaths` to read them.
+    raypath_codec: str, optional
+        Codec for storing raypaths. Options are 'raw' (default) for packed
+        float32 values, or 'zlib' for compressed values.
     """
+    if raypath_codec not in RAYPATH_CODECS:
+        msg = "Unknown value raypath_codec='{:}'. Options are: {:}"\
+                .format(raypath_codec, RAYPATH_CODECS.keys())
+        raise ValueError(msg)
     raydb = PickDatabaseConnection(raydb_file)
     rays = readRayfanGroup(rayfan_file)
     print "Adding {:} traveltimes to {:} ..."\
@@ -596,72 +1359,112 @@ def rayfan2db(rayfan_file, raydb_file=':memory:', synthetic=False, noise=None,
     # add fields for raypaths
     if raypaths:
         raydb._create_table_if_not_exists(RAYPATH_TABLE, RAYPATH_FIELDS)
+        raydb._add_field_if_not_exists(RAYPATH_TABLE, 'path',
+                                       sql_type='BLOB')
     ndb0 = raydb.execute('SELECT COUNT(rowid) FROM picks').fetchone()[0]
+    # look up events and extra fields from pickdb once
+    if pickdb is not None:
+        branch2event = pickdb.vmbranch2event
+        ensembles = sorted(set([rfn.start_point_id for rfn in rays.rayfans]))
+        picks = {}
+        for row in _get_picks_for_ensembles(pickdb, ensembles):
+            picks[(row['event'], row['ensemble'], row['trace'])] = row
+    method = 'rayfan2db({:})'.format(rayfan_file)
+    # rows for each (event, ensemble, trace), with later rays replacing
+    # earlier ones as with repeated calls to update_pick()
+    rows = []
+    raypath_rows = []
+    irow = {}
     for rfn in rays.rayfans:
-        for i, _t in enumerate(rfn.travel_times):
+        if raypaths:
+            bottom_points = rfn.bottom_points.tolist()
+        # values for all rays in the rayfan, as python types for sqlite
+        first, last = [v.tolist() for v in rfn._path_ends]
+        offsets = rfn.offsets.tolist()
+        azimuths = rfn.azimuths.tolist()
+        residuals = rfn.residuals.tolist()
+        event_ids = rfn.event_ids.tolist()
+        event_subids = rfn.event_subids.tolist()
+        end_point_ids = rfn.end_point_ids.tolist()
+        pick_times = rfn.pick_times.tolist()
+        pick_errors = rfn.pick_errors.tolist()
+        travel_times = rfn.travel_times.tolist()
+        if synthetic:
+            # noise is only added to synthetic picks
+            synthetic_times = rfn.travel_times
             if noise is not None:
-                _noise = noise * 2 * (np.random.random() - 0.5)
-            else:
-                _noise = 0.0
-            sx, sy, sz = rfn.paths[i][0]
-            rx, ry, rz = rfn.paths[i][-1]
+                synthetic_times = synthetic_times + noise * 2\
+                        * (np.random.random(rfn.nrays) - 0.5)
+            synthetic_times = synthetic_times.tolist()
+        for i in range(rfn.nrays):
             if pickdb is not None:
-                event = pickdb.vmbranch2event[rfn.event_ids[i]]
+                event = branch2event[event_ids[i]]
             else:
-                event = rfn.event_ids[i]
+                event = event_ids[i]
             if synthetic:
-                time = rfn.travel_times[i] + _noise
+                time = synthetic_times[i]
                 time_reduced = time
                 predicted = None
                 residual = 0.
             else:
-                time = rfn.pick_times[i]
+                time = pick_times[i]
                 time_reduced = time
-                predicted = rfn.travel_times[i]
-                residual = rfn.residuals[i] 
+                predicted = travel_times[i]
+                residual = residuals[i]
             d = {'event': event,
                  'ensemble': rfn.start_point_id,
-                 'trace': rfn.end_point_ids[i],
-                 'vm_branch': rfn.event_ids[i],
-                 'vm_subid': rfn.event_subids[i],
+                 'trace': end_point_ids[i],
+                 'vm_branch': event_ids[i],
+                 'vm_subid': event_subids[i],
                  'time' : time,
                  'time_reduced' : time_reduced,
                  'predicted' : predicted,
                  'residual' : residual,
-                 'error': rfn.pick_errors[i],
-                 'source_x': sx, 'source_y': sy, 'source_z': sz,
-                 'receiver_x': rx, 'receiver_y': ry, 'receiver_z': rz,
-                 'offset': rfn.offsets[i],
-                 'faz': rfn.azimuths[i],
-                 'method': 'rayfan2db({:})'.format(rayfan_file),
+                 'error': pick_errors[i],
+                 'source_x': first[i][0],
+                 'source_y': first[i][1],
+                 'source_z': first[i][2],
+                 'receiver_x': last[i][0],
+                 'receiver_y': last[i][1],
+                 'receiver_z': last[i][2],
+                 'offset': offsets[i],
+                 'faz': azimuths[i],
+                 'method': method,
                  'data_file': rays.file.name}
+            key = (d['event'], d['ensemble'], d['trace'])
             # Copy data from pickdb
-            if pickdb is not None:
-                pick = pickdb.get_picks(event=[event],
-                                        ensemble=[d['ensemble']],
-                                        trace=[d['trace']])
-                if len(pick) > 0:
-                    for f in ['trace_in_file', 'line', 'site', 'data_file']:
-                        try:
-                            d[f] = pick[0][f]
-                        except KeyError:
-                            pass
-            # add data to standard tables
-            raydb.update_pick(**d)
-            # add raypath data to new table
+            if pickdb is not None and key in picks:
+                pick = picks[key]
+                for f in ['trace_in_file', 'line', 'site', 'data_file']:
+                    if f in pick.keys():
+                        d[f] = pick[f]
             if raypaths:
-                d = {'event': event,
-                     'ensemble': rfn.start_point_id,
-                     'trace': rfn.end_point_ids[i],
-                     'ray_btm_x': rays.bottom_points[i][0],
-                     'ray_btm_y': rays.bottom_points[i][1],
-                     'ray_btm_z': rays.bottom_points[i][2],
-                     'ray_x': str([p[0] for p in rfn.paths[i]]),
-                     'ray_y': str([p[1] for p in rfn.paths[i]]),
-                     'ray_z': str([p[2] for p in rfn.paths[i]])}
-                raydb._insert(RAYPATH_TABLE, **d)
-
-        raydb.commit()
+                path = rfn.points[rfn.path_offsets[i]:rfn.path_offsets[i + 1]]
+                raypath = key + tuple(bottom_points[i])\
+                        + (encode_raypath(path, codec=raypath_codec),)
+            else:
+                raypath = None
+            if key in irow:
+                rows[irow[key]] = d
+                raypath_rows[irow[key]] = raypath
+            else:
+                irow[key] = len(rows)
+                rows.append(d)
+                raypath_rows.append(raypath)
+    # add data to standard tables, grouping rows with the same fields
+    groups = {}
+    for d in rows:
+        groups.setdefault(tuple(sorted(d.keys())), []).append(d)
+    for fields in sorted(groups):
+        raydb.update_picks(groups[fields])
+    # add raypath data to new table
+    if raypaths:
+        sql = 'INSERT OR REPLACE INTO {:} ({:}) VALUES ({:})'\
+                .format(RAYPATH_TABLE,
+                        ', '.join([f[0] for f in RAYPATH_FIELDS]),
+                        ', '.join(['?'] * len(RAYPATH_FIELDS)))
+        raydb.executemany(sql, raypath_rows)
+    raydb.commit()
     ndb = raydb.execute('SELECT COUNT(rowid) FROM picks').fetchone()[0]
     if (ndb - ndb0) != rays.nrays:
         msg = 'Only added {:} of {:} travel times to the database.'\
@@ -41,9 +41,10 @@ def assign_points_to_layers(vm, px, py, pz):
     Returns
     -------
     pi : numpy.ndarray
-        Layer index for each point.
+        Layer index for each point, or ``-1`` for points outside of the
+        model.
     """
-    return np.asarray([vm.point2layer(*pt) for pt in zip(px, py, pz)])
+    return vm.points2layers(px, py, pz)
 
 
 def get_indices_near_piercing(pi, iref, downward=True, upward=True):
@@ -0,0 +1,93 @@
+"""
+Test suite for the inverse module.
+"""
+import os
+import unittest
+import numpy as np
+from rockfish.tomography.inverse import read_frechet_matrix,\
+        read_model_update, read_dws
+
+
+def write_example_frechet(filename, rows, endian='<'):
+    """
+    Write rows of ``(columns, values)`` to a Frechet matrix file.
+    """
+    f = open(filename, 'wb')
+    for cols, values in rows:
+        np.array([len(cols)], dtype=endian + 'i4').tofile(f)
+        np.array(cols, dtype=endian + 'i4').tofile(f)
+        np.array(values, dtype=endian + 'f4').tofile(f)
+    f.close()
+
+
+class inverseTestCase(unittest.TestCase):
+    """
+    Test cases for the inverse module.
+    """
+    def test_read_frechet_matrix(self):
+        """
+        Should read a Frechet matrix into a sparse matrix.
+        """
+        rows = [([1, 3], [0.5, 1.5]),
+                ([], []),
+                ([2, 3, 5], [1., 2., 3.])]
+        tmp = 'temp.frechet.bin'
+        for endian in ['<', '>']:
+            write_example_frechet(tmp, rows, endian=endian)
+            G = read_frechet_matrix(tmp, endian=endian)
+            self.assertEqual(G.shape, (3, 5))
+            self.assertTrue(np.allclose(G.toarray(),
+                                        [[0.5, 0, 1.5, 0, 0],
+                                         [0, 0, 0, 0, 0],
+                                         [0, 1., 2., 0, 3.]]))
+        # should set the number of columns
+        G = read_frechet_matrix(tmp, ncols=10, endian=endian)
+        self.assertEqual(G.shape, (3, 10))
+        # should raise an error for a truncated file
+        f = open(tmp, 'ab')
+        np.array([2, 1], dtype=endian + 'i4').tofile(f)
+        f.close()
+        with self.assertRaises(IOError):
+            read_frechet_matrix(tmp, endian=endian)
+        # should raise an error for the wrong byte order
+        write_example_frechet(tmp, rows, endian='<')
+        with self.assertRaises(IOError):
+            read_frechet_matrix(tmp, endian='>')
+        # should raise an error for negative row sizes
+        write_example_frechet(tmp, [([1], [1.])], endian='<')
+        f = open(tmp, 'ab')
+        np.array([-1], dtype='<i4').tofile(f)
+        f.close()
+        with self.assertRaises(IOError):
+            read_frechet_matrix(tmp, endian='<')
+        os.remove(tmp)
+
+    def test_read_model_update(self):
+        """
+        Should memory map a model update vector.
+        """
+        tmp = 'temp.vecm.bin'
+        np.arange(6, dtype='>f4').tofile(tmp)
+        vecm = read_model_update(tmp, endian='>')
+        self.assertTrue(np.all(vecm == np.arange(6)))
+        self.assertFalse(vecm.flags.writeable)
+        del vecm
+        os.remove(tmp)
+
+    def test_read_dws(self):
+        """
+        Should read coordinates and values from a DWS file.
+        """
+        tmp = 'temp.dws.dat'
+        np.savetxt(tmp, [[0, 0, 0, 1.5], [0.5, 0, 0, 2.5]])
+        xyz, dws = read_dws(tmp)
+        self.assertEqual(xyz.shape, (2, 3))
+        self.assertTrue(np.all(dws == [1.5, 2.5]))
+        os.remove(tmp)
+
+
+def suite():
+    return unittest.makeSuite(inverseTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -5,6 +5,8 @@ import os
 import unittest
 import numpy as np
 import copy
+from StringIO import StringIO
+from scipy.io import netcdf_file as netcdf
 from rockfish.tomography.model import VM, VMGrids, readVM
 from rockfish.utils.loaders import get_example_file
 
@@ -15,6 +17,48 @@ TEST_3D_MODELS = ['pinchout3d.vm', 'cranis3d.vm']
 TEST_MODELS = TEST_2D_MODELS + TEST_3D_MODELS
 
 
+def stretch_columns(vm, ilyr, vel):
+    """
+    Stretch a 1D velocity function between layer boundaries one column at a
+    time.
+    """
+    sl = vm.sl.copy()
+    z0, z1 = vm.get_layer_bounds(ilyr)
+    for ix in range(vm.nx):
+        for iy in range(vm.ny):
+            iz0, iz1 = vm.z2i((z0[ix, iy], z1[ix, iy]))
+            _vel = list(vel)
+            if _vel[0] is None:
+                _vel[0] = 1. / vm.sl[ix, iy, max(iz0 - 1, 0)]
+            if _vel[-1] is None:
+                _vel[-1] = 1. / vm.sl[ix, iy, min(iz1 + 2, vm.nz - 1)]
+            zi = np.linspace(z0[ix, iy], z1[ix, iy], len(vel))
+            if zi[-1] > zi[0]:
+                v = np.interp(vm.z[iz0:iz1 + 1], zi, _vel)
+            else:
+                v = np.where(vm.z[iz0:iz1 + 1] > zi[0], _vel[-1], _vel[0])
+            sl[ix, iy, iz0:iz1 + 1] = 1. / v
+    return sl
+
+def gradient_columns(vm, ilyr, dvdz, v0):
+    """
+    Define a velocity gradient in a layer one column at a time.
+    """
+    sl = vm.sl.copy()
+    z0, z1 = vm.get_layer_bounds(ilyr)
+    dvdz = dvdz * np.ones((vm.nx, vm.ny))
+    for ix in range(vm.nx):
+        for iy in range(vm.ny):
+            iz0, iz1 = vm.z2i((z0[ix, iy], z1[ix, iy]))
+            if v0 is None:
+                _v0 = 1. / vm.sl[ix, iy, iz0 - 1]
+            else:
+                _v0 = (v0 * np.ones((vm.nx, vm.ny)))[ix, iy]
+            z = vm.z[iz0:iz1 + 1] - vm.z[iz0]
+            sl[ix, iy, iz0:iz1 + 1] = 1. / (_v0 + z * dvdz[ix, iy])
+    return sl
+
+
 class VMTestCase(unittest.TestCase):
     """
     Test cases for the vmtools modules.
@@ -75,6 +119,125 @@ class VMTestCase(unittest.TestCase):
         # clean up
         os.remove(tmp)
 
+    def test_write_ascii_grid(self):
+        """
+        Should write a row for each node in the grid.
+        """
+        vm = readVM(get_example_file('cranis3d.vm'))
+        tmp = 'temp.vm.xyzv'
+        vm.write_ascii_grid(tmp, meters=True, velocity=True)
+        dat = np.loadtxt(tmp)
+        self.assertEqual(dat.shape, (vm.nx * vm.ny * vm.nz, 4))
+        for ix, iy, iz in [(0, 0, 0), (1, 2, 3), (4, 3, 300)]:
+            i = (ix * vm.ny + iy) * vm.nz + iz
+            self.assertAlmostEqual(dat[i, 0], vm.x[ix] * 1000., 3)
+            self.assertAlmostEqual(dat[i, 1], vm.y[iy] * 1000., 3)
+            self.assertAlmostEqual(dat[i, 2], vm.z[iz] * 1000., 3)
+            self.assertAlmostEqual(dat[i, 3], 1. / vm.sl[ix, iy, iz], 5)
+        # should write the time model
+        vm.time_model.write_ascii_grid(tmp, grid='slowness')
+        dat = np.loadtxt(tmp, delimiter=',')
+        nt = len(vm.time_model.twt)
+        self.assertEqual(dat.shape, (vm.nx * vm.ny * nt, 4))
+        self.assertTrue(np.allclose(dat[:nt, 2], vm.time_model.twt))
+        self.assertTrue(np.allclose(dat[:, 3],
+                                    vm.time_model.grids.slowness.ravel(),
+                                    equal_nan=True))
+        os.remove(tmp)
+
+    def test_write_grd(self):
+        """
+        Should write a 2D grid to a netCDF file.
+        """
+        vm = readVM(get_example_file('jump1d.vm'))
+        tmp = 'temp.grd'
+        vm.write_grd(tmp, velocity=True)
+        grd = netcdf(tmp, 'r', mmap=False)
+        self.assertTrue(np.allclose(grd.variables['x'][:], vm.x))
+        self.assertTrue(np.allclose(grd.variables['y'][:], vm.z))
+        z = grd.variables['z'][:]
+        self.assertEqual(z.shape, (vm.nz, vm.nx))
+        self.assertTrue(np.allclose(z, 1. / vm.sl[:, 0, :].transpose()))
+        self.assertTrue(np.allclose(grd.variables['z'].actual_range,
+                                    [z.min(), z.max()]))
+        self.assertEqual(grd.variables['z'].units, 'km/s')
+        grd.close()
+        os.remove(tmp)
+
+    def test_slice_along_xy_line(self):
+        """
+        Should extract a 2D model along a line.
+        """
+        vm = readVM(get_example_file('cranis3d.vm'))
+        # should match the model along a row of nodes
+        vm1 = vm.slice_along_xy_line([vm.x[0], vm.x[-1]], [vm.y[2]] * 2)
+        self.assertEqual((vm1.nx, vm1.ny, vm1.nz), (vm.nx - 1, 1, vm.nz))
+        self.assertTrue(np.allclose(vm1.sl[:, 0, :], vm.sl[:-1, 2, :]))
+        self.assertTrue(np.allclose(vm1.rf[:, :, 0], vm.rf[:, :-1, 2]))
+        self.assertTrue(np.all(vm1.ir[:, :, 0] == vm.ir[:, :-1, 2]))
+        # should work for lines with a constant x coordinate
+        vm1 = vm.slice_along_xy_line([vm.x[3]] * 2, [vm.y[0], vm.y[-1]])
+        self.assertTrue(np.allclose(vm1.sl[:, 0, :], vm.sl[3, :-1, :]))
+        # should interpolate between columns
+        x = 0.5 * (vm.x[1] + vm.x[2])
+        y = 0.25 * vm.y[0] + 0.75 * vm.y[1]
+        vm1 = vm.slice_along_xy_line([x, vm.x[-1]], [y, vm.y[-1]], dx=0.1)
+        sl = 0.125 * (vm.sl[1, 0] + vm.sl[2, 0])\
+                + 0.375 * (vm.sl[1, 1] + vm.sl[2, 1])
+        self.assertTrue(np.allclose(vm1.sl[0, 0], sl))
+        rf = 0.125 * (vm.rf[:, 1, 0] + vm.rf[:, 2, 0])\
+                + 0.375 * (vm.rf[:, 1, 1] + vm.rf[:, 2, 1])
+        self.assertTrue(np.allclose(vm1.rf[:, 0, 0], rf))
+
+    def test_project_model(self):
+        """
+        Should project a 2D model onto another line.
+        """
+        vm = readVM(get_example_file(BENCHMARK_2D))
+        # should not change the model for a zero angle
+        vm1 = vm.project_model(0)
+        self.assertEqual(vm1.nx, vm.nx)
+        self.assertTrue(np.allclose(vm1.sl, vm.sl))
+        self.assertTrue(np.allclose(vm1.rf, vm.rf))
+        self.assertTrue(np.all(vm1.ir == vm.ir))
+        # should stretch the model along the new line
+        vm1 = vm.project_model(60)
+        self.assertAlmostEqual(vm1.r2[0], 2 * vm.r2[0], delta=vm1.dx)
+        n = len(vm1.sl[::2])
+        self.assertTrue(np.allclose(vm1.sl[::2], vm.sl[:n]))
+        self.assertTrue(np.allclose(vm1.sl[1::2],
+                                    0.5 * (vm.sl[:-1] + vm.sl[1:])))
+        self.assertTrue(np.allclose(vm1.rf[:, 1::2],
+                                    0.5 * (vm.rf[:, :-1] + vm.rf[:, 1:])))
+
+    def test_read_write_vm_file_like(self):
+        """
+        Should read and write from file-like objects and other byte orders.
+        """
+        for model in TEST_MODELS:
+            vmfile = get_example_file(model)
+            vm0 = readVM(vmfile)
+            # should read from a file-like object
+            vm1 = readVM(StringIO(open(vmfile, 'rb').read()))
+            for attr in ['sl', 'rf', 'jp', 'ir', 'ij']:
+                self.assertTrue(np.all(vm0.__getattribute__(attr)
+                                       == vm1.__getattribute__(attr)))
+            # should preserve data when swapping byte order
+            tmp = 'temp.vm'
+            # should also accept struct byte order characters
+            for endian in ['>', '@', '!']:
+                vm0.write(tmp, endian=endian)
+                vm1 = readVM(tmp, endian=endian)
+                for attr in ['sl', 'rf', 'jp', 'ir', 'ij']:
+                    self.assertTrue(np.all(vm0.__getattribute__(attr)
+                                           == vm1.__getattribute__(attr)))
+                self.assertEqual(vm0.r1, vm1.r1)
+            os.remove(tmp)
+        # should raise an error for truncated files
+        data = open(get_example_file(BENCHMARK_2D), 'rb').read()
+        with self.assertRaises(IOError):
+            readVM(StringIO(data[:1000]))
+
     def test_boundary_flags(self):
         """
         Should convert boundary flags from fortran to python index conventions
@@ -214,6 +377,48 @@ class VMTestCase(unittest.TestCase):
                 vm.define_stretched_layer_velocities(ilyr, [10])
                 self.assertEqual(np.nanmax(vm.sl), 1. / 10)
                 self.assertEqual(np.nanmin(vm.sl), 1. / 10)
+        # should match a 1D function fit to each column
+        for model in [BENCHMARK_2D, 'cranis3d.vm']:
+            vm = readVM(get_example_file(model))
+            for ilyr in range(vm.nr + 1):
+                for vel in [[1.5, 4.0], [1.5, 4.0, 6.5, 8.0, 8.5],
+                            [None, None], [None, 7.]]:
+                    sl = stretch_columns(vm, ilyr, vel)
+                    _vm = copy.deepcopy(vm)
+                    _vm.define_stretched_layer_velocities(ilyr, vel)
+                    self.assertTrue(np.allclose(_vm.sl, sl))
+        # should only change velocities within limits
+        vm = readVM(get_example_file('cranis3d.vm'))
+        sl = vm.sl.copy()
+        vm.define_stretched_layer_velocities(1, [2., 3.], xmin=vm.x[2],
+                                             ymax=vm.y[1])
+        self.assertTrue(np.all(vm.sl[:2] == sl[:2]))
+        self.assertTrue(np.all(vm.sl[:, 2:] == sl[:, 2:]))
+        self.assertFalse(np.all(vm.sl[2:, :2] == sl[2:, :2]))
+
+    def test_define_layer_gradients(self):
+        """
+        Should define velocity gradients within a layer.
+        """
+        for model in [BENCHMARK_2D, 'cranis3d.vm']:
+            vm = readVM(get_example_file(model))
+            dvdz = np.linspace(0.1, 0.5, vm.nx)[:, np.newaxis]\
+                    * np.ones((vm.nx, vm.ny))
+            for ilyr in range(1, vm.nr + 1):
+                # should match a gradient defined for each column
+                for v0 in [None, 2.]:
+                    sl = gradient_columns(vm, ilyr, 0.2, v0)
+                    _vm = copy.deepcopy(vm)
+                    _vm.define_constant_layer_gradient(ilyr, 0.2, v0=v0)
+                    self.assertTrue(np.allclose(_vm.sl, sl))
+                sl = gradient_columns(vm, ilyr, dvdz, None)
+                _vm = copy.deepcopy(vm)
+                _vm.define_variable_layer_gradient(ilyr, dvdz)
+                self.assertTrue(np.allclose(_vm.sl, sl))
+                sl = gradient_columns(vm, ilyr, dvdz, dvdz + 2)
+                _vm = copy.deepcopy(vm)
+                _vm.define_variable_layer_gradient(ilyr, dvdz, v0=dvdz + 2)
+                self.assertTrue(np.allclose(_vm.sl, sl))
 
     def test_insert_layer_velocities(self):
         """
@@ -241,6 +446,16 @@ class VMTestCase(unittest.TestCase):
             # should have nodes in each layer
             # assuming no complete pinchouts
             self.assertEqual(len(np.unique(layers)), vm.nr + 1)
+            # should return the cached grid until interfaces change
+            self.assertTrue(vm.layers is layers)
+            self.assertFalse(layers.flags.writeable)
+            vm.rf[0] += vm.dz * 5
+            layers1 = vm.layers
+            self.assertFalse(layers1 is layers)
+            self.assertTrue(np.array_equal(layers1, vm._calc_layers()))
+            # should update for changes in the number of interfaces
+            vm.insert_interface(vm.r2[2] - vm.dz)
+            self.assertEqual(len(np.unique(vm.layers)), vm.nr + 1)
 
     def test_get_layer_bounds(self):
         """
@@ -286,6 +501,115 @@ class VMTestCase(unittest.TestCase):
         self.assertEqual(z1.min(), _z)
         self.assertEqual(z1.max(), _z1)
 
+    def test_smooth_interface(self):
+        """
+        Should smooth interfaces and jumps without changing their shape.
+        """
+        for model in TEST_MODELS:
+            vm = readVM(get_example_file(model))
+            shape = vm.rf.shape
+            vm.smooth_interface(0, 3)
+            vm.smooth_jumps(3)
+            self.assertEqual(vm.rf.shape, shape)
+            self.assertEqual(vm.jp.shape, shape)
+            # flat interfaces should stay flat
+            vm.rf[0] = 5.
+            vm.smooth_interface(0, 3)
+            self.assertTrue(np.allclose(vm.rf[0], 5.))
+
+    def test_apply_remove_jumps(self):
+        """
+        Should add jumps to nodes at and below interfaces and remove them.
+        """
+        for model in TEST_MODELS:
+            vm = readVM(get_example_file(model))
+            vm.jp = 0.01 * np.random.random(vm.jp.shape)
+            sl0 = vm.sl.copy()
+            vm.apply_jumps()
+            # should match adding jumps one node at a time
+            sl1 = sl0.copy()
+            for iref in range(vm.nr):
+                for ix in range(vm.nx):
+                    for iy in range(vm.ny):
+                        iz0 = vm.z2i([vm.rf[iref, ix, iy]])[0]
+                        sl1[ix, iy, iz0:] += vm.jp[iref, ix, iy]
+            self.assertTrue(np.allclose(vm.sl, sl1))
+            vm.remove_jumps()
+            self.assertTrue(np.allclose(vm.sl, sl0))
+
+    def test_recalculate_jumps(self):
+        """
+        Should set jumps to the slowness difference across an interface.
+        """
+        for model in TEST_MODELS:
+            vm = readVM(get_example_file(model))
+            iref = 1
+            vm.recalculate_jumps(iref)
+            _, z0 = vm.get_layer_bounds(iref)
+            for ix in range(vm.nx):
+                for iy in range(vm.ny):
+                    iz0 = vm.z2i([z0[ix, iy]])[0]
+                    self.assertAlmostEqual(vm.jp[iref - 1, ix, iy],
+                                           vm.sl[ix, iy, iz0 + 1]
+                                           - vm.sl[ix, iy, iz0])
+
+    def test_points2layers(self):
+        """
+        Should find the layers that points are in.
+        """
+        vm = readVM(get_example_file('cranis3d.vm'))
+        x = np.linspace(vm.r1[0], vm.r2[0], 7)
+        y = np.linspace(vm.r1[1], vm.r2[1], 7)
+        z = np.linspace(vm.r1[2] - 1, vm.r2[2] + 1, 200)
+        x, y, z = [v.ravel() for v in np.meshgrid(x, y, z)]
+        ilyr = vm.points2layers(x, y, z)
+        self.assertEqual(ilyr.shape, x.shape)
+        # should match layer bounds at the nearest column
+        ix = vm.x2i(x)
+        iy = vm.y2i(y)
+        for i in range(0, len(x), 37):
+            if (z[i] < vm.r1[2]) or (z[i] > vm.r2[2]):
+                self.assertEqual(ilyr[i], -1)
+                self.assertEqual(vm.point2layer(x[i], y[i], z[i]), None)
+                continue
+            z0, z1 = vm.get_layer_bounds(ilyr[i])
+            self.assertTrue(z0[ix[i], iy[i]] <= z[i] <= z1[ix[i], iy[i]])
+            self.assertEqual(vm.point2layer(x[i], y[i], z[i]), ilyr[i])
+        # should assign points on an interface to the layer above
+        ilyr = vm.points2layers(vm.x[:2], vm.y[:2], vm.rf[1, :2, :2].diagonal())
+        self.assertTrue(np.all(ilyr == 1))
+        # should find indices for arrays of coordinates
+        ix = vm.x2i(np.array([[vm.x[1], vm.x[3]], [vm.r1[0] - 5, 1e9]]))
+        self.assertTrue(np.all(ix == [[1, 3], [0, vm.nx - 1]]))
+
+    def test_sample(self):
+        """
+        Should interpolate grid values without crossing jumps.
+        """
+        vm = VM(r1=(0, 0, 0), r2=(10, 0, 10), dx=1, dy=1, dz=1)
+        vm.insert_interface(5.5)
+        vm.sl[:, :, :6] = 1. / 2.
+        vm.sl[:, :, 6:] = 1. / 6.
+        x = np.array([2.5, 2.5, 2.5, 7.])
+        z = np.array([5.4, 5.6, 3., 1e9])
+        # should interpolate across the interface without a jump
+        v = vm.sample(x, 0, z)
+        self.assertTrue(np.allclose(v, [3.6, 4.4, 2., 6.]))
+        # should only use nodes on the same side of a jump
+        vm.jp[0] = 1. / 6. - 1. / 2.
+        v = vm.sample(x, 0, z)
+        self.assertTrue(np.allclose(v, [2., 6., 2., 6.]))
+        v = vm.sample(x, 0, z, respect_layers=False)
+        self.assertTrue(np.allclose(v, [3.6, 4.4, 2., 6.]))
+        # should match grid values at nodes
+        vm = readVM(get_example_file('cranis3d.vm'))
+        x, y, z = np.meshgrid(vm.x, vm.y, vm.z, indexing='ij')
+        v = vm.sample(x, y, z, grid='slowness', respect_layers=False)
+        self.assertTrue(np.allclose(v, vm.sl))
+        v = vm.sample(x, y, z, grid=vm.grids.twt)
+        self.assertEqual(v.shape, vm.sl.shape)
+        self.assertTrue(np.allclose(v, vm.grids.twt))
+
     def test_gridpoint2index(self):
         """
         Should convert between 1D and 3D grid indices.
@@ -301,6 +625,40 @@ class VMTestCase(unittest.TestCase):
         for j in range(3):
             self.assertEqual(i0[j], i1[j])
 
+    def test_time_model(self):
+        """
+        Should convert the model grid to two-way travel time.
+        """
+        vm = readVM(get_example_file('cranis3d.vm'))
+        # should match the cumulative time in each column
+        twt = vm.grids.twt
+        for ix, iy in [(0, 0), (2, 3), (4, 4)]:
+            t = 2 * vm.dz * np.cumsum(vm.sl[ix, iy, 1:])
+            self.assertTrue(np.allclose(twt[ix, iy, 1:], t))
+        self.assertTrue(np.all(twt[:, :, 0] == 0))
+        # should cache grids until the slowness grid is modified
+        self.assertTrue(vm.grids.twt is twt)
+        grids = vm.time_model.grids
+        self.assertTrue(vm.time_model.grids is grids)
+        vm.define_constant_layer_velocity(1, 5.)
+        self.assertFalse(vm.grids.twt is twt)
+        self.assertFalse(vm.time_model.grids is grids)
+        twt = vm.grids.twt
+        vm.sl = 2 * vm.sl
+        self.assertTrue(np.allclose(vm.grids.twt, 2 * twt))
+        grids = vm.time_model.grids
+        vm.time_model.dt = 0.05
+        self.assertFalse(vm.time_model.grids is grids)
+        # should match a 1D interpolation in each column
+        sl = vm.time_model.grids.slowness
+        t = vm.time_model.twt
+        for ix, iy in [(0, 0), (2, 3), (4, 4)]:
+            tmax = vm.grids.twt[ix, iy, -1]
+            self.assertTrue(np.allclose(sl[ix, iy, t <= tmax],
+                np.interp(t[t <= tmax], vm.grids.twt[ix, iy], vm.sl[ix, iy])))
+            # should not extend columns below the base of the model
+            self.assertTrue(np.all(np.isnan(sl[ix, iy, t > tmax])))
+
     def dev_grids(self):
         """
         Should use a separate class to manage grids 
@@ -1,15 +1,42 @@
 """
 Test suite for the rayfan module.
 """
+import os
 import unittest
 import numpy as np
 import logging
-from rockfish.tomography.rayfan import Rayfan
+import matplotlib.pyplot as plt
+from rockfish.tomography.rayfan import Rayfan, readRayfanGroup, rayfan2db,\
+        merge_rayfans, subset_rayfan, encode_raypath, decode_raypath,\
+        decode_raypaths, rayfan_statistics, raypath_matrix, hit_count_grid,\
+        dws_grid
+from rockfish.tomography.model import VM
+from rockfish.picking.database import PickDatabaseConnection
 from rockfish.utils.loaders import get_example_file
 
 logging.basicConfig(level=logging.DEBUG)
 
 
+def write_example_rayfans(filename, paths, endian='<'):
+    """
+    Write a version 2 rayfan file with a rayfan for each list of paths.
+    """
+    f = open(filename, 'wb')
+    np.array([-2, len(paths)], dtype=endian + 'i4').tofile(f)
+    for irfn, _paths in enumerate(paths):
+        n = len(_paths)
+        lens = [len(p) for p in _paths]
+        np.array([irfn + 1, n, sum(lens)], dtype=endian + 'i4').tofile(f)
+        np.array([0.01], dtype=endian + 'f4').tofile(f)
+        np.array([np.arange(n) + 10, np.ones(n), np.zeros(n), lens],
+                 dtype=endian + 'i4').tofile(f)
+        np.array([np.ones(n), np.arange(n) + 1, 0.1 * np.ones(n)],
+                 dtype=endian + 'f4').tofile(f)
+        for path in _paths:
+            np.array(path, dtype=endian + 'f4').tofile(f)
+    f.close()
+
+
 class rayfanTestCase(unittest.TestCase):
     """
     Test cases for the rayfan module.
@@ -25,6 +52,369 @@ class rayfanTestCase(unittest.TestCase):
         # Should read 1st rayfan from the file
         rfn = Rayfan(file)
 
+    def test_read_columnar(self):
+        """
+        Should read all raypaths in a rayfan into a single array.
+        """
+        paths = [[[0, 0, 0], [1, 0, 2], [2, 0, 2], [4, 0, 0]],
+                 [],
+                 [[0, 0, 0], [0, 3, 1], [0, 4, 0]]]
+        tmp = 'temp.ray'
+        for endian in '<>':
+            write_example_rayfans(tmp, [paths, paths[2:]], endian=endian)
+            rays = readRayfanGroup(tmp, endian=endian)
+            self.assertEqual(len(rays.rayfans), 2)
+            rfn = rays.rayfans[0]
+            self.assertEqual(rfn.points.shape, (7, 3))
+            self.assertEqual(rfn.points.dtype, np.float32)
+            self.assertTrue(np.all(rfn.path_offsets == [0, 4, 4, 7]))
+            self.assertEqual(len(rfn.paths), 3)
+            for path, _path in zip(rfn.paths, paths):
+                self.assertTrue(np.array_equal(path,
+                                               np.reshape(_path, (-1, 3))))
+            self.assertTrue(np.all(rfn.end_point_ids == [10, 11, 12]))
+            self.assertTrue(np.allclose(rfn.travel_times, [1, 2, 3]))
+            self.assertAlmostEqual(rfn.static_correction, 0.01)
+            # derived values should be nan for empty raypaths
+            self.assertTrue(np.allclose(rfn.offsets, [4, np.nan, 4],
+                                        equal_nan=True))
+            self.assertTrue(np.allclose(rfn.azimuths, [90, np.nan, 0],
+                                        equal_nan=True))
+            self.assertTrue(np.allclose(rfn.bottom_points,
+                                        [[1, 0, 2], [np.nan] * 3, [0, 3, 1]],
+                                        equal_nan=True))
+            self.assertTrue(np.allclose(rfn.endpoints,
+                                        [[0, 0, 0], [np.nan] * 3, [0, 0, 0]],
+                                        equal_nan=True))
+            self.assertEqual(rays.rayfans[1].nrays, 1)
+            self.assertEqual(rays.nrays, 4)
+            rays.file.close()
+        os.remove(tmp)
+
+    def test_read_start_points(self):
+        """
+        Should read rayfans for selected start points with a seek table.
+        """
+        paths = [[[[0, 0, 0], [1, 0, 2], [2, 0, 0]]],
+                 [[[0, 0, 0], [0, 1, 1]], []],
+                 [[[0, 0, 0], [3, 0, 1], [4, 0, 2], [5, 0, 0]]]]
+        tmp = 'temp.ray'
+        idx = tmp + '.idx'
+        write_example_rayfans(tmp, paths)
+        if os.path.isfile(idx):
+            os.remove(idx)
+        # should build the seek table by scanning rayfan headers
+        rays = readRayfanGroup(tmp, endian='<', start_points=[1, 3])
+        self.assertTrue(os.path.isfile(idx))
+        self.assertEqual([r.start_point_id for r in rays.rayfans], [1, 3])
+        self.assertTrue(np.array_equal(rays.rayfans[1].paths[0],
+                                       paths[2][0]))
+        # should match the seek table built from a full read
+        table = rays.seek_table
+        os.remove(idx)
+        rays = readRayfanGroup(tmp, endian='<')
+        self.assertTrue(np.array_equal(table, rays.seek_table))
+        self.assertTrue(np.all(table['nrays'] == [1, 2, 1]))
+        self.assertTrue(np.all(table['npoints'] == [3, 2, 4]))
+        # should read from the sidecar
+        rays = readRayfanGroup(tmp, endian='<', start_points=[2])
+        self.assertEqual(len(rays.rayfans), 1)
+        self.assertEqual(rays.rayfans[0].nrays, 2)
+        self.assertTrue(np.array_equal(table, rays.seek_table))
+        # should rebuild the seek table when the rayfan file changes
+        write_example_rayfans(tmp, paths[::-1] + paths[:1])
+        rays = readRayfanGroup(tmp, endian='<', start_points=[1])
+        self.assertTrue(np.array_equal(rays.rayfans[0].paths[0],
+                                       paths[2][0]))
+        os.remove(tmp)
+        os.remove(idx)
+
+    def test_cached_values(self):
+        """
+        Should cache derived values until a rayfan is modified.
+        """
+        paths = [[[0, 0, 0], [1, 0, 2], [2, 0, 0]],
+                 [[0, 0, 0], [3, 0, 1], [4, 0, 0]]]
+        tmp = 'temp.ray'
+        write_example_rayfans(tmp, [paths, paths[:1]])
+        rays = readRayfanGroup(tmp, endian='<')
+        rays.file.close()
+        os.remove(tmp)
+        os.remove(tmp + '.idx')
+        rfn = rays.rayfans[0]
+        self.assertTrue(rfn.offsets is rfn.offsets)
+        self.assertTrue(rays.residuals is rays.residuals)
+        self.assertEqual(rays.nrays, 3)
+        self.assertTrue(np.allclose(rays.offsets, [2, 4, 2]))
+        with self.assertRaises(ValueError):
+            rfn.residuals[0] = 0.
+        # should recalculate values after the rayfan is modified
+        self.assertTrue(np.allclose(rays.residuals, [0.01, 1.01, 0.01]))
+        rfn.travel_times[1] = 4.
+        self.assertTrue(np.allclose(rays.residuals, [0.01, 1.01, 0.01]))
+        rfn.modified()
+        self.assertTrue(np.allclose(rfn.residuals, [0.01, 3.01]))
+        self.assertTrue(np.allclose(rays.residuals, [0.01, 3.01, 0.01]))
+        self.assertAlmostEqual(rfn.rms, np.sqrt((0.01 ** 2 + 3.01 ** 2) / 2))
+        # should recalculate group values after rayfans are removed
+        rays.rayfans = rays.rayfans[1:]
+        self.assertTrue(np.allclose(rays.residuals, [0.01]))
+        self.assertEqual(rays.nrays, 1)
+
+    def test_rayfan2db(self):
+        """
+        Should add all rays in a rayfan file to a database.
+        """
+        paths = [[[0, 0, 0], [1, 0, 2], [2, 0, 0]],
+                 [[0, 0, 0], [3, 0, 1], [4, 0, 0]]]
+        tmp = 'temp.ray'
+        write_example_rayfans(tmp, [paths, paths[::-1]])
+        pickdb = PickDatabaseConnection(':memory:')
+        pickdb.update_pick(event='Pg', ensemble=2, trace=11, time=0,
+                           branch=1, subbranch=0, trace_in_file=7,
+                           source_x=0, source_y=0, source_z=0,
+                           receiver_x=0, receiver_y=0, receiver_z=0)
+        raydb = rayfan2db(tmp, pickdb=pickdb)
+        picks = raydb.get_picks()
+        self.assertEqual(len(picks), 4)
+        for row in picks:
+            self.assertEqual(row['event'], 'Pg')
+            i = row['trace'] - 10
+            if row['ensemble'] == 2:
+                i = 1 - i
+            self.assertAlmostEqual(row['offset'], 2 * (i + 1))
+            self.assertAlmostEqual(row['receiver_x'], paths[i][-1][0])
+            self.assertAlmostEqual(row['time'], 1)
+            self.assertAlmostEqual(row['predicted'], row['trace'] - 9)
+            if (row['ensemble'], row['trace']) == (2, 11):
+                self.assertEqual(row['trace_in_file'], 7)
+            else:
+                self.assertEqual(row['trace_in_file'], None)
+        # should copy data for more ensembles than fit in one query
+        write_example_rayfans(tmp, [[paths[0]]] * 1200)
+        pickdb = PickDatabaseConnection(':memory:')
+        pickdb.update_picks([{'event': 'Pg', 'ensemble': i + 1, 'trace': 10,
+                              'time': 0, 'branch': 1, 'subbranch': 0,
+                              'trace_in_file': i, 'source_x': 0,
+                              'source_y': 0, 'source_z': 0,
+                              'receiver_x': 0, 'receiver_y': 0,
+                              'receiver_z': 0} for i in range(1200)])
+        raydb = rayfan2db(tmp, pickdb=pickdb)
+        picks = raydb.get_picks()
+        self.assertEqual(len(picks), 1200)
+        for row in picks:
+            self.assertEqual(row['trace_in_file'], row['ensemble'] - 1)
+        write_example_rayfans(tmp, [paths, paths[::-1]])
+        # should only add noise to synthetic times
+        raydb = rayfan2db(tmp, pickdb=pickdb, noise=0.05)
+        for row in raydb.get_picks():
+            self.assertAlmostEqual(row['time'], 1)
+            self.assertAlmostEqual(row['predicted'], row['trace'] - 9)
+        raydb = rayfan2db(tmp, pickdb=pickdb, synthetic=True, noise=0.05)
+        for row in raydb.get_picks():
+            self.assertTrue(abs(row['time'] - (row['trace'] - 9)) <= 0.05)
+            self.assertEqual(row['predicted'], None)
+        # should store raypaths with the bottom point of each ray
+        for codec in ['raw', 'zlib']:
+            raydb = rayfan2db(tmp, pickdb=pickdb, raypaths=True,
+                              raypath_codec=codec)
+            rows = raydb.execute('SELECT * FROM raypaths').fetchall()
+            self.assertEqual(len(rows), 4)
+            for row in rows:
+                i = row['trace'] - 10
+                if row['ensemble'] == 2:
+                    i = 1 - i
+                self.assertEqual(row['ray_btm_z'], 2 - i)
+                self.assertTrue(np.array_equal(decode_raypath(row['path']),
+                                               paths[i]))
+        os.remove(tmp)
+        os.remove(tmp + '.idx')
+        # should raise error for an unknown codec
+        with self.assertRaises(ValueError):
+            rayfan2db(tmp, raypaths=True, raypath_codec='bogus')
+
+    def test_decode_raypaths(self):
+        """
+        Should decode many raypaths into a single array.
+        """
+        paths = [np.random.rand(n, 3) for n in [3, 0, 5]]
+        blobs = [encode_raypath(paths[0]),
+                 encode_raypath(paths[1], codec='zlib'),
+                 encode_raypath(paths[2], codec='zlib')]
+        points, path_offsets = decode_raypaths(blobs)
+        self.assertEqual(points.dtype, np.float32)
+        self.assertTrue(np.all(path_offsets == [0, 3, 3, 8]))
+        self.assertTrue(np.allclose(points, np.vstack(paths)))
+        for path, blob in zip(paths, blobs):
+            self.assertTrue(np.allclose(decode_raypath(blob), path))
+        self.assertEqual(len(blobs[0]), 1 + 4 * 9)
+        # should compress values
+        blob = encode_raypath(np.zeros((100, 3)), codec='zlib')
+        self.assertTrue(len(blob) < 4 * 300)
+        with self.assertRaises(ValueError):
+            decode_raypath('X' + blobs[0][1:])
+
+    def test_write(self):
+        """
+        Should write rayfans that read back the same.
+        """
+        paths = [[[0, 0, 0], [1, 0, 2], [2, 0, 0]],
+                 [],
+                 [[0, 0, 0], [3, 0, 1], [4, 0, 2], [5, 0, 0]]]
+        tmp = 'temp.ray'
+        write_example_rayfans(tmp, [paths, paths[2:]])
+        data = open(tmp, 'rb').read()
+        rays = readRayfanGroup(tmp, endian='<')
+        rays.file.close()
+        rays.write(tmp, endian='<')
+        self.assertEqual(open(tmp, 'rb').read(), data)
+        # should select a subset of rays
+        rfn = rays.rayfans[0].select([0, 2])
+        self.assertEqual(rfn.nrays, 2)
+        self.assertTrue(np.all(rfn.path_offsets == [0, 3, 7]))
+        self.assertTrue(np.all(rfn.end_point_ids == [10, 12]))
+        self.assertTrue(np.array_equal(rfn.paths[1], paths[2]))
+        self.assertTrue(np.allclose(rfn.offsets, [2, 5]))
+        self.assertEqual(rays.rayfans[0].nrays, 3)
+        os.remove(tmp)
+        os.remove(tmp + '.idx')
+
+    def test_merge_and_subset(self):
+        """
+        Should merge rayfan files and write subsets of rayfans.
+        """
+        paths = [[[0, 0, 0], [1, 0, 2], [2, 0, 0]],
+                 [[0, 0, 0], [3, 0, 1], [4, 0, 2], [5, 0, 0]]]
+        files = ['temp0.ray', 'temp1.ray']
+        write_example_rayfans(files[0], [paths, paths[:1]])
+        write_example_rayfans(files[1], [paths[1:]])
+        merge_rayfans(files, 'temp.ray', endian='<')
+        rays = readRayfanGroup('temp.ray', endian='<')
+        self.assertEqual([r.start_point_id for r in rays.rayfans], [1, 2, 1])
+        self.assertEqual([r.nrays for r in rays.rayfans], [2, 1, 1])
+        self.assertTrue(np.array_equal(rays.rayfans[2].paths[0], paths[1]))
+        # should keep rayfans for some start points
+        subset_rayfan('temp.ray', files[0], start_points=[1], endian='<')
+        _rays = readRayfanGroup(files[0], endian='<')
+        self.assertEqual([r.nrays for r in _rays.rayfans], [2, 1])
+        # should keep rays for some branches
+        rays.rayfans[0].event_ids[1] = 2
+        rays.write(files[1], endian='<')
+        subset_rayfan(files[1], files[0], branches=[2], endian='<')
+        _rays = readRayfanGroup(files[0], endian='<')
+        self.assertEqual(len(_rays.rayfans), 1)
+        self.assertTrue(np.all(_rays.rayfans[0].end_point_ids == [11]))
+        self.assertTrue(np.array_equal(_rays.rayfans[0].paths[0], paths[1]))
+        for filename in files + ['temp.ray']:
+            os.remove(filename)
+            os.remove(filename + '.idx')
+
+    def test_rayfan_statistics(self):
+        """
+        Should calculate residual statistics for groups of rays.
+        """
+        paths = [[[0, 0, 0], [1, 0, 2], [2, 0, 0]],
+                 [[0, 0, 0], [3, 0, 1], [4, 0, 2], [5, 0, 0]],
+                 [[0, 0, 0], [4, 0, 1], [6, 0, 0]]]
+        tmp = 'temp.ray'
+        write_example_rayfans(tmp, [paths, paths[:2]])
+        rays = readRayfanGroup(tmp, endian='<')
+        stats = rayfan_statistics(tmp, endian='<')
+        self.assertTrue(np.all(stats.start_point == [1, 2]))
+        self.assertTrue(np.all(stats.event == [1, 1]))
+        self.assertTrue(np.all(stats['count'] == [3, 2]))
+        for i, rfn in enumerate(rays.rayfans):
+            self.assertAlmostEqual(stats.mean_residual[i],
+                                   np.mean(rfn.residuals))
+            self.assertAlmostEqual(stats.rms[i], rfn.rms)
+            self.assertAlmostEqual(stats.chi2[i], rfn.chi2_mean)
+        # should group by end point
+        stats = rayfan_statistics(tmp, by=('end_point',), endian='<')
+        self.assertTrue(np.all(stats.end_point == [10, 11, 12]))
+        self.assertTrue(np.all(stats['count'] == [2, 2, 1]))
+        self.assertTrue(np.allclose(stats.mean_residual,
+                                    rays.rayfans[0].residuals))
+        # should put all rays in one group
+        stats = rayfan_statistics(tmp, by=(), endian='<')
+        self.assertEqual(stats['count'][0], 5)
+        self.assertAlmostEqual(stats.rms[0],
+                               np.sqrt(np.mean(rays.residuals ** 2)))
+        # should raise an error for unknown fields
+        with self.assertRaises(ValueError):
+            rayfan_statistics(tmp, by=('bogus',), endian='<')
+        os.remove(tmp)
+        os.remove(tmp + '.idx')
+
+    def test_raypath_matrix(self):
+        """
+        Should build a sparse matrix of raypath lengths in model cells.
+        """
+        paths = [[[0, 0, 1], [4, 0, 1]],
+                 [[0, 0, 0], [3, 0, 3]],
+                 [[-2, 0, 2], [1, 0, 2]]]
+        tmp = 'temp.ray'
+        write_example_rayfans(tmp, [paths[:2], paths[2:]])
+        rays = readRayfanGroup(tmp, endian='<')
+        vm = VM(r1=(0, 0, 0), r2=(4, 0, 4), dx=1, dy=1, dz=1)
+        G = raypath_matrix(rays, vm)
+        self.assertEqual(G.shape, (3, vm.nx * vm.ny * vm.nz))
+        # cells are centered on grid nodes
+        L = G.toarray().reshape((3, vm.nx, vm.nz))
+        self.assertTrue(np.allclose(L[0, :, 1], [0.5, 1, 1, 1, 0.5]))
+        self.assertTrue(np.allclose(np.diag(L[1]),
+                                    np.sqrt(2) * np.array([0.5, 1, 1, 0.5,
+                                                           0])))
+        # should ignore parts of paths outside of the grid
+        self.assertTrue(np.allclose(L[2, :, 2], [1, 0.5, 0, 0, 0]))
+        self.assertTrue(np.allclose(G.sum(axis=1).T,
+                                    [4, 3 * np.sqrt(2), 1.5]))
+        # should work for a single rayfan
+        G0 = raypath_matrix(rays.rayfans[0], vm)
+        self.assertTrue(np.allclose(G0.toarray(), G.toarray()[:2]))
+        # should reduce to grids
+        hits = hit_count_grid(G, vm)
+        self.assertEqual(hits.shape, (vm.nx, vm.ny, vm.nz))
+        self.assertEqual(hits[1, 0, 1], 2)
+        self.assertEqual(hits[0, 0, 3], 0)
+        dws = dws_grid(G, vm)
+        self.assertAlmostEqual(dws[1, 0, 1], 1 + np.sqrt(2))
+        self.assertAlmostEqual(dws.sum(), G.sum())
+        os.remove(tmp)
+        os.remove(tmp + '.idx')
+
+    def test_plot_raypaths(self):
+        """
+        Should plot raypaths as a line collection for each event.
+        """
+        paths = [[[0, 0, 0], [1, 0, 1], [2, 0, 2], [3, 0, 1], [4, 0, 0]],
+                 [],
+                 [[0, 0, 0], [0, 1, 1], [0, 2, 0]]]
+        tmp = 'temp.ray'
+        write_example_rayfans(tmp, [paths, paths[:1]])
+        rays = readRayfanGroup(tmp, endian='<')
+        rays.rayfans[0].event_ids[2] = 2
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        rays.plot_raypaths(ax=ax, event_colors={2: 'b'})
+        self.assertEqual(len(ax.collections), 2)
+        segments = [len(lc.get_segments()) for lc in ax.collections]
+        self.assertEqual(sorted(segments), [1, 2])
+        # should accept colors given as sequences
+        ax.cla()
+        rays.plot_raypaths(ax=ax, event_colors={2: [0, 0, 1]},
+                           default_color=(0.5, 0.5, 0.5))
+        self.assertEqual(len(ax.collections), 2)
+        # should decimate points but keep the last point
+        ax.cla()
+        rays.plot_raypaths(ax=ax, decimate=3, subsample=3)
+        segments = ax.collections[0].get_segments()
+        self.assertEqual(len(segments), 2)
+        for segment in segments:
+            self.assertTrue(np.allclose(segment, [[0, 0], [3, 1], [4, 0]]))
+        plt.close(fig)
+        os.remove(tmp)
+        os.remove(tmp + '.idx')
+
 
 def suite():
     return unittest.makeSuite(rayfanTestCase, 'test')
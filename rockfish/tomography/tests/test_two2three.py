@@ -60,6 +60,32 @@ class two2threeTestCase(unittest.TestCase):
             self.assertTrue(np.min(ix) >= 0)
             self.assertTrue(np.max(ix) <= vm2d.nx)
 
+    def test_project_layer_velocities(self):
+        """
+        Should stretch 2D velocity columns to fit 3D layers.
+        """
+        vm2d = VM(r1=(0, 0, 0), r2=(50, 0, 30), dx=1, dy=1, dz=1)
+        vm2d.insert_interface([[_z] for _z in 3 + vm2d.x * 0.1])
+        vm2d.insert_interface(20)
+        vm2d.sl = 0.1 + 0.01 * vm2d.z * np.ones((vm2d.nx, 1, 1))
+        vm3d = VM(r1=(10, 1, 0), r2=(20, 20, 30), dx=1, dy=1, dz=1)
+        vm3d.insert_interface(5)
+        vm3d.insert_interface(12)
+        project_layer_velocities(vm2d, vm3d, 30, 1)
+        # should match a 1D interpolation of each column
+        ix_2d = project_model_points(vm2d, vm3d, 30, indices=True)
+        for ix, iy in [(0, 0), (4, 7), (10, 19)]:
+            z0, z1 = vm2d.rf[:, ix_2d[ix, iy], 0]
+            iz_2d = vm2d.zrange2i(z0, z1)
+            iz_3d = vm3d.zrange2i(5, 12)
+            i3d = np.arange(len(iz_3d)) * float(len(iz_2d)) / len(iz_3d)
+            sl = np.interp(i3d, np.arange(len(iz_2d)),
+                           vm2d.sl[ix_2d[ix, iy], 0, iz_2d])
+            self.assertTrue(np.allclose(vm3d.sl[ix, iy, iz_3d], sl))
+        # should not change other layers
+        self.assertTrue(np.all(vm3d.sl[:, :, :5] == 0))
+        self.assertTrue(np.all(vm3d.sl[:, :, 13:] == 0))
+
     def dev_project_layer_velocities(self):
         """
         Should map 2D model velocities to a 3D model.
@@ -117,6 +143,18 @@ class two2threeTestCase(unittest.TestCase):
         """
         self.test_two2three(sol=(343, 1085), theta=39)
 
+    def test_two2three_2d_origin(self):
+        """
+        Should measure distances along the line from the 2D model origin.
+        """
+        vm2d = VM(r1=(100, 0, 0), r2=(200, 0, 10), dx=10, dy=1, dz=1)
+        vm2d.insert_interface([[_x / 100.] for _x in vm2d.x])
+        vm3d = two2three(vm2d, (0, 0), (100, 0), dx=10, dy=10)
+        self.assertTrue(np.allclose(vm3d.rf[0, :, 0], 1 + vm3d.x / 100.))
+        # should also project points from the 2D origin
+        x = project_model_points(vm2d, vm3d, 0)
+        self.assertTrue(np.allclose(x[:, 0], 100 + vm3d.x))
+
 
 def suite():
     return unittest.makeSuite(two2threeTestCase, 'dev')
@@ -2,9 +2,8 @@
 Methods for creating 3D models from 2D models.
 """
 import numpy as np
-from scipy.interpolate import interp1d, interp2d
 import warnings
-from rockfish.tomography.model import VM
+from rockfish.tomography.model import VM, linear_weights, nearest_index
 
 
 def project_point(x, y, theta):
@@ -55,14 +54,12 @@ def project_model_points(vm2d, vm3d, phi, indices=False):
     """
     assert vm2d.ny == 1, 'vm2d must be 2D with vm2d.ny == 1'
     x_3d = vm3d.x - vm3d.r1[0]
-    x_2d = np.zeros((vm3d.nx, vm3d.ny))
-    for _iy in vm3d.yrange2i():
-        _y_3d = vm3d.y[_iy] - vm3d.r1[1]
-        x_2d[:, _iy], _, _ = project_point(x_3d, _y_3d, phi)
-    x_2d = x_2d.clip(vm2d.r1[0], vm2d.r2[0])
+    y_3d = vm3d.y - vm3d.r1[1]
+    x_2d, _, _ = project_point(x_3d[:, np.newaxis], y_3d[np.newaxis, :], phi)
+    # distance along the line is measured from the 2D model origin
+    x_2d = (vm2d.r1[0] + x_2d).clip(vm2d.r1[0], vm2d.r2[0])
     if indices:
-        return np.asarray(vm2d.x2i(x_2d.flatten()))\
-                .reshape((vm3d.nx, vm3d.ny))
+        return nearest_index(x_2d, vm2d.r1[0], vm2d.dx, vm2d.nx)
     else:
         return x_2d
 
@@ -93,26 +90,26 @@ def project_layer_velocities(vm2d, vm3d, phi, ilyr_3d, ilyr_2d=None,
     if ilyr_2d is None:
         ilyr_2d = ilyr_3d
     ix_2d = project_model_points(vm2d, vm3d, phi, indices=True)
-    z_2d = vm2d.get_layer_bounds(ilyr_2d)
-    z_3d = vm3d.get_layer_bounds(ilyr_3d)
-    for ix in vm3d.xrange2i():
-        for iy in vm3d.yrange2i():
-            # get slowness collumn from 2d model
-            _z0_2d = z_2d[0][ix_2d[ix, iy], 0]
-            _z1_2d = z_2d[1][ix_2d[ix, iy], 0]
-            iz_2d = vm2d.zrange2i(_z0_2d, _z1_2d)
-            sl_2d = vm2d.sl[ix_2d[ix, iy], 0, iz_2d]
-            # get depth range in 3d model 
-            _z0_3d = z_3d[0][ix, iy]
-            _z1_3d = z_3d[1][ix, iy]
-            iz_3d = vm2d.zrange2i(_z0_3d, _z1_3d)
-            # fit 2d range into 3d range
-            n2d = len(iz_2d)
-            n3d = len(iz_3d)
-            i2d = np.arange(n2d)
-            i3d = np.arange(n3d) * float(n2d) / float(n3d)
-            z2sl = interp1d(i2d, sl_2d)
-            vm3d.sl[ix, iy, iz_3d] = z2sl(np.clip(i3d, 0, i2d[-1]))
+    # nodes in the 3d layer
+    ix, iy, iz, iz0_3d, iz1_3d = vm3d.get_layer_nodes(ilyr_3d)
+    # range of the 2d layer in the column projected to each node
+    ixp = ix_2d[ix, iy]
+    z0_2d, z1_2d = vm2d.get_layer_bounds(ilyr_2d)
+    iz0_2d = nearest_index(z0_2d[ixp, 0], vm2d.r1[2], vm2d.dz, vm2d.nz)
+    iz1_2d = nearest_index(z1_2d[ixp, 0], vm2d.r1[2], vm2d.dz, vm2d.nz)
+    n2d = iz1_2d - iz0_2d + 1
+    n3d = iz1_3d - iz0_3d + 1
+    # fit 2d range into 3d range
+    keep = n2d > 0
+    i3d = np.clip((iz - iz0_3d) * n2d / n3d.astype(float), 0, n2d - 1)[keep]
+    i0 = np.minimum(np.floor(i3d).astype(int), np.maximum(n2d[keep] - 2, 0))
+    i1 = np.minimum(i0 + 1, n2d[keep] - 1)
+    w = i3d - i0
+    sl = vm2d.sl[ixp[keep], 0]
+    sl0 = sl[np.arange(len(i0)), iz0_2d[keep] + i0]
+    sl1 = sl[np.arange(len(i1)), iz0_2d[keep] + i1]
+    vm3d.sl[ix[keep], iy[keep], iz[keep]] = (1 - w) * sl0 + w * sl1
+    vm3d.grids.modified()
 
 
 def two2three(vm, sol, eol, dx=None, dy=None, phi=90.0, head_only=False):
@@ -160,47 +157,25 @@ def two2three(vm, sol, eol, dx=None, dy=None, phi=90.0, head_only=False):
              dx=dx, dy=dy, nr=vm.nr)
     if head_only:
         return vm1
-    # build surface interpolators
-    x2rf = []
-    x2jp = []
-    x2ir = []
-    x2ij = []
-    xp = vm.x - vm.r1[0]    # x in 2D model relative to 2D origin
-    for iref in range(0, vm.nr):
-        x2rf.append(interp1d(xp, [v[0] for v in vm.rf[iref]],
-                             kind='linear'))
-        x2jp.append(interp1d(xp, [v[0] for v in vm.jp[iref]],
-                             kind='linear'))
-        x2ir.append(interp1d(xp, [v[0] for v in vm.ir[iref]],
-                             kind='nearest'))
-        x2ij.append(interp1d(xp, [v[0] for v in vm.ij[iref]],
-                             kind='nearest'))
     # map 2D model to the 3D model
     x = vm1.x - vm1.r1[0]   # x in 3D model relative to origin
-
-    for _iy in vm1.yrange2i():
-        _y = vm1.y[_iy] - vm1.r1[1]  # y in 3D model relative to origin
-        a, _, _ = project_point(x, _y, theta)
-        a = a.clip(vm.r1[0], vm.r2[0])
-        nclip = len(np.nonzero(a == vm.r1[0]))\
-                + len(np.nonzero(a == vm.r2[0]))
-        if nclip > 2:
-            warnings.warn('{:} points off the 2D line at y={:}'\
-                          .format(nclip - 2, _y))
-        # interpolate interface values
-        for iref in range(0, vm.nr):
-            try:
-                vm1.rf[iref, :, _iy] = x2rf[iref](a)
-                vm1.jp[iref, :, _iy] = x2jp[iref](a)
-                vm1.ir[iref, :, _iy] = x2ir[iref](a)
-                vm1.ij[iref, :, _iy] = x2ij[iref](a)
-            except ValueError as e:
-                msg = e.message
-                msg += ' (min(a),max(a)={:},{:}; vm.r1[0]={:}; vm.r2[0]={:})'\
-                        .format(min(a), max(a), vm.r1[0], vm.r2[0])
-                raise ValueError(msg)
-        # assign velocities
-        for _ix, _a in enumerate(a):
-            _ixp = vm.x2i([_a])[0]
-            vm1.sl[_ix, _iy, :] = vm.sl[_ixp, 0, :]
+    y = vm1.y - vm1.r1[1]   # y in 3D model relative to origin
+    a, _, _ = project_point(x[:, np.newaxis], y[np.newaxis, :], theta)
+    # distance along the line is measured from the 2D model origin
+    a = (vm.r1[0] + a).clip(vm.r1[0], vm.r2[0])
+    nclip = np.sum((a == vm.r1[0]) | (a == vm.r2[0]), axis=0)
+    if np.any(nclip > 2):
+        warnings.warn('{:} points off the 2D line'\
+                      .format(np.sum(nclip[nclip > 2] - 2)))
+    # interpolate interface values
+    xp = a - vm.r1[0]    # x in 2D model relative to 2D origin
+    ix0, ix1, w = linear_weights(xp, 0., vm.dx, vm.nx)
+    ix = nearest_index(xp, 0., vm.dx, vm.nx)
+    for attr in ['rf', 'jp']:
+        v = vm.__getattribute__(attr)[:, :, 0]
+        vm1.__setattr__(attr, (1 - w) * v[:, ix0] + w * v[:, ix1])
+    vm1.ir = vm.ir[:, ix, 0]
+    vm1.ij = vm.ij[:, ix, 0]
+    # assign velocities
+    vm1.sl = vm.sl[nearest_index(a, vm.r1[0], vm.dx, vm.nx), 0, :]
     return vm1
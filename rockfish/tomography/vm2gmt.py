@@ -1,11 +1,10 @@
 """
 Utilities for converting model data to Genneric Mapping Tools formats.
 """
-import os
-import subprocess
 import numpy as np
 from scipy.io import netcdf_file as netcdf
 from sympy.physics import units as sunits
+from rockfish.tomography.model import write_netcdf_grid
 
 def interface2netcdf(vm, iref, filename, units='km', elevation=False):
     """
@@ -27,11 +26,7 @@ def interface2netcdf(vm, iref, filename, units='km', elevation=False):
         If ``True``, flip the sign of interface depths.
     """
     # Unit scaling
-    scl = sunits.kilometers / sunits.__getattribute__(units)
-    if elevation:
-        zscl = scl * -1.
-    else:
-        zscl = scl
+    scl, zscl = _get_scales(units, elevation)
     # Open file
     f = netcdf(filename, 'w')
     f.title = 'Interface {:} from VM model.'.format(iref) 
@@ -60,19 +55,10 @@ def interface2netcdf(vm, iref, filename, units='km', elevation=False):
     f.sync()
     f.close()
 
-def interface2grd(vm, iref, filename, **kwargs):
+def interface2grd(vm, iref, filename, units='km', elevation=False):
     """
     Write surface depths to a GMT-compatible netcdf file.
 
-    .. note:: In general, netcdf files produced by :meth:`surface2netcdf`
-        are compatible with GMT. However, zmin and zmax are not set correctly,
-        causing issues with other programs such as Fledermaus. 
-        :meth:`surface2grd` is a kludge that uses GMT's grd2xyz and then
-        xyz2grd to create a fully GMT-compatible netcdf file. 
-        
-    .. todo:: Replace with a fully functioning version of 
-        :meth:`surface2netcdf`.
-
     Parameters
     ----------
     vm : :class:`rockfish.tomography.model.VM`
@@ -81,20 +67,27 @@ def interface2grd(vm, iref, filename, **kwargs):
         Index of interface to extract.
     filename: str
         Name of the grd file to write the interface to.
-    kwargs :
-        Arguments for :meth:`surface2netcdf`.
+    units : 'str', optional
+        Name of distance units in the output file. Must be a unit name
+        understood by :class:`sympy.physics.units`. Distance units in the
+        model are assumed to be 'km'.
+    elevation : bool, optional
+        If ``True``, flip the sign of interface depths.
+    """
+    scl, zscl = _get_scales(units, elevation)
+    write_netcdf_grid(filename, vm.x * scl, vm.y * scl,
+                      vm.rf[iref].transpose() * zscl,
+                      title='Interface {:} from VM model.'.format(iref),
+                      xunits=units, yunits=units, zunits=units)
+
+def _get_scales(units, elevation):
+    """
+    Get scale factors for converting model distances and depths to
+    ``units``.
     """
-    ncdf = 'temp.netcdf'
-    interface2netcdf(vm, iref, ncdf, **kwargs)
-    grd = netcdf(ncdf)
-    y = grd.variables['x'][:]
-    x = grd.variables['y'][:]
-    region = '{:}/{:}/{:}/{:}'.format(min(x), max(x), min(y), max(y))
-    spacing = '{:}/{:}'.format(np.diff(x[0:2])[0], np.diff(y[0:2])[0])
-    tmp = 'temp.xyz'
-    gmt = "grd2xyz {:} > {:}\n".format(ncdf, tmp)
-    gmt += 'xyz2grd {:} -G{:} -R{:} -I{:}'\
-            .format(tmp, filename, region, spacing)
-    subprocess.call(gmt, shell=True)
-    os.remove(tmp)
-    os.remove(ncdf)
+    scl = sunits.kilometers / sunits.__getattribute__(units)
+    if elevation:
+        zscl = scl * -1.
+    else:
+        zscl = scl
+    return scl, zscl
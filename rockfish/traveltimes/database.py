@@ -66,6 +66,7 @@ from pyspatialite.dbapi2 import IntegrityError
 from rockfish.utils.user_input import query_yes_no
 from rockfish.database.utils import format_search, format_row_factory
 from rockfish.segy.segy import readSEGY 
+from rockfish.tomography.rayfan import encode_raypath
 
 DEFAULT_EPSG = 4326
 
@@ -830,36 +831,54 @@ class TraveltimeDatabaseConnection(DatabaseConnection):
         self.commit()
 
 
-    def insert_rayfan(self, rays, model_line=None, vm_model=None):
-
+    def insert_rayfan(self, rays, model_line=None, vm_model=None,
+                      codec='raw'):
+        """
+        Insert traveltimes and raypaths from rayfans into the rays table.
+
+        Raypaths are stored as BLOBs made by
+        :func:`rockfish.tomography.rayfan.encode_raypath`. Use
+        :func:`rockfish.tomography.rayfan.decode_raypaths` to read them.
+
+        :param rays: :class:`rockfish.tomography.rayfan.RayfanGroup` with
+            rays to insert.
+        :param model_line: Optional. Name of the model line that rays were
+            traced for.
+        :param vm_model: Optional. Name of the model that rays were traced
+            through. Existing rays for this model are replaced.
+        :param codec: Optional. Codec for storing raypaths. Options are
+            'raw' (default) or 'zlib'.
+        """
         if vm_model is not None:
             sql = "DELETE FROM rays WHERE vm_model='{:}'"\
                     .format(vm_model)
+            self.execute(sql)
+
+        sql = 'SELECT event, branch, subbranch FROM events'
+        events = {}
+        for event, branch, subbranch in self.execute(sql):
+            events[(branch, subbranch)] = event
 
+        rows = []
         for rfn in rays.rayfans:
 
             rid = rfn.start_point_id
+            paths = rfn.paths
+            sids = rfn.end_point_ids.tolist()
+            branches = rfn.event_ids.tolist()
+            subbranches = rfn.event_subids.tolist()
+            times = rfn.travel_times.tolist()
 
             for i in range(rfn.nrays):
-                sid = rfn.end_point_ids[i]
-
-                branch = rfn.event_ids[i]
-                subbranch = rfn.event_subids[i]
-
-                sql = 'SELECT event FROM events WHERE'
-                sql += ' branch={:} AND subbranch={:}'\
-                        .format(branch, subbranch)
-                event = self.execute(sql).fetchone()[0]
-
-                time = rfn.travel_times[i]
-                path = rfn.paths[i]
-
-                sql = 'INSERT INTO rays'
-                sql += '(event, sid, rid, time, path, model_line, vm_model)'
-                sql += " VALUES('{:}', {:}, {:}, {:}, '{:}', '{:}', '{:}')"\
-                        .format(event, sid, rid, time, path, model_line,
-                                vm_model)
-                self.execute(sql)
+                event = events[(branches[i], subbranches[i])]
+                rows.append((event, sids[i], rid, times[i],
+                             encode_raypath(paths[i], codec=codec),
+                             model_line, vm_model))
+
+        sql = 'INSERT INTO rays'
+        sql += '(event, sid, rid, time, path, model_line, vm_model)'
+        sql += ' VALUES(?, ?, ?, ?, ?, ?, ?)'
+        self.executemany(sql, rows)
 
         self.commit()
 